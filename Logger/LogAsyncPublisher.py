@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+
+import time
+import pika
+import threading
+from functools import partial
+from collections import deque
+from itertools import groupby, chain
+from LogPublisher import LogPublisher, LogDispatchException, routed
+from LogMetrics import PUBLISH_TIME, PUBLISHED, ACKED, NACKED, DROPPED
+
+
+# Publisher running a pika SelectConnection in its own thread. Messages are
+# handed over through an outbox and up to `window` of them can be waiting
+# for their delivery confirmation at the same time.
+class LogAsyncPublisher(LogPublisher):
+
+    def __init__(self, config, logger, flusher=True, routes=()):
+        super(LogAsyncPublisher, self).__init__(config, logger, flusher, routes)
+        self._window         = config.get('publisher_window', 1000)
+        self._max_retries    = config.get('publisher_max_retries', 5)
+        self._pump_interval  = 0.005
+        self._outbox         = deque()
+        self._unconfirmed    = {}
+        self._returned       = set()
+        self._delivery_tag   = 0
+        self._declaring      = None
+        self._dispatching    = set()
+        self._overflowing    = False
+        self._sequence       = 0
+        self._settling       = deque()
+        self._ready          = False
+        self._thread         = None
+        self._condition      = threading.Condition(self._lock)
+
+    def start(self):
+        self.dispatch()
+        if self._routes:
+            # The destinations of the filter file are checked on a blocking
+            # connection before the asynchronous one starts
+            self.connect()
+            try:
+                self.check()
+            finally:
+                self.disconnect()
+                self.reset()
+        self._stopping = False
+        self._closing = False
+        self._unavailable = True
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+        self.flusher_start()
+
+    def stop(self):
+        self.flusher_stop()
+        with self._condition:
+            self._stopping = True
+            self.flush()
+            deadline = time.time() + self._blocked_timeout
+            while (self._outbox or self._unconfirmed) and self._ready and time.time() < deadline:
+                self._condition.wait(0.1)
+            self._closing = True
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(self._blocked_timeout)
+        self._thread = None
+        with self._condition:
+            pending = [self._unconfirmed[tag] for tag in sorted(self._unconfirmed)] + list(self._outbox)
+            self._unconfirmed.clear()
+            self._outbox.clear()
+        if pending:
+            self._logger.warning('Stopping with %i unconfirmed messages' % len(pending))
+            if self._spool is not None:
+                for message in pending:
+                    self.spool(message)
+        if self._spool is not None or not pending:
+            self.confirm()
+        if self._spool is not None:
+            self._spool.close()
+
+    def reconnect(self):
+        # Reconnections are driven by the connection thread
+        pass
+
+    def run(self):
+        while not self._stopping:
+            self._logger.debug('Connecting: %s' % self._url)
+            credentials = pika.PlainCredentials(self._user, self._pass)
+            parameters = pika.ConnectionParameters(host=self._host, port=self._port, credentials=credentials, heartbeat_interval=self._heartbeat,
+                                                   blocked_connection_timeout=self._blocked_timeout)
+            try:
+                self._connection = pika.SelectConnection(parameters,
+                                                         on_open_callback=self.on_connection_open,
+                                                         on_open_error_callback=self.on_connection_open_error,
+                                                         on_close_callback=self.on_connection_closed,
+                                                         stop_ioloop_on_close=False)
+                self._connection.ioloop.start()
+            except Exception as e:
+                self._logger.warning('Connection failed: %r' % e)
+            if not self._stopping:
+                self._logger.warning('Reconnecting in %i seconds' % self._retry_delay)
+                time.sleep(self._retry_delay)
+                self._retry_delay = min(self._retry_delay * 2, 60)
+
+    def on_connection_open(self, connection):
+        self._logger.debug('Connection open callback')
+        connection.add_on_connection_blocked_callback(self.connection_blocked_callback)
+        connection.add_on_connection_unblocked_callback(self.connection_unblocked_callback)
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_connection_open_error(self, connection, error):
+        self._logger.warning('Connection open error: %r' % error)
+        connection.ioloop.stop()
+
+    def on_connection_closed(self, connection, reply_code, reply_text):
+        self._logger.debug('Connection close callback (%s %s)' % (reply_code, reply_text))
+        with self._condition:
+            self._ready = False
+            self._unavailable = True
+            self._channel = None
+            # Unconfirmed messages are sent again, in order, once reconnected
+            for tag in sorted(self._unconfirmed, reverse=True):
+                self._outbox.appendleft(self._unconfirmed.pop(tag))
+            self._returned.clear()
+            self._condition.notify_all()
+        connection.ioloop.stop()
+
+    def on_channel_open(self, channel):
+        self._logger.debug('Opening channel')
+        self._channel = channel
+        self._delivery_tag = 0
+        # Every destination is declared again on a new channel, the default
+        # one first
+        self.reset()
+        self._destination.channel = channel
+        self._declared.update([('exchange', self._exchange), ('queue', self._queue), ('binding', self._queue, self._exchange, self._topic)])
+        channel.add_on_close_callback(self.on_channel_closed)
+        channel.add_on_return_callback(self.on_return)
+        channel.confirm_delivery(self.on_delivery_confirmation)
+        self._logger.debug('Opening exchange: %s (%s)' % (self._exchange, self._exchange_type))
+        channel.exchange_declare(self.on_exchange_declared, exchange=self._exchange, exchange_type=self._exchange_type)
+
+    def on_channel_closed(self, channel, reply_code, reply_text):
+        self._logger.warning('Channel closed (%s %s)' % (reply_code, reply_text))
+        # A declaration the server refuses would be made again on every
+        # connection: the messages of its destination are dropped for a while
+        destination, self._declaring = self._declaring, None
+        if destination is not None:
+            with self._condition:
+                self.refuse(destination, (reply_code, reply_text))
+        if self._connection.is_open:
+            self._connection.close()
+
+    def on_exchange_declared(self, unused_frame):
+        self._logger.debug('Opening queue: %s' % self._queue)
+        self._channel.queue_declare(self.on_queue_declared, queue=self._queue, arguments=self.queue_arguments())
+
+    def on_queue_declared(self, unused_frame):
+        self._logger.debug('Binding queue "%s" to exchange "%s" with key "%s"' % (self._queue, self._exchange, self._topic))
+        self._channel.queue_bind(self.on_queue_bound, queue=self._queue, exchange=self._exchange, routing_key=self._topic)
+
+    def on_queue_bound(self, unused_frame):
+        with self._condition:
+            self._destination.ready = True
+            self._ready = True
+            self._unavailable = False
+            self._overflowing = False
+            self._retry_delay = 1
+        self._logger.info('Connected to %s:%s' % (self._host, self._port))
+        self.pump()
+
+    def pump(self):
+        # Runs in the connection thread: publishes from the outbox while the
+        # window allows it
+        dropped = False
+        with self._condition:
+            while self._outbox and self._ready and not self._blocked and len(self._unconfirmed) < self._window:
+                # Messages keep their order: the outbox waits for the
+                # declaration of the destination of the next one
+                destination = self._outbox[0]['destination']
+                if destination.refused_until > time.time():
+                    DROPPED.inc(len(self._outbox.popleft()['records']), 'refused')
+                    dropped = True
+                    continue
+                if not self.dispatched(destination):
+                    self.dispatch_start(destination)
+                    break
+                if not destination.ready:
+                    if destination.channel is None:
+                        self.declare(destination)
+                    break
+                message = self._outbox.popleft()
+                self._delivery_tag += 1
+                self._unconfirmed[self._delivery_tag] = message
+                message['sent'] = time.time()
+                self._logger.debug('Sending message: %s', message['body'])
+                self._channel.basic_publish(destination.exchange, destination.topic, message['body'],
+                                            pika.BasicProperties(content_type=message['content_type'], content_encoding=message['content_encoding'], delivery_mode=1,
+                                                                 priority=message['lane'] if self._amqp_priority else None,
+                                                                 message_id=str(self._delivery_tag)),
+                                            mandatory=True)
+                PUBLISHED.inc()
+                self._message_number += 1
+            self._condition.notify_all()
+            if self._stopping and (self._closing or not (self._outbox or self._unconfirmed)):
+                self._connection.close()
+                return
+        if dropped:
+            self.confirm()
+        if self._ready:
+            self._connection.add_timeout(self._pump_interval, self.pump)
+
+    def dispatched(self, destination):
+        with LogPublisher._dispatched_lock:
+            return (self._host, self._port) + destination.key in LogPublisher._dispatched
+
+    def dispatch_start(self, destination):
+        # The dispatch RPC blocks for up to dispatch_timeout on every retry:
+        # it is made in a thread of its own, and the connection thread
+        # publishes to the destination once it is cached
+        if destination in self._dispatching:
+            return
+        self._dispatching.add(destination)
+        thread = threading.Thread(target=self.dispatch_run, args=(destination,))
+        thread.daemon = True
+        thread.start()
+
+    def dispatch_run(self, destination):
+        try:
+            self.dispatch(destination)
+            failed = None
+        except LogDispatchException as e:
+            failed = e
+        with self._condition:
+            self._dispatching.discard(destination)
+            if failed is not None:
+                self._logger.warning('Opening destination %r failed: %r' % (destination.key, failed))
+                messages = [message for message in self._outbox if message['destination'] is destination]
+                self._outbox = deque(message for message in self._outbox if message['destination'] is not destination)
+                for message in messages:
+                    if self._spool is not None:
+                        self.spool(message)
+                    else:
+                        DROPPED.inc(len(message['records']), 'dispatch')
+            self._condition.notify_all()
+        if failed is not None:
+            self.confirm()
+
+    def declare(self, destination):
+        # Runs in the connection thread. The declarations of the destination
+        # missing on this channel are made in turn.
+        steps = []
+        if ('exchange', destination.exchange) not in self._declared:
+            steps.append((('exchange', destination.exchange), self._channel.exchange_declare,
+                          dict(exchange=destination.exchange, exchange_type=destination.exchange_type)))
+        if ('queue', destination.queue) not in self._declared:
+            steps.append((('queue', destination.queue), self._channel.queue_declare, dict(queue=destination.queue, arguments=self.queue_arguments())))
+        if ('binding', destination.queue, destination.exchange, destination.topic) not in self._declared:
+            steps.append((('binding', destination.queue, destination.exchange, destination.topic), self._channel.queue_bind,
+                          dict(queue=destination.queue, exchange=destination.exchange, routing_key=destination.topic)))
+        self._logger.debug('Opening destination: %r' % (destination.key,))
+        destination.channel = self._channel
+        self._declaring = destination
+        self.declare_next(destination, steps)
+
+    def declare_next(self, destination, steps, unused_frame=None):
+        if not steps:
+            with self._condition:
+                destination.ready = True
+                self._declaring = None
+            return
+        key, method, arguments = steps.pop(0)
+        # Channel methods are handled in order: later declarations of the
+        # same exchange or queue can count on this one
+        self._declared.add(key)
+        method(partial(self.declare_next, destination, steps), **arguments)
+
+    def on_return(self, channel, method, properties, body):
+        # A returned message is still acknowledged afterwards
+        self._logger.debug('Channel return callback: %s' % method.reply_text)
+        with self._condition:
+            self._returned.add(int(properties.message_id))
+
+    def on_delivery_confirmation(self, method_frame):
+        confirmation_type = method_frame.method.NAME.split('.')[1].lower()
+        tag = method_frame.method.delivery_tag
+        with self._condition:
+            if method_frame.method.multiple:
+                tags = [unconfirmed for unconfirmed in self._unconfirmed if unconfirmed <= tag]
+            else:
+                tags = [tag] if tag in self._unconfirmed else []
+            for tag in sorted(tags):
+                message = self._unconfirmed.pop(tag)
+                if confirmation_type == 'ack' and tag not in self._returned:
+                    self._acked += 1
+                    ACKED.inc()
+                    PUBLISH_TIME.observe(time.time() - message['sent'])
+                else:
+                    self._nacked += 1
+                    NACKED.inc()
+                    self._returned.discard(tag)
+                    self.retry(message)
+            self._condition.notify_all()
+        self.confirm()
+
+    def delivered(self, callback):
+        # Once the messages enqueued so far are confirmed or spooled
+        with self._condition:
+            self._settling.append((self._sequence, callback))
+        self.confirm()
+
+    def confirm(self):
+        with self._condition:
+            if not self._settling:
+                return
+            # Messages sent again keep their place
+            oldest = min([message['sequence'] for message in chain(self._outbox, self._unconfirmed.values())] or [self._sequence + 1])
+            callbacks = []
+            while self._settling and self._settling[0][0] < oldest:
+                callbacks.append(self._settling.popleft()[1])
+        for callback in callbacks:
+            callback()
+
+    def retry(self, message):
+        message['attempts'] += 1
+        if message['attempts'] <= self._max_retries:
+            self._outbox.appendleft(message)
+            return
+        self._logger.warning('Message rejected %i times' % message['attempts'])
+        if self._spool is not None:
+            self.spool(message)
+
+    def spool(self, message):
+        for record in message['records']:
+            self._spool.append(record if message['route'] is None and not message['lane'] else (message['route'], record, message['lane']))
+
+    def enqueue(self, message):
+        # Messages of higher lanes go before the ones of lower lanes
+        if not message['lane']:
+            self._outbox.append(message)
+            return
+        index = next((index for index, queued in enumerate(self._outbox) if queued['lane'] < message['lane']), len(self._outbox))
+        self._outbox.rotate(-index)
+        self._outbox.appendleft(message)
+        self._outbox.rotate(index)
+
+    def deliver(self, records, route=None, lane=0):
+        # Destinations are dispatched by the connection thread
+        destination = self.destination(route)
+        with self._condition:
+            # Without batching there is a message per record
+            for index, (body, content_type, content_encoding) in enumerate(self.encode(records)):
+                message_records = [records[index]] if self._batch_size <= 1 else records
+                if not self.wait_room():
+                    DROPPED.inc(len(message_records), 'unavailable')
+                    continue
+                self._sequence += 1
+                self.enqueue({'sequence': self._sequence, 'body': body, 'content_type': content_type, 'content_encoding': content_encoding, 'attempts': 0, 'sent': None,
+                              'records': message_records, 'route': route, 'lane': lane, 'destination': destination})
+
+    def wait_room(self):
+        # Waits for room in the outbox while the server is connected. Without
+        # a spool, messages that find it full while the server is unavailable
+        # are dropped rather than blocking the sender until it is back.
+        while len(self._outbox) >= self._window and not self._stopping:
+            if self._unavailable and self._spool is None:
+                if not self._overflowing:
+                    self._logger.warning('Server unavailable and %i messages waiting. Dropping messages' % len(self._outbox))
+                    self._overflowing = True
+                return False
+            self._condition.wait(0.1)
+        return True
+
+    def recover(self, drain=True):
+        # Spooled records are moved to the outbox once the server is
+        # available again
+        if self._spool is None or not drain:
+            return
+        while self._ready and not self._blocked and not self._spool.empty() and len(self._outbox) < self._window:
+            messages = self._spool.peek(max(self._batch_size, 1))
+            for (route, lane), group in groupby(messages, lambda message: routed(message)[::2]):
+                self.deliver([routed(message)[1] for message in group], route, lane)
+            self._spool.commit()
+
+    def depth(self):
+        return len(self._outbox) + len(self._unconfirmed)
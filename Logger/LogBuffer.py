@@ -1,36 +1,261 @@
 #!/usr/bin/env python
-import os, re, json, logging
-from LogFilter import LogFilter, LogFilterSet, LogSkipException
+import re, time, codecs, logging
+from collections import deque, defaultdict
+from LogFilter import LogFilterSet, LogSkipException
+from LogMetrics import LINES_READ, RECORDS_READ, LINES_MATCHED, LINES_SKIPPED, LINES_SUPPRESSED, DROPPED, PROCESS_TIME
 
 
 class LogBuffer():
 
-    def __init__(self, filters):
-        self.temp = ''
-        self.filters = LogFilterSet(filters)
-        self.stack = []
+    def __init__(self, filters, maxlen=None, max_line_length=None, max_line_policy='split', encoding='utf-8', errors='replace', name=None,
+                 multiline_start=None, multiline_continue=None, multiline_max_lines=500, multiline_max_bytes=65536, multiline_timeout=1):
+        self.name = name
+        self.temp = []
+        self.temp_length = 0
+        # A LogFilterSet can be shared by the buffers of several files
+        self.filters = filters if isinstance(filters, LogFilterSet) else LogFilterSet(filters, encoding, errors)
+        self.stack = deque(maxlen=maxlen)
+        self.dropped = 0
+        self.max_line_length = max_line_length
+        self.max_line_policy = max_line_policy
+        self.truncating = False
+        self.split = False
+        # Oversized UTF-8 lines are cut at a character boundary
+        self.utf8 = codecs.lookup(encoding).name == 'utf-8'
+        self.lines = 0
+        self.matched = defaultdict(int)
+        self.skipped = 0
+        if self.max_line_policy not in ('split', 'truncate'):
+            raise ValueError('Unknown max line policy: %s' % self.max_line_policy)
+        # Multiline records: lines are held in self.record until a line that
+        # does not continue it arrives, a limit is reached or it times out
+        if multiline_start and multiline_continue:
+            raise ValueError('Only one of multiline_start and multiline_continue can be set')
+        self.multiline_start = self.compile(multiline_start, encoding)
+        self.multiline_continue = self.compile(multiline_continue, encoding)
+        self.multiline = self.multiline_start is not None or self.multiline_continue is not None
+        self.multiline_max_lines = multiline_max_lines
+        self.multiline_max_bytes = multiline_max_bytes
+        self.multiline_timeout = multiline_timeout
+        self.record = []
+        self.record_bytes = 0
+        self.record_raw = 0
+        self.record_updated = None
+        # Consecutive identical lines of a collapse filter:
+        # [filter, string, count, first, last, raw bytes, match]
+        self.collapsed = None
+        self.suppressed = defaultdict(int)
+        self.limited = defaultdict(int)
 
-    def append(self, string):
+    def compile(self, pattern, encoding):
+        if not pattern:
+            return None
+        return re.compile(pattern if isinstance(pattern, bytes) else pattern.encode(encoding))
+
+    def append(self, string, raw=0):
+        filter, string, match = self.filters.match(string)
+        self.matched[filter.pattern] += 1
+        if filter.collapse:
+            collapsed = self.collapsed
+            if collapsed is not None and collapsed[0] is filter and collapsed[1] == string:
+                collapsed[2] += 1
+                collapsed[4] = time.time()
+                collapsed[5] += raw
+                return
+            self.uncollapse()
+            now = time.time()
+            self.collapsed = [filter, string, 1, now, now, raw, match]
+            return
+        self.uncollapse()
+        self.emit(filter, string, None, match)
+
+    def uncollapse(self):
+        if self.collapsed is not None:
+            filter, string, count, first, last, raw, match = self.collapsed
+            self.collapsed = None
+            if count > 1:
+                self.suppressed[(filter.pattern, 'collapse')] += count - 1
+            self.emit(filter, string, (count, first, last) if count > 1 else None, match)
+
+    def emit(self, filter, string, repeated=None, match=None):
+        reason = filter.admit()
+        if reason is not None:
+            self.suppressed[(filter.pattern, reason)] += 1
+            if reason == 'rate':
+                if not self.limited[filter.pattern]:
+                    logging.warning("Filter {0} exceeded its rate limit of {1} lines/s. Suppressing lines".format(filter.pattern, filter.rate_limit))
+                self.limited[filter.pattern] += 1
+            return
+        if self.limited.get(filter.pattern):
+            logging.warning("Filter {0} suppressed {1} lines over its rate limit".format(filter.pattern, self.limited.pop(filter.pattern)))
         try:
-            self.stack.append(self.filters.apply(string))
+            record = filter.serialize(string, repeated, match)
         except LogSkipException as skip:
-            logging.debug(str(skip))
+            self.skipped += 1
+            logging.debug('%s', skip)
+            return
+        if self.stack.maxlen is not None and len(self.stack) == self.stack.maxlen:
+            self.dropped += 1
+            DROPPED.inc(1, 'buffer')
+            logging.warning("Buffer full ({0} records). Dropping oldest record ({1} dropped)".format(self.stack.maxlen, self.dropped))
+        self.stack.append((filter.route, record, filter.priority) if filter.tagged else record)
 
     def push(self, string):
-        self.temp += string
-        lines = self.temp.splitlines(True)
-        while lines:
-            line = lines.pop(0)
-            if not line.endswith(os.linesep): 
-                self.temp = line
+        # Only the new chunk (raw bytes) is scanned for line boundaries. The
+        # pending (incomplete) line is kept as a list of fragments and
+        # joined once.
+        started = time.time()
+        start = 0
+        end = string.find(b'\n')
+        while end != -1:
+            self.pend(string[start:end])
+            self.complete()
+            start = end + 1
+            end = string.find(b'\n', start)
+        if start < len(string):
+            self.pend(string[start:])
+        PROCESS_TIME.observe(time.time() - started)
+        self.report()
+
+    def report(self):
+        # Metrics are accumulated locally and published once per chunk.
+        # Lines are counted as read, records as filtered.
+        if self.lines:
+            LINES_READ.inc(self.lines, self.name)
+            self.lines = 0
+        if self.matched:
+            RECORDS_READ.inc(sum(self.matched.values()), self.name)
+            for pattern, count in self.matched.items():
+                LINES_MATCHED.inc(count, self.name, pattern)
+            self.matched.clear()
+        if self.skipped:
+            LINES_SKIPPED.inc(self.skipped, self.name)
+            self.skipped = 0
+        if self.suppressed:
+            for (pattern, reason), count in self.suppressed.items():
+                LINES_SUPPRESSED.inc(count, self.name, pattern, reason)
+            self.suppressed.clear()
+
+    def pend(self, fragment):
+        if self.truncating:
+            return
+        self.temp.append(fragment)
+        self.temp_length += len(fragment)
+        if self.max_line_length and self.temp_length > self.max_line_length:
+            self.oversized()
+
+    def oversized(self):
+        # Lines longer than max_line_length are either split in several
+        # records or truncated, discarding everything up to the next newline
+        line = b''.join(self.temp)
+        self.release()
+        while len(line) > self.max_line_length:
+            cut = self.boundary(line)
+            if self.max_line_policy == 'truncate':
+                logging.debug("Truncating line longer than %s", self.max_line_length)
+                self.append(line[:cut].rstrip(), cut)
+                self.truncating = True
+                line = b''
                 break
-            self.temp = ''
-            self.append(line.rstrip())
+            # Only the last part of a line is stripped, in complete()
+            self.append(line[:cut], cut)
+            line = line[cut:]
+            self.split = True
+        self.temp = [line] if line else []
+        self.temp_length = len(line)
+
+    def boundary(self, line):
+        # Steps back over the continuation bytes (0x80-0xBF) of a UTF-8
+        # character straddling max_line_length
+        cut = self.max_line_length
+        if self.utf8:
+            while cut > max(self.max_line_length - 3, 1) and b'\x80' <= line[cut:cut + 1] <= b'\xbf':
+                cut -= 1
+        return cut
+
+    def complete(self):
+        line = b''.join(self.temp)
+        raw = self.temp_length + 1
+        self.temp = []
+        self.temp_length = 0
+        self.lines += 1
+        line = line.rstrip()
+        if self.truncating or (self.split and not line):
+            self.truncating = self.split = False
+            return
+        self.split = False
+        if self.multiline:
+            self.collect(line, raw)
+        else:
+            self.append(line, raw)
+
+    def continues(self, line):
+        if self.multiline_start is not None:
+            return self.multiline_start.match(line) is None
+        return self.multiline_continue.match(line) is not None
+
+    def collect(self, line, raw):
+        # Continuation lines are merged into the held record, which is only
+        # filtered and serialized once complete
+        if self.record and self.continues(line) and len(self.record) < self.multiline_max_lines and \
+                self.record_bytes + 1 + len(line) <= self.multiline_max_bytes:
+            self.record.append(line)
+            self.record_bytes += 1 + len(line)
+        else:
+            self.release()
+            self.record = [line]
+            self.record_bytes = len(line)
+        self.record_raw += raw
+        self.record_updated = time.time()
+
+    def release(self):
+        if self.record:
+            record = b'\n'.join(self.record)
+            raw = self.record_raw
+            self.record = []
+            self.record_bytes = 0
+            self.record_raw = 0
+            self.append(record, raw)
+
+    def holding(self):
+        return bool(self.record) or self.collapsed is not None
+
+    def deadline(self):
+        # Seconds until a held record has to be released
+        deadlines = []
+        if self.record:
+            deadlines.append(self.record_updated + self.multiline_timeout)
+        if self.collapsed is not None:
+            deadlines.append(self.collapsed[3] + self.collapsed[0].collapse_window)
+        return max(min(deadlines) - time.time(), 0) if deadlines else None
+
+    def expire(self):
+        # Releases a multiline record once no line was added for
+        # multiline_timeout, and collapsed lines once collapse_window passed
+        now = time.time()
+        if self.record and now - self.record_updated >= self.multiline_timeout:
+            self.release()
+        if self.collapsed is not None and now - self.collapsed[3] >= self.collapsed[0].collapse_window:
+            self.uncollapse()
+        self.report()
+
+    def pending(self):
+        # Bytes read but not sent yet: the incomplete line and the held
+        # records
+        return self.temp_length + self.record_raw + (self.collapsed[5] if self.collapsed is not None else 0)
+
+    def flush(self):
+        # Completes the pending line, e.g. the last line of a rotated file
+        if self.temp:
+            self.complete()
+        self.release()
+        self.uncollapse()
+        self.report()
+        self.truncating = self.split = False
 
     def empty(self):
         return not self.stack
 
     def pop(self):
         if self.stack:
-            return self.stack.pop(0)
-
+            return self.stack.popleft()
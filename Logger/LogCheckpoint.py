@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import logging
+import threading
+
+
+class LogCheckpointStore(object):
+
+    def __init__(self, path, interval=5, sources=()):
+        self.path       = path
+        self.interval   = interval
+        self.offsets    = {}
+        self.dirty      = False
+        self.saved      = time.time()
+        self.lock       = threading.Lock()
+        # Checkpoints written by other processes (e.g. before the files were
+        # sharded across a different number of workers) are merged with this
+        # store, which may be older: the furthest offset of a file wins
+        for source in list(sources) + [self.path]:
+            for path, checkpoint in self.load(source).items():
+                current = self.offsets.get(path)
+                if current is None or (current['inode'], current['device']) != (checkpoint['inode'], checkpoint['device']) \
+                        or current['offset'] < checkpoint['offset']:
+                    self.offsets[path] = checkpoint
+
+    def load(self, path):
+        if not os.path.isfile(path):
+            return {}
+        try:
+            with open(path, 'r') as stream:
+                offsets = json.load(stream)
+            logging.debug("Action: Load checkpoints. File {0}".format(path))
+            return offsets
+        except ValueError as e:
+            logging.warning("Ignoring corrupted checkpoint file {0}: {1}".format(path, e))
+            return {}
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            temp = self.path + '.tmp'
+            with open(temp, 'w') as stream:
+                json.dump(self.offsets, stream)
+                stream.flush()
+                os.fsync(stream.fileno())
+            os.rename(temp, self.path)
+            self.dirty = False
+            self.saved = time.time()
+        logging.debug("Action: Save checkpoints. File {0}".format(self.path))
+
+    def resume(self, path, stat):
+        # Returns the offset to start reading from. A different inode or
+        # device means the file was rotated or recreated, and a file smaller
+        # than the checkpoint was truncated: both are read from the start.
+        with self.lock:
+            checkpoint = self.offsets.get(path)
+        if checkpoint is None:
+            return 0
+        if checkpoint['inode'] != stat.st_ino or checkpoint['device'] != stat.st_dev:
+            logging.info("File {0} was rotated. Reading from the beginning".format(path))
+            return 0
+        if stat.st_size < checkpoint['offset']:
+            logging.info("File {0} was truncated. Reading from the beginning".format(path))
+            return 0
+        logging.info("Resuming file {0} at offset {1}".format(path, checkpoint['offset']))
+        return checkpoint['offset']
+
+    def update(self, path, stat, offset):
+        with self.lock:
+            self.offsets[path] = {'inode': stat.st_ino, 'device': stat.st_dev, 'offset': offset}
+            self.dirty = True
+        if time.time() - self.saved >= self.interval:
+            self.save()
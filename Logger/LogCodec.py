@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+
+import zlib
+import struct
+
+# Minimal MessagePack packer for the types found in filter attributes
+# (https://github.com/msgpack/msgpack/blob/master/spec.md). Strings are
+# always packed as str, even byte strings read from ASCII lines.
+
+try:
+    TEXT = (str, unicode)
+except NameError:
+    TEXT = (str, bytes)
+
+def pack_string(string):
+    data = string if isinstance(string, bytes) else string.encode('utf-8')
+    length = len(data)
+    if length < 32:
+        return struct.pack('>B', 0xa0 | length) + data
+    if length < 0x100:
+        return struct.pack('>BB', 0xd9, length) + data
+    if length < 0x10000:
+        return struct.pack('>BH', 0xda, length) + data
+    return struct.pack('>BI', 0xdb, length) + data
+
+def map_header(length):
+    if length < 16:
+        return struct.pack('>B', 0x80 | length)
+    if length < 0x10000:
+        return struct.pack('>BH', 0xde, length)
+    return struct.pack('>BI', 0xdf, length)
+
+def array_header(length):
+    if length < 16:
+        return struct.pack('>B', 0x90 | length)
+    if length < 0x10000:
+        return struct.pack('>BH', 0xdc, length)
+    return struct.pack('>BI', 0xdd, length)
+
+def pack(value):
+    if value is None:
+        return b'\xc0'
+    if value is True:
+        return b'\xc3'
+    if value is False:
+        return b'\xc2'
+    if isinstance(value, TEXT):
+        return pack_string(value)
+    if isinstance(value, float):
+        return struct.pack('>Bd', 0xcb, value)
+    if isinstance(value, (int, type(2 ** 64))):
+        if 0 <= value < 128:
+            return struct.pack('>B', value)
+        if -32 <= value < 0:
+            return struct.pack('>b', value)
+        if value >= 2 ** 63:
+            return struct.pack('>BQ', 0xcf, value)
+        return struct.pack('>Bq', 0xd3, value)
+    if isinstance(value, (list, tuple)):
+        return array_header(len(value)) + b''.join(pack(item) for item in value)
+    if isinstance(value, dict):
+        return map_header(len(value)) + b''.join(pack(key) + pack(item) for key, item in value.items())
+    raise TypeError('Can not pack %r' % (value,))
+
+
+def gzip_compressor(level):
+    # zlib with a gzip header, the same as the gzip module
+    level = 6 if level is None else level
+    def compress(data):
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        return compressor.compress(data) + compressor.flush()
+    return compress
+
+def zstd_compressor(level):
+    import zstandard
+    return zstandard.ZstdCompressor(level=3 if level is None else level).compress
+
+COMPRESSORS = {'gzip': gzip_compressor, 'zstd': zstd_compressor}
+
+def compressor(name, level=None):
+    # Returns a function compressing bytes, or None for 'none'
+    if name in (None, 'none'):
+        return None
+    if name not in COMPRESSORS:
+        raise ValueError('Unknown compression: %s' % name)
+    return COMPRESSORS[name](level)
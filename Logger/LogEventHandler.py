@@ -1,61 +1,331 @@
 #!/usr/bin/env python
-import os.path, logging
+import os.path, time, json, logging, threading
 from LogFileHandler import LogFileHandler
-from watchdog.events import PatternMatchingEventHandler
+from LogFilter import LogFilter
+from LogRule import LogRule
+from LogPoller import LogPoller
+from watchdog.events import FileSystemEventHandler, FileModifiedEvent
 
 
 
-class LogEventHandler(PatternMatchingEventHandler):
-    def __init__(self, path, filters, publisher, patterns=None, ignore_patterns=None, ignore_directories=False, case_sensitive=False):
-        self._patterns           = patterns
-        self._ignore_patterns    = ignore_patterns
-        self._ignore_directories = ignore_directories
-        self._case_sensitive     = case_sensitive
-        self.file                = LogFileHandler(path, filters)
+# A single handler is scheduled once per watched directory. Events are routed
+# through a table from path to LogFileHandler, so the cost of an event does
+# not depend on the number of rules. Paths that match no rule are kept in the
+# table as None, and entries of closed files are evicted once idle.
+#
+# Rotated files are never dropped with unread data: when a file is moved or
+# deleted its descriptor stays open and is drained, and it is drained again
+# to EOF before switching to the new file created at the same path.
+#
+# Rules can be replaced while running (reload): the files of unchanged rules
+# keep their handler, descriptor and position.
+class LogEventHandler(FileSystemEventHandler):
+    def __init__(self, observer, publisher, checkpoints=None, read_budget=None, idle_timeout=300, poll_min_interval=0.5, poll_max_interval=30):
+        self.observer            = observer
         self.publisher           = publisher
+        self.checkpoints         = checkpoints
+        self.read_budget         = read_budget
+        self.idle_timeout        = idle_timeout
+        self.rules               = []
+        self.files               = {}
+        self.owners              = {}
+        self.unmatched           = set()
+        self.seen                = {}
+        self.watches             = {}
+        self.swept               = time.time()
+        self.poller              = None
+        self.poll_intervals      = (poll_min_interval, poll_max_interval)
 
-        self.publish()
+        super(LogEventHandler, self).__init__()
 
-        super(LogEventHandler, self).__init__(  patterns=self._patterns, 
-                                                ignore_patterns=self._ignore_patterns,
-                                                ignore_directories=self._ignore_directories, 
-                                                case_sensitive=self._case_sensitive )
+    def stop(self):
+        # The poller queues events to the observer: it is stopped first
+        if self.poller is not None:
+            self.poller.stop()
+
+    def dispatch(self, event):
+        if isinstance(event, LogReloadEvent):
+            self.apply(event.rules)
+        else:
+            super(LogEventHandler, self).dispatch(event)
+
+    def reload(self, rules):
+        # Once the observer runs, the rules are replaced by its thread, in
+        # order with the events
+        if self.watches and self.observer.is_alive():
+            self.queue(LogReloadEvent(rules))
+        else:
+            self.apply(rules)
+
+    def apply(self, rules):
+        # rules are (pattern, filter attributes, options) in the order of the
+        # filter file. Only the filters of new or changed rules are compiled,
+        # and only the files of removed and added rules are matched again, so
+        # the cost does not depend on the number of files followed.
+        current = dict((rule.key, rule) for rule in self.rules)
+        ordered, added = [], []
+        for pattern, filters, options in rules:
+            key = json.dumps([pattern, filters, options], sort_keys=True, default=str)
+            rule = current.pop(key, None)
+            if rule is None:
+                logging.info("Remotelogger observing pattern: {path}".format(path=pattern))
+                rule = LogRule(pattern, [LogFilter(dict(afilter)) for afilter in filters], key, **options)
+                added.append(rule)
+            ordered.append(rule)
+        self.rules = ordered
+        for rule in current.values():
+            logging.info("Remotelogger no longer observing pattern: {path}".format(path=rule.pattern))
+            if rule.poll:
+                self.poller.remove_rule(rule)
+            for path in list(rule.paths):
+                self.rematch(path)
+        for rule in added:
+            self.add(rule)
+        self.unschedule()
+
+    def add(self, rule):
+        # Paths that matched no rule may match the new one
+        for path in [path for path in self.unmatched if rule.match(path)]:
+            self.detach(path)
+        self.schedule(rule.directory, rule.recursive)
+        if rule.poll:
+            if self.poller is None:
+                self.poller = LogPoller(self, *self.poll_intervals)
+            logging.info("Polling pattern: {path}".format(path=rule.pattern))
+            self.poller.add_rule(rule)
+        for path in rule.discover():
+            # Files of a later rule go to the new one
+            if path in self.owners:
+                self.rematch(path)
+            self.publish(path)
+
+    def rematch(self, path):
+        # Hands a file over to the first rule matching it, if it changed. The
+        # descriptor and position are kept and the data pending in the buffer
+        # is read again with the new filters.
+        owner = self.owners.get(path)
+        rule = next((rule for rule in self.rules if rule.match(path)), None)
+        if rule is owner:
+            return
+        file = self.detach(path)
+        if self.poller is not None and (rule is None or not rule.poll):
+            self.poller.discard(path)
+        if rule is None:
+            logging.info("Remotelogger no longer observing file: {path}".format(path=path))
+            file.close()
+            return
+        logging.info("File {0} is now filtered by pattern: {1}".format(path, rule.pattern))
+        file.reconfigure(rule.filters, **rule.options)
+        self.attach(path, file, rule)
+        if rule.poll:
+            self.poller.track(path)
+
+    def attach(self, path, file, rule):
+        self.files[path] = file
+        if file is None:
+            self.unmatched.add(path)
+        else:
+            self.owners[path] = rule
+            rule.paths.add(path)
+
+    def detach(self, path):
+        rule = self.owners.pop(path, None)
+        if rule is not None:
+            rule.paths.discard(path)
+        self.unmatched.discard(path)
+        return self.files.pop(path, None)
+
+    def schedule(self, directory, recursive):
+        for watched, (watch, watched_recursive) in self.watches.items():
+            if watched == directory and (watched_recursive or not recursive):
+                return
+            if watched_recursive and directory.startswith(watched.rstrip('/') + '/'):
+                return
+        if directory in self.watches:
+            self.observer.unschedule(self.watches[directory][0])
+        logging.info("Remotelogger observing directory: {path}{recursive}".format(path=directory, recursive=' (recursive)' if recursive else ''))
+        self.watches[directory] = (self.observer.schedule(self, path=directory, recursive=recursive), recursive)
+
+    def unschedule(self):
+        # Watches no rule needs any more
+        for directory, (watch, recursive) in list(self.watches.items()):
+            if not any(rule.directory == directory or (recursive and rule.directory.startswith(directory.rstrip('/') + '/')) for rule in self.rules):
+                logging.info("Remotelogger no longer observing directory: {path}".format(path=directory))
+                self.observer.unschedule(watch)
+                del self.watches[directory]
+
+    def lookup(self, path):
+        self.seen[path] = time.time()
+        try:
+            return self.files[path]
+        except KeyError:
+            pass
+        file, owner = None, None
+        for rule in self.rules:
+            if rule.match(path):
+                logging.info("Remotelogger observing file: {path}".format(path=path))
+                file, owner = LogFileHandler(path, rule.filters, self.checkpoints, **rule.options), rule
+                if rule.poll:
+                    self.poller.track(path)
+                break
+        self.attach(path, file, owner)
+        return file
+
+    def sweep(self):
+        now = time.time()
+        if now - self.swept < min(self.idle_timeout, 60):
+            return
+        self.swept = now
+        for path, file in list(self.files.items()):
+            if now - self.seen.get(path, 0) >= self.idle_timeout and (file is None or not file.is_open() or not os.path.exists(path)):
+                logging.debug("Action: Evict. File {0}".format(path))
+                if file is not None:
+                    file.close()
+                self.detach(path)
+                self.seen.pop(path, None)
+                if self.poller is not None:
+                    self.poller.discard(path)
 
     def on_moved(self, event):
-        super(LogEventHandler, self).on_moved(event)
         logging.debug("Event: move. Origin: {0} Destiny: {1}".format(event.src_path, event.dest_path))
-        self.file.close()
-        self.stop()
-        super(LogEventHandler, self).__init__( patterns=[event.dest_path],
-                                          ignore_patterns=self._ignore_patterns,
-                                          ignore_directories=self._ignore_directories,
-                                          case_sensitive=self._case_sensitive)
-        self.file.path = event.dest_path
-        self.file.open()
-        self.start(dir=os.path.split(event.dest_path)[0], recursive=False)
+        if event.is_directory:
+            self.discover(event.dest_path)
+            return
+        file = self.files.get(event.src_path)
+        if file is not None and file.is_open():
+            self.exhaust(file)
+            if self.files.get(event.dest_path) is None and any(rule.match(event.dest_path) for rule in self.rules):
+                # The file keeps the filters of its rule
+                rule = self.owners.get(event.src_path)
+                self.detach(event.src_path)
+                self.detach(event.dest_path)
+                file.move(event.dest_path)
+                self.attach(event.dest_path, file, rule)
+        if self.lookup(event.dest_path) is not None:
+            self.publish(event.dest_path)
+        self.sweep()
 
     def on_created(self, event):
-        super(LogEventHandler, self).on_created(event)
         logging.debug("Event: create. File: {0}".format(event.src_path))
-        if not self.file.is_open():
-            self.file.open()
-        
+        if event.is_directory:
+            self.discover(event.src_path)
+            return
+        file = self.lookup(event.src_path)
+        if file is not None:
+            if not file.is_open():
+                file.open()
+            self.publish(event.src_path)
+        self.sweep()
+
     def on_deleted(self, event):
-        super(LogEventHandler, self).on_deleted(event)
         logging.debug("Event: delete. File: {0}".format(event.src_path))
-        self.file.close()
+        file = self.files.get(event.src_path)
+        if file is not None and file.is_open():
+            self.exhaust(file)
+        self.sweep()
 
     def on_modified(self, event):
-        super(LogEventHandler, self).on_modified(event)
-        logging.debug("Event: modify. File: {0}".format(event.src_path))
-        self.publish()
-
-    def publish(self):
-        if(self.file.is_open()):
-            self.file.tail()
-        buffer = self.file.get_buffer()
+        if event.is_directory:
+            return
+        logging.debug("Event: modify. File: %s", event.src_path)
+        if self.lookup(event.src_path) is not None:
+            self.publish(event.src_path)
+        self.sweep()
+
+    def discover(self, directory):
+        # Files created with a new directory, before it was watched
+        for rule in self.rules:
+            if rule.covers(directory):
+                for path in rule.discover(directory):
+                    self.publish(path)
+
+    def publish(self, path):
+        # The file is read chunk by chunk, sending the records of every chunk
+        # before reading the next one. Once read_budget is exhausted, the
+        # rest of the file is left for a new event queued behind the pending
+        # ones, so other files keep making progress.
+        file = self.lookup(path)
+        if file is None:
+            return
+        rotation = file.rotation()
+        if rotation == 'rename':
+            self.exhaust(file)
+        if rotation is not None:
+            file.rotate(rotation)
+            self.drain(file)
+        budget = self.read_budget
+        while file.is_open():
+            read = file.tail()
+            self.drain(file)
+            if not read:
+                break
+            if budget is not None and self.watches:
+                budget -= read
+                if budget <= 0:
+                    self.queue(FileModifiedEvent(path))
+                    break
+        self.hold(file)
+        self.drain(file)
+        file.checkpoint(self.publisher)
+
+    def hold(self, file):
+        # A record held at the end of the file (multiline or collapsed lines)
+        # is released by a later event once it times out
+        buffer = file.get_buffer()
+        buffer.expire()
+        if buffer.holding() and file.timer is None:
+            file.timer = threading.Timer(buffer.deadline(), self.timeout, [file])
+            file.timer.daemon = True
+            file.timer.start()
+
+    def timeout(self, file):
+        file.timer = None
+        self.queue(FileModifiedEvent(file.path))
+
+    def queue(self, event):
+        # Events are handled in order by the observer thread, like the ones
+        # of the watches
+        if self.watches:
+            self.observer.event_queue.put((event, next(iter(self.watches.values()))[0]))
+
+    def exhaust(self, file):
+        # Reads the file to EOF, whatever the read budget
+        while file.tail():
+            self.drain(file)
+        self.drain(file)
+        file.checkpoint(self.publisher)
+
+    def drain(self, file):
+        buffer = file.get_buffer()
         while not buffer.empty():
             self.publisher.send(buffer.pop())
 
 
+class LogReloadEvent(object):
+    # Queued to the observer like the file system events
+    event_type   = 'reload'
+    is_directory = False
+    src_path     = ''
+
+    def __init__(self, rules):
+        self.rules = rules
+        # Compared to the previous event by the queue of the observer, that
+        # skips repeated events
+        self.key   = (self.event_type, id(self))
+
+
+# Calls reload when the filter file is written, or replaced by a rename as
+# most editors do
+class LogFilterFileHandler(FileSystemEventHandler):
+    def __init__(self, path, reload):
+        self.path   = path
+        self.reload = reload
+
+        super(LogFilterFileHandler, self).__init__()
 
+    def on_any_event(self, event):
+        # Reading the file is an event too on recent watchdog versions
+        if event.is_directory or event.event_type not in ('created', 'modified', 'moved'):
+            return
+        if self.path in (event.src_path, getattr(event, 'dest_path', None)):
+            self.reload()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import re
+import math
+import time
+from collections import OrderedDict
+
+# Converters of the fields extracted from the named groups of a filter:
+# 'str', 'int', 'float', 'timestamp' or 'timestamp:<strptime format>'.
+# Values that can not be converted, and NaN or infinite numbers, which JSON
+# can not represent, are sent as null.
+
+TIMESTAMP_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S', '%Y/%m/%d %H:%M:%S', '%d/%b/%Y:%H:%M:%S', '%b %d %H:%M:%S')
+FRACTION = re.compile(r'[.,](\d+)$')
+
+
+class LogTimestampParser(object):
+    # Timestamps to epoch seconds, in local time. Lines of the same second
+    # only parse their common prefix once: parsed prefixes are kept in a
+    # small LRU cache and the fraction of a second is added separately.
+
+    def __init__(self, format=None, size=256):
+        self.formats  = (format,) if format else TIMESTAMP_FORMATS
+        self.fraction = not format or '%f' not in format
+        self.size     = size
+        self.cache    = OrderedDict()
+
+    def __call__(self, value):
+        fraction = 0.0
+        if self.fraction:
+            match = FRACTION.search(value)
+            if match:
+                value, fraction = value[:match.start()], float('0.' + match.group(1))
+        try:
+            seconds = self.cache.pop(value)
+        except KeyError:
+            seconds = self.parse(value)
+            if len(self.cache) >= self.size:
+                self.cache.popitem(last=False)
+        self.cache[value] = seconds
+        return seconds + fraction
+
+    def parse(self, value):
+        for format in self.formats:
+            try:
+                parsed = time.strptime(value, format)
+            except ValueError:
+                continue
+            if parsed.tm_year == 1900:
+                # Formats without year, like syslog
+                parsed = time.struct_time((time.localtime().tm_year,) + tuple(parsed)[1:])
+            return time.mktime(parsed)
+        raise ValueError('Unknown timestamp format: %s' % value)
+
+
+def converter(spec):
+    if spec in (None, True, 'str'):
+        return None
+    if spec == 'int':
+        return int
+    if spec == 'float':
+        return float
+    if spec == 'timestamp':
+        return LogTimestampParser()
+    if isinstance(spec, str) and spec.startswith('timestamp:'):
+        return LogTimestampParser(spec[len('timestamp:'):])
+    raise ValueError('Unknown field converter: %s' % spec)
+
+def convert(function, value):
+    if value is None or function is None:
+        return value
+    try:
+        value = function(value)
+    except ValueError:
+        return None
+    if isinstance(value, float) and (math.isnan(value) or math.isinf(value)):
+        return None
+    return value
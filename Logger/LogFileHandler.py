@@ -1,17 +1,30 @@
 #!/usr/bin/env python
-import os.path, logging
+import io, os.path, logging
+from functools import partial
 from LogBuffer import LogBuffer
+from LogMetrics import BYTES_READ, ROTATIONS
 
 
 class LogFileHandler():
-    def __init__(self, path, filters):
+    def __init__(self, path, filters, checkpoints=None, buffer_size=None, max_line_length=None, max_line_policy='split', chunk_size=65536, encoding='utf-8', errors='replace', **multiline):
         self.reset()
         self.path = path
         self.position = 0
         self.object = None
-        self.buffer = LogBuffer(filters)
+        self.buffer = LogBuffer(filters, buffer_size, max_line_length, max_line_policy, encoding, errors, path, **multiline)
+        self.timer = None
+        self.checkpoints = checkpoints
+        self.chunk_size = chunk_size
         self.open()
-        self.tail()
+
+    def reconfigure(self, filters, buffer_size=None, max_line_length=None, max_line_policy='split', chunk_size=65536, encoding='utf-8', errors='replace', **multiline):
+        # The data pending in the old buffer is read again by the new one, so
+        # no line is lost or sent twice
+        if self.is_open():
+            self.position -= self.buffer.pending()
+            self.object.seek(self.position)
+        self.buffer = LogBuffer(filters, buffer_size, max_line_length, max_line_policy, encoding, errors, self.path, **multiline)
+        self.chunk_size = chunk_size
 
     def reset(self):
         self.path = None
@@ -19,13 +32,54 @@ class LogFileHandler():
         self.position = 0
 
     def is_open(self):
-        return os.path.isfile(self.path) and self.object is not None
+        # The descriptor stays open after the file is moved or deleted, until
+        # it is drained and replaced by the new file
+        return self.object is not None
 
-    def open(self):
+    def open(self, resume=True):
         self.close()
+        self.position = 0
         if os.path.isfile(self.path):
             logging.debug("Action: Open. File {0}".format(self.path))
-            self.object = open(self.path, 'r')
+            self.object = io.open(self.path, 'rb')
+            if resume and self.checkpoints is not None:
+                self.position = self.checkpoints.resume(self.path, os.fstat(self.object.fileno()))
+            self.object.seek(self.position)
+
+    def rotation(self):
+        # 'rename' when another file took the path (rename+create), 'truncate'
+        # when the file shrank below the read position (copytruncate)
+        if not self.is_open():
+            return None
+        try:
+            current = os.stat(self.path)
+        except OSError:
+            return None
+        opened = os.fstat(self.object.fileno())
+        if (current.st_ino, current.st_dev) != (opened.st_ino, opened.st_dev):
+            return 'rename'
+        if opened.st_size < self.position:
+            return 'truncate'
+        return None
+
+    def rotate(self, rotation):
+        # The old file must have been drained: its last line is completed and
+        # the new file is read from the start
+        self.buffer.flush()
+        ROTATIONS.inc(1, self.path, rotation)
+        if rotation == 'truncate':
+            logging.info("File {0} was truncated at offset {1}. Reading from the beginning".format(self.path, self.position))
+            self.object.seek(0)
+            self.position = 0
+        else:
+            logging.info("File {0} was rotated at offset {1}. Switching to the new file".format(self.path, self.position))
+            self.open(resume=False)
+
+    def move(self, path):
+        # The rotated file keeps being followed under its new name
+        logging.info("File {0} was rotated to {1}. Following it under its new name".format(self.path, path))
+        ROTATIONS.inc(1, self.path, 'rename')
+        self.path = path
 
     def close(self):
         if self.is_open():
@@ -34,13 +88,24 @@ class LogFileHandler():
             self.object = None
 
     def tail(self):
+        # Reads the next chunk into the buffer. Returns the length read.
+        # The file is read in binary mode from the offset it was left at,
+        # so the position is just the count of bytes read.
         if self.is_open():
-            self.object.seek(self.position)
-            data = self.object.read()
-            self.position = self.object.tell()
+            data = self.object.read(self.chunk_size)
+            self.position += len(data)
             if data:
-                logging.debug("Action: Tail {0}: {1}".format(self.path, data))
+                logging.debug("Action: Tail %s: %s", self.path, data)
+                BYTES_READ.inc(len(data), self.path)
                 self.buffer.push(data)
+            return len(data)
+        return 0
+
+    def checkpoint(self, sink):
+        # Lines still pending in the buffer have not been sent yet, and the
+        # ones sent are only done once the sink delivered them
+        if self.checkpoints is not None and self.is_open():
+            sink.mark(partial(self.checkpoints.update, self.path, os.fstat(self.object.fileno()), self.position - self.buffer.pending()))
 
     def get_buffer(self):
         return self.buffer
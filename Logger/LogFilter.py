@@ -1,11 +1,112 @@
-import os, re, json
+import os, re, json, time
+from json.encoder import encode_basestring_ascii
+from LogCodec import pack, pack_string, map_header
+from LogFields import converter, convert
+
+# Placeholder for the line while the attributes of a filter are encoded
+PLACEHOLDER = '\x00remotelogger\x00'
+ASCII = ''.join(map(chr, range(128)))
+STRING_KEY = pack_string('string')
+# Options of a filter, or of its rule, sending records to another destination
+# than the one of the configuration
+ROUTE_KEYS = ('exchange', 'exchange_type', 'queue', 'routing_key')
+RESERVED = ('string', 'repeat_count', 'first_seen', 'last_seen')
+
+
+def ujson_encoder():
+    import ujson
+    return lambda string: ujson.dumps(string, ensure_ascii=True, escape_forward_slashes=False)
+
+def orjson_encoder():
+    import orjson
+    return lambda string: orjson.dumps(string).decode('utf-8')
+
+ENCODERS = {'json': lambda: encode_basestring_ascii, 'ujson': ujson_encoder, 'orjson': orjson_encoder}
+encode_string = encode_basestring_ascii
+
+def set_encoder(name):
+    # 'json' and 'ujson' produce the same bytes as json.dumps. 'orjson' does
+    # not escape non ASCII characters. 'auto' picks ujson when installed.
+    global encode_string
+    if name == 'auto':
+        try:
+            encode_string = ujson_encoder()
+        except ImportError:
+            encode_string = encode_basestring_ascii
+        return
+    if name not in ENCODERS:
+        raise ValueError('Unknown JSON encoder: %s' % name)
+    encode_string = ENCODERS[name]()
+
+# Format of the records: 'json' or 'msgpack'. Set before creating the filters.
+record_format = 'json'
+
+def set_format(name):
+    global record_format
+    if name not in ('json', 'msgpack'):
+        raise ValueError('Unknown message format: %s' % name)
+    record_format = name
+
+# Number of priority lanes, 0 when disabled. Set before creating the filters.
+lanes = 0
+# Lane of the records of a severity, limited to the number of lanes
+SEVERITY_LANES = {'WARNING': 1, 'ERROR': 2, 'CRITICAL': 3}
+
+def set_lanes(count):
+    global lanes
+    lanes = count
+
+if hasattr(bytes, 'isascii'):
+    is_ascii = bytes.isascii
+else:
+    def is_ascii(data):
+        try:
+            data.decode('ascii')
+            return True
+        except UnicodeDecodeError:
+            return False
+
+def encode_value(value):
+    # JSON of a field value
+    if value is None:
+        return 'null'
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (int, type(2 ** 64))):
+        return '%d' % value
+    return encode_string(value)
+
+def route_of(options):
+    # Route of the destination options set in a filter or a rule, if any
+    route = dict((key, options[key]) for key in ROUTE_KEYS if key in options)
+    return json.dumps(route, sort_keys=True) if route else None
+
+def ascii_compatible(encoding):
+    # Lines can only be split and matched as bytes if ASCII characters are
+    # encoded as themselves
+    try:
+        return ASCII.encode(encoding) == ASCII.encode('ascii')
+    except UnicodeError:
+        return False
+
+def is_ascii_pattern(pattern):
+    try:
+        pattern.encode('ascii')
+        return True
+    except UnicodeError:
+        return False
+
 
 class LogSkipException(Exception):
 
     def __init__(self, pattern, message):
         self.expression = pattern
         self.message = message
-        super(Exception, self).__init__('[SKIP] pattern: "'+str(pattern)+'", string: "'+message+'"')
+        super(Exception, self).__init__(pattern, message)
+
+    def __str__(self):
+        # Only formatted when logged
+        return '[SKIP] pattern: "'+str(self.expression)+'", string: "'+self.message+'"'
 
 
 class LogFilter():
@@ -13,39 +114,312 @@ class LogFilter():
     def __init__(self, attributes):
         self.pattern    = attributes.pop('pattern')
         self.regex      = re.compile(self.pattern)
-        self.action     = getattr(self.regex, attributes.pop('action', 'match'), self.regex.match)
+        self.action_name= attributes.pop('action', 'match')
+        self.action     = getattr(self.regex, self.action_name, self.regex.match)
         self.serialize  = self.skip if attributes.pop('skip', False) else self.to_json
+        # Suppression of floods: token bucket, 1 in N sampling and collapsing
+        # of consecutive identical lines (done per file, by LogBuffer)
+        self.rate_limit = attributes.pop('rate_limit', None)
+        self.rate_burst = attributes.pop('rate_burst', None) or self.rate_limit
+        self.sample     = attributes.pop('sample', 1)
+        self.collapse   = attributes.pop('collapse', False)
+        self.collapse_window = attributes.pop('collapse_window', 10)
+        self.tokens     = self.rate_burst
+        self.refilled   = time.time()
+        self.sampled    = 0
+        # Named groups sent as typed fields: true for strings, or a mapping
+        # from group name to converter. keep_line: false leaves out the line.
+        fields          = attributes.pop('fields', None)
+        self.keep_line  = attributes.pop('keep_line', True)
+        # Records of routed or prioritized filters are (route, record, lane),
+        # the route being the JSON of the destination options
+        self.route      = route_of(dict((key, attributes.pop(key)) for key in ROUTE_KEYS if key in attributes))
+        priority        = attributes.pop('priority', SEVERITY_LANES.get(attributes.get('severity'), 0))
+        self.priority   = min(max(int(priority), 0), lanes - 1) if lanes else 0
+        self.tagged     = self.route is not None or self.priority > 0
         self.attributes = attributes
+        self.fields     = self.compile_fields(fields)
+        self.prefix, self.suffix = self.template()
+        if self.fields is not None and self.serialize == self.to_json:
+            self.serialize = self.to_msgpack_fields if record_format == 'msgpack' else self.to_json_fields
+            self.static = json.dumps(attributes)[1:-1]
+            self.static_packed = b''.join(pack(key) + pack(value) for key, value in attributes.items())
+        elif record_format == 'msgpack' and self.serialize == self.to_json:
+            self.serialize = self.to_msgpack
+            self.packed = self.msgpack_template()
+
+    def compile_fields(self, fields):
+        # [(name, JSON key, packed key, converter)] of every named group
+        if not fields:
+            return None
+        groups = sorted(self.regex.groupindex, key=self.regex.groupindex.get)
+        if not groups:
+            raise ValueError('Filter %s extracts fields but has no named groups' % self.pattern)
+        converters = fields if isinstance(fields, dict) else {}
+        for name in converters:
+            if name not in self.regex.groupindex:
+                raise ValueError('Filter %s has no group named %s' % (self.pattern, name))
+        for name in groups:
+            if name in RESERVED or name in self.attributes:
+                raise ValueError('Filter %s: field %s would replace an attribute' % (self.pattern, name))
+        return [(name, json.dumps(name) + ': ', pack_string(name), converter(converters.get(name))) for name in groups]
+
+    def values(self, string, match):
+        # Converted values of the fields. Groups of ASCII lines matched as
+        # bytes are decoded.
+        if match is None or match is True:
+            match = self.action(string)
+        values = []
+        for name, key, packed, function in self.fields:
+            value = match.group(name)
+            if isinstance(value, bytes) and bytes is not str:
+                value = value.decode('ascii')
+            values.append(convert(function, value))
+        return values
 
-    def skip(self, string):
+    def skip(self, string, repeated=None, match=None):
         raise LogSkipException(self.pattern, string)
 
+    def admit(self):
+        # Returns why a line is suppressed, or None if it can be sent
+        if self.sample > 1:
+            self.sampled += 1
+            if self.sampled % self.sample != 1:
+                return 'sample'
+        if self.rate_limit:
+            now = time.time()
+            self.tokens = min(self.rate_burst, self.tokens + (now - self.refilled) * self.rate_limit)
+            self.refilled = now
+            if self.tokens < 1:
+                return 'rate'
+            self.tokens -= 1
+        return None
+
     def apply(self, string):
         return self.action(string)
 
-    def to_json(self, string):
-        tmp = {'string':string}
+    def template(self):
+        # The static attributes are encoded once. Each line is only escaped
+        # and spliced in where the placeholder was.
+        tmp = {'string':PLACEHOLDER}
         tmp.update(self.attributes)
-        return json.dumps(tmp)
+        encoded = json.dumps(tmp)
+        placeholder = json.dumps(PLACEHOLDER)
+        if placeholder not in encoded:
+            return encoded, None
+        prefix, suffix = encoded.split(placeholder, 1)
+        return prefix, suffix
+
+    def msgpack_template(self):
+        # Map headers without and with the repeat fields, and the packed
+        # attributes that follow the string
+        if 'string' in self.attributes:
+            return None, None, pack(self.attributes)
+        attributes = b''.join(pack(key) + pack(value) for key, value in self.attributes.items())
+        size = len(self.attributes) + 1
+        return map_header(size) + pack_string('string'), map_header(size + 3) + pack_string('string'), attributes
+
+    def to_msgpack(self, string, repeated=None, match=None):
+        header, repeated_header, attributes = self.packed
+        if header is None:
+            return attributes
+        if repeated is None:
+            return header + pack_string(string) + attributes
+        count, first, last = repeated
+        return repeated_header + pack_string(string) + pack('repeat_count') + pack(count) + \
+            pack('first_seen') + pack(float(first)) + pack('last_seen') + pack(float(last)) + attributes
+
+    def to_json(self, string, repeated=None, match=None):
+        # repeated: (count, first, last) of collapsed identical lines
+        if self.suffix is None:
+            return self.prefix
+        if repeated is None:
+            return self.prefix + encode_string(string) + self.suffix
+        count, first, last = repeated
+        return '%s%s, "repeat_count": %d, "first_seen": %.3f, "last_seen": %.3f%s' % (self.prefix, encode_string(string), count, first, last, self.suffix)
+
+    def to_json_fields(self, string, repeated=None, match=None):
+        parts = [field[1] + encode_value(value) for field, value in zip(self.fields, self.values(string, match))]
+        if self.keep_line:
+            parts.insert(0, '"string": ' + encode_string(string))
+        if repeated is not None:
+            parts.append('"repeat_count": %d, "first_seen": %.3f, "last_seen": %.3f' % repeated)
+        if self.static:
+            parts.append(self.static)
+        return '{' + ', '.join(parts) + '}'
+
+    def to_msgpack_fields(self, string, repeated=None, match=None):
+        size = len(self.fields) + len(self.attributes) + (1 if self.keep_line else 0) + (3 if repeated is not None else 0)
+        parts = [map_header(size)]
+        if self.keep_line:
+            parts.append(STRING_KEY + pack_string(string))
+        parts.extend(field[2] + pack(value) for field, value in zip(self.fields, self.values(string, match)))
+        if repeated is not None:
+            count, first, last = repeated
+            parts.append(pack('repeat_count') + pack(count) + pack('first_seen') + pack(float(first)) + pack('last_seen') + pack(float(last)))
+        parts.append(self.static_packed)
+        return b''.join(parts)
 
 
 class DummyLogFilter(LogFilter):
 
-    def __init__(self, pattern):
+    def __init__(self, pattern, route=None):
+        self.pattern = pattern
         self.attributes = {}
+        self.fields = None
+        self.route = route
+        self.priority = 0
+        self.tagged = route is not None
         self.serialize     = self.to_json
+        self.prefix, self.suffix = self.template()
+        if record_format == 'msgpack':
+            self.serialize = self.to_msgpack
+            self.packed = self.msgpack_template()
+        self.collapse = False
 
     def apply(self, string):
         return True
 
+    def admit(self):
+        return None
+
+
+class LogFilterEngine():
+    # Python 2 re supports at most 100 named groups per pattern
+    CHUNK = 90
+    SPECIAL = '.^$*+?{}[]\\|()'
+    QUANTIFIERS = '*+?{'
+    BACKREFERENCE = re.compile(r'\\[1-9]')
+    # Global inline flags, like (?i), apply to the whole combined pattern on
+    # Python 2 and before Python 3.11
+    INLINE_FLAGS = re.compile(r'\(\?[aiLmsux]+\)')
+
+    def __init__(self, filters, fallback, binary=False):
+        self.filters  = filters
+        self.fallback = fallback
+        self.binary   = binary
+        self.prefixes = self.literal_prefixes(filters)
+        self.stages   = []
+        run = []
+        for filter in filters:
+            if self.combinable(filter):
+                run.append(filter)
+                if len(run) == self.CHUNK:
+                    self.stage(run)
+                    run = []
+            else:
+                self.stage(run)
+                run = []
+                self.stages.append((self.single(filter), None, filter))
+        self.stage(run)
+
+    def single(self, filter):
+        # Binary engines match ASCII lines with the pattern compiled as bytes
+        if not self.binary:
+            return filter.apply
+        regex = re.compile(filter.pattern.encode('ascii'))
+        return getattr(regex, filter.action_name, regex.match)
+
+    def combinable(self, filter):
+        # Search filters are left alone: re.search scans for literals much
+        # faster than a combined pattern with a lazy leading wildcard.
+        # Filters extracting fields need a match of their own pattern.
+        return filter.action_name == 'match' and filter.fields is None and not self.BACKREFERENCE.search(filter.pattern) \
+            and not self.INLINE_FLAGS.search(filter.pattern)
+
+    def stage(self, filters):
+        # Consecutive match filters are compiled in one alternation.
+        # Alternatives are tried in order, so the first filter that matches
+        # wins, and the winner is resolved from the name of its group.
+        if len(filters) > 1:
+            groups = {}
+            alternatives = []
+            for filter in filters:
+                name = 'f%d' % len(groups)
+                groups[name] = filter
+                alternatives.append('(?P<%s>%s)' % (name, filter.pattern))
+            pattern = '|'.join(alternatives)
+            try:
+                self.stages.append((re.compile(pattern.encode('ascii') if self.binary else pattern).match, groups, None))
+                return
+            except (re.error, AssertionError, OverflowError):
+                pass
+        for filter in filters:
+            self.stages.append((self.single(filter), None, filter))
+
+    def literal_prefix(self, filter):
+        # Fixed text every matching line starts with, or None
+        pattern = filter.pattern
+        if '|' in pattern or self.INLINE_FLAGS.search(pattern):
+            return None
+        if pattern.startswith('^'):
+            pattern = pattern[1:]
+        elif filter.action_name != 'match':
+            return None
+        prefix = ''
+        for char in pattern:
+            if char in self.SPECIAL:
+                if char in self.QUANTIFIERS:
+                    prefix = prefix[:-1]
+                break
+            prefix += char
+        return prefix or None
+
+    def literal_prefixes(self, filters):
+        prefixes = [self.literal_prefix(filter) for filter in filters]
+        if None in prefixes:
+            return None
+        if self.binary:
+            return tuple(prefix.encode('ascii') for prefix in prefixes)
+        return tuple(prefixes)
+
+    def find(self, string):
+        # The winning filter and its match, None for combined filters
+        if self.prefixes is not None and not string.startswith(self.prefixes):
+            return self.fallback, None
+        for apply, groups, filter in self.stages:
+            match = apply(string)
+            if match:
+                return (groups[match.lastgroup], None) if groups else (filter, match)
+        return self.fallback, None
+
 
 class LogFilterSet():
-    def __init__(self, filters):
+    def __init__(self, filters, encoding='utf-8', errors='replace', route=None):
+        # Lines matching no filter follow the route of their rule
         self.filters = filters or []
-        self.filters.append(DummyLogFilter(pattern="*"))
+        self.filters.append(DummyLogFilter(pattern="*", route=route))
+        self.encoding = encoding
+        self.errors = errors
+        self.engine = LogFilterEngine(self.filters[:-1], self.filters[-1])
+        self.binary = None
+        if not ascii_compatible(encoding):
+            raise ValueError('Encoding not compatible with ASCII: %s' % encoding)
+        if all(is_ascii_pattern(filter.pattern) for filter in self.filters[:-1]):
+            # Some str patterns are not valid bytes patterns, like \u escapes
+            # or (?u): their lines are all decoded
+            try:
+                self.binary = LogFilterEngine(self.filters[:-1], self.filters[-1], binary=True)
+            except re.error:
+                self.binary = None
 
-    def apply(self, string):
+    def match(self, line):
+        # Lines are raw bytes. ASCII lines are matched without decoding.
+        # Returns the winning filter, the decoded line and the match
+        if self.binary is not None and is_ascii(line):
+            filter, match = self.binary.find(line)
+            return filter, (line if bytes is str else line.decode('ascii')), match
+        string = line.decode(self.encoding, self.errors)
+        filter, match = self.engine.find(string)
+        return filter, string, match
+
+    def apply(self, line):
+        filter, string, match = self.match(line)
+        return filter.serialize(string, None, match)
+
+    def apply_sequential(self, string):
         for filter in self.filters:
-            if filter.apply(string):
-                return filter.serialize(string) 
+            match = filter.apply(string)
+            if match:
+                return filter.serialize(string, None, match)
 
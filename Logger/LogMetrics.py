@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+import os
+import bisect
+import logging
+import threading
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import UnixStreamServer, StreamRequestHandler, ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import UnixStreamServer, StreamRequestHandler, ThreadingMixIn
+
+
+def escape(value):
+    return ('%s' % value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def labels(names, values):
+    pairs = ['%s="%s"' % (name, escape(value)) for name, value in zip(names, values)]
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+class Counter(object):
+
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name       = name
+        self.help       = help
+        self.labelnames = labelnames
+        self.values     = {}
+        self.lock       = threading.Lock()
+
+    def inc(self, amount=1, *labelvalues):
+        with self.lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return ['%s%s %s' % (self.name, labels(self.labelnames, key), value) for key, value in values]
+
+
+class Gauge(object):
+
+    type = 'gauge'
+
+    def __init__(self, name, help):
+        self.name       = name
+        self.help       = help
+        self.functions  = []
+
+    def set_function(self, function):
+        self.functions.append(function)
+
+    def total(self):
+        return sum(function() for function in self.functions)
+
+    def render(self):
+        return ['%s %s' % (self.name, self.total())]
+
+
+class Histogram(object):
+
+    type = 'histogram'
+    BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name       = name
+        self.help       = help
+        self.buckets    = buckets
+        self.counts     = [0] * (len(buckets) + 1)
+        self.sum        = 0
+        self.lock       = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.sum += value
+
+    def total(self):
+        with self.lock:
+            return sum(self.counts)
+
+    def render(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append('%s_bucket{le="%s"} %s' % (self.name, bound, cumulative))
+        lines.append('%s_sum %s' % (self.name, total))
+        lines.append('%s_count %s' % (self.name, cumulative))
+        return lines
+
+
+class LogMetrics(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help):
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name, help, buckets=Histogram.BUCKETS):
+        return self.register(Histogram(name, help, buckets))
+
+    def render(self):
+        # Prometheus text exposition format
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        return ' '.join('%s%s=%s' % (metric.name.replace('remotelogger_', ''), '_count' if metric.type == 'histogram' else '', metric.total()) for metric in self.metrics)
+
+
+registry        = LogMetrics()
+BYTES_READ      = registry.counter('remotelogger_bytes_read_total', 'Bytes read from log files', ('file',))
+LINES_READ      = registry.counter('remotelogger_lines_read_total', 'Lines read from log files', ('file',))
+RECORDS_READ    = registry.counter('remotelogger_records_read_total', 'Records made of the lines read, a multiline record counting once', ('file',))
+LINES_MATCHED   = registry.counter('remotelogger_lines_matched_total', 'Lines matched by every filter', ('file', 'pattern'))
+LINES_SKIPPED   = registry.counter('remotelogger_lines_skipped_total', 'Lines discarded by skip filters', ('file',))
+LINES_SUPPRESSED= registry.counter('remotelogger_lines_suppressed_total', 'Lines not sent because of rate limits, sampling or collapsing', ('file', 'pattern', 'reason'))
+DROPPED         = registry.counter('remotelogger_dropped_total', 'Records discarded because a buffer or queue was full or an output failed', ('reason',))
+ROTATIONS       = registry.counter('remotelogger_rotations_total', 'Log file rotations', ('file', 'style'))
+PROCESS_TIME    = registry.histogram('remotelogger_process_seconds', 'Time to split every chunk read in lines, and filter and serialize them')
+PUBLISH_TIME    = registry.histogram('remotelogger_publish_seconds', 'Time to publish a message and receive its confirmation')
+PUBLISHED       = registry.counter('remotelogger_published_total', 'Messages published')
+ACKED           = registry.counter('remotelogger_acked_total', 'Messages confirmed by the server')
+NACKED          = registry.counter('remotelogger_nacked_total', 'Messages rejected or returned by the server')
+QUEUE_DEPTH     = registry.gauge('remotelogger_queue_depth', 'Records waiting to be published')
+SPOOLED         = registry.gauge('remotelogger_spooled', 'Records waiting in the spool')
+
+
+class MetricsHTTPHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+class MetricsUnixHandler(StreamRequestHandler):
+
+    def handle(self):
+        self.wfile.write(registry.render().encode('utf-8'))
+
+
+class ThreadingUnixStreamServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+class LogMetricsReporter(object):
+
+    def __init__(self, interval=60, address='127.0.0.1', port=0, path=None):
+        self.interval = interval
+        self.address  = address
+        self.port     = port
+        self.path     = path
+        self.servers  = []
+        self.stopping = threading.Event()
+
+    def start(self):
+        if self.interval > 0:
+            self.thread(self.report)
+        if self.port:
+            logging.info("Serving metrics on http://{0}:{1}/metrics".format(self.address, self.port))
+            self.serve(HTTPServer((self.address, self.port), MetricsHTTPHandler))
+        if self.path:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            logging.info("Serving metrics on unix socket {0}".format(self.path))
+            self.serve(ThreadingUnixStreamServer(self.path, MetricsUnixHandler))
+
+    def stop(self):
+        self.stopping.set()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def thread(self, target):
+        thread = threading.Thread(target=target)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self, server):
+        self.servers.append(server)
+        self.thread(server.serve_forever)
+
+    def report(self):
+        while not self.stopping.wait(self.interval):
+            logging.info("Stats: %s", registry.summary())
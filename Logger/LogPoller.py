@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+import os, time, heapq, logging, threading
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileModifiedEvent
+
+
+REMOTE_FILESYSTEMS = ('nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', 'lustre', 'gpfs', 'beegfs', 'panfs',
+                      'ceph', 'glusterfs', 'fuse.glusterfs', 'fuse.sshfs', 'afs', '9p')
+
+def remote_filesystem(path, mounts='/proc/mounts'):
+    # Type of the filesystem holding path, from its longest mount point
+    try:
+        with open(mounts, 'r') as stream:
+            entries = [line.split()[1:3] for line in stream if len(line.split()) > 2]
+    except (IOError, OSError):
+        return False
+    path = os.path.realpath(path)
+    best, fstype = '', None
+    for mountpoint, kind in entries:
+        mountpoint = mountpoint.replace('\\040', ' ')
+        if (path == mountpoint or path.startswith(mountpoint.rstrip('/') + '/')) and len(mountpoint) >= len(best):
+            best, fstype = mountpoint, kind
+    return fstype in REMOTE_FILESYSTEMS
+
+
+# Follows files where inotify does not see the writes of other hosts (NFS,
+# Lustre...). Every file is stat()ed on its own schedule: right after a
+# change it is polled every min_interval, and the interval doubles while it
+# stays idle up to max_interval, so idle files cost almost nothing. Changes
+# are queued to the observer as regular events. Files of glob rules are
+# discovered every max_interval.
+class LogPoller(object):
+
+    def __init__(self, handler, min_interval=0.5, max_interval=30):
+        self.handler      = handler
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.rules        = []
+        self.schedule     = []
+        self.state        = {}
+        self.discovered   = 0
+        self.lock         = threading.Lock()
+        self.wakeup       = threading.Event()
+        self.stopping     = False
+        self.thread       = None
+
+    def start(self):
+        if self.thread is not None:
+            return
+        logging.info("Polling files every {0} to {1} seconds".format(self.min_interval, self.max_interval))
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+        self.thread = None
+
+    def add_rule(self, rule):
+        with self.lock:
+            self.rules.append(rule)
+            if rule.literal:
+                self.add(rule.pattern)
+        self.start()
+
+    def remove_rule(self, rule):
+        with self.lock:
+            self.rules.remove(rule)
+            if rule.literal and not any(other.literal and other.pattern == rule.pattern for other in self.rules):
+                self.state.pop(rule.pattern, None)
+
+    def track(self, path):
+        with self.lock:
+            self.add(path)
+
+    def add(self, path):
+        # Called with the lock held
+        if path not in self.state:
+            due = time.time() + self.min_interval
+            self.state[path] = [self.stat(path), self.min_interval, due]
+            heapq.heappush(self.schedule, (due, path))
+            self.wakeup.set()
+
+    def discard(self, path):
+        with self.lock:
+            if not any(rule.literal and rule.pattern == path for rule in self.rules):
+                self.state.pop(path, None)
+
+    def stat(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_dev, stat.st_size, stat.st_mtime)
+
+    def run(self):
+        while not self.stopping:
+            now = time.time()
+            if now - self.discovered >= self.max_interval:
+                self.discover()
+                self.discovered = now
+            with self.lock:
+                due = []
+                while self.schedule and self.schedule[0][0] <= now:
+                    due.append(heapq.heappop(self.schedule))
+            for when, path in due:
+                self.poll(path, when)
+            self.wakeup.clear()
+            if self.stopping:
+                break
+            with self.lock:
+                timeout = min(self.schedule[0][0] - time.time() if self.schedule else self.max_interval,
+                              self.discovered + self.max_interval - time.time())
+            self.wakeup.wait(max(timeout, 0.01))
+
+    def poll(self, path, when):
+        # Entries left in the schedule by a discarded path are skipped
+        with self.lock:
+            state = self.state.get(path)
+        if state is None or state[2] != when:
+            return
+        previous, interval, when = state
+        current = self.stat(path)
+        if current == previous:
+            interval = min(interval * 2, self.max_interval)
+        else:
+            interval = self.min_interval
+            if previous is None:
+                self.handler.queue(FileCreatedEvent(path))
+            elif current is None:
+                self.handler.queue(FileDeletedEvent(path))
+            else:
+                self.handler.queue(FileModifiedEvent(path))
+        with self.lock:
+            if path in self.state:
+                due = time.time() + interval
+                self.state[path] = [current, interval, due]
+                heapq.heappush(self.schedule, (due, path))
+
+    def discover(self):
+        with self.lock:
+            rules = [rule for rule in self.rules if not rule.literal]
+        for rule in rules:
+            for path in rule.discover():
+                with self.lock:
+                    known = path in self.state
+                    if not known:
+                        self.add(path)
+                if not known:
+                    self.handler.queue(FileCreatedEvent(path))
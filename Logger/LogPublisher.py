@@ -4,6 +4,20 @@ import logging
 import pika
 import json
 import uuid
+import time
+import threading
+from itertools import groupby
+from collections import deque
+from pika.exceptions import AMQPError, ChannelClosed
+from LogSpool import LogSpool
+from LogSink import LogSink
+from LogCodec import compressor, array_header
+from LogMetrics import PUBLISH_TIME, PUBLISHED, ACKED, NACKED, SPOOLED, DROPPED
+
+
+class LogDispatchException(Exception):
+    pass
+
 
 class RemoteLogConsumerDispacher(object):
 
@@ -22,6 +36,7 @@ class RemoteLogConsumerDispacher(object):
         self._connection     = None
         self._channel        = None
         self._callback_queue = None
+        self._consumer_tag   = None
 
     def connect(self):
         self._logger.debug('Connecting: %s' % self._url)
@@ -39,14 +54,15 @@ class RemoteLogConsumerDispacher(object):
             self._channel.exchange_declare(exchange=self._exchange, exchange_type=self._exchange_type)
 
     def queue_open(self):
-        self._logger.debug('Opening queue: %s' % self._queue)
-        self._channel.queue_declare(queue=self._queue)
+        if self._queue:
+            self._logger.debug('Opening queue: %s' % self._queue)
+            self._channel.queue_declare(queue=self._queue)
 
     def callback_queue_open(self):
         self._logger.debug('Opening callback queue')
         result = self._channel.queue_declare(exclusive=True)
         self._callback_queue = result.method.queue
-        self._channel.basic_consume(self.on_response, no_ack=True, queue=self._callback_queue)
+        self._consumer_tag = self._channel.basic_consume(self.on_response, no_ack=True, queue=self._callback_queue)
 
     def on_response(self, ch, method, props, body):
         if self._correlation_id == props.correlation_id:
@@ -67,14 +83,20 @@ class RemoteLogConsumerDispacher(object):
             self._channel.exchange_delete(exchange=self._exchange, if_unused=True)
 
     def queue_close(self):
-        self._logger.debug('Closing queue: %s' % self._queue)
-        self._channel.queue_delete(queue=self._queue, if_unused=True, if_empty=True)
+        if self._queue:
+            self._logger.debug('Closing queue: %s' % self._queue)
+            self._channel.queue_delete(queue=self._queue, if_unused=True, if_empty=True)
 
     def callback_queue_close(self):
-        self._logger.debug('Clossing callback queue')
-        result = self._channel.queue_delete(self._queue)
+        # The consumer is cancelled before its queue is deleted
+        self._logger.debug('Closing callback queue: %s' % self._callback_queue)
+        if self._consumer_tag is not None:
+            self._channel.basic_cancel(consumer_tag=self._consumer_tag)
+            self._consumer_tag = None
+        self._channel.queue_delete(queue=self._callback_queue)
+        self._callback_queue = None
 
-    def dispatch(self, exchange, exchange_type, queue, routing_key):
+    def dispatch(self, exchange, exchange_type, queue, routing_key, timeout=10):
         self.response = None
         message = json.dumps({'exchange':exchange, 'exchange_type':exchange_type, 'queue':queue, 'routing_key':routing_key})
         self._correlation_id = str(uuid.uuid4())
@@ -86,8 +108,13 @@ class RemoteLogConsumerDispacher(object):
                                          ),
                                    body=message)
         self._logger.debug('Dispatch consumer on: %r' % message)
+        # Sleeps until a frame arrives or the timeout expires
+        deadline = time.time() + timeout
         while self.response is None:
-            self._connection.process_data_events()
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise LogDispatchException('No dispatch response in %s seconds' % timeout)
+            self._connection.process_data_events(time_limit=remaining)
         return self.response
 
     def start(self):
@@ -105,10 +132,59 @@ class RemoteLogConsumerDispacher(object):
         self.disconnect()
 
 
-class LogPublisher(object):
+def routed(message):
+    # (route, record, lane) of a queued or spooled message. Records of the
+    # default destination have no route, and the lowest lane is 0.
+    return message if isinstance(message, tuple) else (None, message, 0)
+
+
+# Records waiting to be published together, to the same destination and
+# with the same priority
+class LogBatch(object):
+
+    def __init__(self, destination, lane):
+        self.destination = destination
+        self.lane        = lane
+        self.records     = []
+        self.bytes       = 0
+        self.started     = None
+        self.flushes     = 0
+
+
+# Exchange, queue and routing key where the records of a route are
+# published, and their pending batches by lane
+class LogDestination(object):
 
-    def __init__(self, config, logger):
+    def __init__(self, route, exchange, exchange_type, queue, routing_key):
+        self.route         = route
+        self.exchange      = exchange
+        self.exchange_type = exchange_type
+        self.queue         = queue
+        self.routing_key   = routing_key
+        self.topic         = routing_key+'.'+queue
+        self.key           = (exchange, exchange_type, queue, routing_key)
+        # Set once the destination is declared on the current connection
+        self.channel       = None
+        self.ready         = False
+        self.batches       = {}
+        # Until when the server refuses its declaration
+        self.refused_until = 0
+
+
+# The AMQP output
+class LogPublisher(LogSink):
+
+    _dispatched      = {}
+    _dispatched_lock = threading.Lock()
+
+    # Refused destinations are declared again after this delay (seconds)
+    REFUSAL_DELAY    = 60
+
+    def __init__(self, config, logger, flusher=True, routes=()):
+        super(LogPublisher, self).__init__(logger, flusher)
         self._config         = config
+        # Routes of the filter file, checked once at startup
+        self._routes         = list(routes)
 
         self._connection     = None
         self._channel        = None
@@ -129,68 +205,436 @@ class LogPublisher(object):
         self._queue          = config['queue']
         self._routing_key    = config['routing_key']
         self._topic          = config['routing_key']+'.'+config['queue']
+        self._destination    = LogDestination(None, self._exchange, self._exchange_type, self._queue, self._routing_key)
+        # Destinations by route, several routes can share one
+        self._destinations   = {None: self._destination}
+        self._channels       = []
+        self._channel_pool   = max(config.get('channel_pool_size', 4), 1)
+        self._assigned       = 0
+        self._declared       = set()
         self._heartbeat      = config['heartbeat']
         self._blocked_timeout= config['blocked_connection_timeout']
-        self._logger         = logger
-
-    def dispatch(self):
-        dispatcher  = RemoteLogConsumerDispacher(self._config, '', '', '', 'rpc_queue', self._logger)
-        dispatcher.start()
-        dispatcher.dispatch(self._exchange, self._exchange_type, self._queue, self._routing_key)
-        dispatcher.stop()
+        self._dispatch_timeout= config.get('dispatch_timeout', 10)
+        self._dispatch_retries= config.get('dispatch_retries', 3)
+        self._batch_size     = config.get('batch_size', 1)
+        self._batch_linger   = config.get('batch_linger', 100)
+        self._batch_max_bytes= config.get('batch_max_bytes', 0)
+        self._batch_format   = config.get('batch_format', 'json')
+        self._format         = config.get('message_format', 'json')
+        self._compression    = config.get('compression', 'none')
+        self._compress       = compressor(self._compression, config.get('compression_level'))
+        self._compress_min   = config.get('compression_min_bytes', 1024)
+        # Priority lanes: records of higher lanes skip the spooled backlog
+        # and, with amqp_priority, are sent with their lane as priority
+        self._lanes          = len(config.get('priority_weights', [1, 2, 4, 8])) if config.get('priority_lanes') else 0
+        self._amqp_priority  = bool(self._lanes > 1 and config.get('amqp_priority'))
+
+        self._batched        = []
+        self._marks          = deque()
+        self._lock           = threading.RLock()
+        self._blocked        = False
+        self._unavailable    = False
+        self._retry_at       = 0
+        self._retry_delay    = 1
+        self._spool          = None
+        if config.get('spool_path', 'remotelogger.spool'):
+            self._spool      = LogSpool(config.get('spool_path', 'remotelogger.spool'),
+                                        config.get('spool_segment_bytes', 16777216),
+                                        config.get('spool_max_bytes', 1073741824),
+                                        config.get('spool_fsync', 'segment'),
+                                        self._format == 'msgpack')
+            SPOOLED.set_function(self._spool.__len__)
+
+    def destination(self, route):
+        # Destination of a route: the options of the route override the
+        # ones of the configuration
+        destination = self._destinations.get(route)
+        if destination is None:
+            options = dict(((key, self._config[key]) for key in ('exchange', 'exchange_type', 'queue', 'routing_key')), **json.loads(route))
+            destination = LogDestination(route, options['exchange'], options['exchange_type'], options['queue'], options['routing_key'])
+            destination = next((known for known in self._destinations.values() if known.key == destination.key), destination)
+            self._destinations[route] = destination
+        return destination
+
+    def dispatch(self, destination=None):
+        # The consumer only has to be dispatched once per exchange and queue:
+        # reconnections and other publishers reuse the cached response
+        destination = destination or self._destination
+        key = (self._host, self._port) + destination.key
+        with LogPublisher._dispatched_lock:
+            if key in LogPublisher._dispatched:
+                self._logger.debug('Consumer already dispatched: %r' % (key,))
+                return LogPublisher._dispatched[key]
+        delay = 1
+        for attempt in range(1, self._dispatch_retries + 2):
+            dispatcher = RemoteLogConsumerDispacher(self._config, '', '', '', 'rpc_queue', self._logger)
+            try:
+                dispatcher.start()
+                response = dispatcher.dispatch(destination.exchange, destination.exchange_type, destination.queue, destination.routing_key, self._dispatch_timeout)
+                dispatcher.stop()
+                break
+            except (AMQPError, LogDispatchException) as e:
+                try:
+                    dispatcher.disconnect()
+                except Exception:
+                    pass
+                if attempt > self._dispatch_retries:
+                    raise LogDispatchException('Dispatch failed after %i attempts: %r' % (attempt, e))
+                self._logger.warning('Dispatch failed (%r). Retrying in %i seconds' % (e, delay))
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+        with LogPublisher._dispatched_lock:
+            LogPublisher._dispatched[key] = response
+        return response
+
+    def __str__(self):
+        return 'AMQP output %s:%s' % (self._host, self._config['port'])
 
     def start(self):
         self.dispatch()
+        self.reset()
         self.connect()
         self.channel_open()
         self.exchange_open()
         self.queue_open()
         self.queue_bind()
+        self._destination.ready = True
+        self.check()
+        self.flusher_start()
 
     def stop(self):
-        self.queue_unbind()
-        self.queue_close()
-        self.exchange_close()
+        self.flusher_stop()
+        self.flush()
+        for destination in self.declared():
+            self.queue_unbind(destination)
+            self.queue_close(destination)
+        for destination in self.declared():
+            self.exchange_close(destination)
         self.channel_close()
         self.disconnect()
+        if self._spool is not None:
+            self._spool.close()
 
     def restart(self):
         self.stop()
         self.start()
 
+    def reconnect(self):
+        # The previous connection is probably broken: its resources are
+        # not deleted, only closed if still possible.
+        try:
+            self.disconnect()
+        except Exception as e:
+            self._logger.debug('Disconnection failed: %r' % e)
+        self.start()
+
     def connect(self):
         self._logger.debug('Connecting: %s' % self._url)
         credentials = pika.PlainCredentials(self._user, self._pass) 
-        parameters = pika.ConnectionParameters(host=self._host, port=self._port, credentials=credentials, heartbeat_interval=self._heartbeat) 
+        parameters = pika.ConnectionParameters(host=self._host, port=self._port, credentials=credentials, heartbeat_interval=self._heartbeat,
+                                               blocked_connection_timeout=self._blocked_timeout)
         self._connection = pika.BlockingConnection(parameters)
         self._connection.add_on_connection_blocked_callback(self.connection_blocked_callback)
         self._connection.add_on_connection_unblocked_callback(self.connection_unblocked_callback)
 
-    def channel_open(self):
-        self._logger.debug('Opening channel')
-        self._channel = self._connection.channel()
-        self._channel.confirm_delivery()
-        self._channel.add_on_cancel_callback(self.channel_cancel_callback)
-        self._channel.add_on_return_callback(self.channel_return_callback)
+    def reset(self):
+        # Channels and declarations only live as long as their connection
+        self._channels = []
+        self._assigned = 0
+        self._declared = set()
+        for destination in self._destinations.values():
+            destination.channel = None
+            destination.ready = False
 
-    def exchange_open(self):
-        self._logger.debug('Opening exchange: %s (%s)' % (self._exchange, self._exchange_type))
-        self._channel.exchange_declare(exchange=self._exchange, exchange_type=self._exchange_type)
-
-    def queue_open(self):
-        self._logger.debug('Opening queue: %s' % self._queue)
-        self._channel.queue_declare(queue=self._queue)
+    def declared(self):
+        return [destination for destination in set(self._destinations.values()) if destination.ready]
 
-    def queue_bind(self):
-        self._logger.debug('Binding queue "%s" to exchange "%s" with key "%s"' % (self._queue, self._exchange, self._topic))
-        self._channel.queue_bind(queue=self._queue, exchange=self._exchange, routing_key=self._topic)
+    def channel_open(self):
+        self._channel = self.pooled_channel()
+        self._destination.channel = self._channel
+
+    def pooled_channel(self):
+        # Destinations are spread over up to channel_pool_size channels of
+        # the connection, in turn
+        index = self._assigned % self._channel_pool
+        self._assigned += 1
+        if index < len(self._channels):
+            return self._channels[index]
+        self._logger.debug('Opening channel')
+        channel = self._connection.channel()
+        channel.confirm_delivery()
+        channel.add_on_cancel_callback(self.channel_cancel_callback)
+        channel.add_on_return_callback(self.channel_return_callback)
+        self._channels.append(channel)
+        return channel
+
+    def check(self):
+        # The destinations of the filter file are declared once, so that a
+        # configuration the server refuses fails at startup
+        routes, self._routes = self._routes, []
+        for route in routes:
+            destination = self.destination(route)
+            try:
+                self.prepare(destination)
+            except ChannelClosed as e:
+                raise LogDispatchException('Destination %r refused by the server: %r' % (destination.key, e))
+
+    def refuse(self, destination, error):
+        # The server closed the channel: its records are dropped for a while
+        # rather than blocking the records of every other destination
+        self._logger.warning('Destination %r refused by the server (%r). Dropping its records for %i seconds' % (destination.key, error, self.REFUSAL_DELAY))
+        destination.refused_until = time.time() + self.REFUSAL_DELAY
+        channel = destination.channel
+        if channel is None:
+            return
+        # The other destinations of the channel are declared again on a new one
+        self._channels = [pooled for pooled in self._channels if pooled is not channel]
+        for other in self._destinations.values():
+            if other.channel is channel:
+                other.channel = None
+                other.ready = False
+
+    def prepare(self, destination):
+        # Other destinations are dispatched and declared the first time they
+        # are published to on a connection. Declarations are cached: an
+        # exchange or a queue shared by several destinations is declared once.
+        if destination.ready:
+            return
+        self.dispatch(destination)
+        destination.channel = self.pooled_channel()
+        self.exchange_open(destination)
+        self.queue_open(destination)
+        self.queue_bind(destination)
+        destination.ready = True
+
+    def exchange_open(self, destination=None):
+        destination = destination or self._destination
+        if ('exchange', destination.exchange) in self._declared:
+            return
+        self._logger.debug('Opening exchange: %s (%s)' % (destination.exchange, destination.exchange_type))
+        destination.channel.exchange_declare(exchange=destination.exchange, exchange_type=destination.exchange_type)
+        self._declared.add(('exchange', destination.exchange))
+
+    def queue_open(self, destination=None):
+        destination = destination or self._destination
+        if ('queue', destination.queue) in self._declared:
+            return
+        self._logger.debug('Opening queue: %s' % destination.queue)
+        destination.channel.queue_declare(queue=destination.queue, arguments=self.queue_arguments())
+        self._declared.add(('queue', destination.queue))
+
+    def queue_bind(self, destination=None):
+        destination = destination or self._destination
+        if ('binding', destination.queue, destination.exchange, destination.topic) in self._declared:
+            return
+        self._logger.debug('Binding queue "%s" to exchange "%s" with key "%s"' % (destination.queue, destination.exchange, destination.topic))
+        destination.channel.queue_bind(queue=destination.queue, exchange=destination.exchange, routing_key=destination.topic)
+        self._declared.add(('binding', destination.queue, destination.exchange, destination.topic))
+
+    def queue_arguments(self):
+        # Queues declared with another maximum priority are refused by the
+        # server
+        return {'x-max-priority': self._lanes - 1} if self._amqp_priority else None
 
     def send(self, message):
-        self._logger.debug('Sending message: %s' % message)
-        delivery = self._channel.basic_publish(exchange=self._exchange, routing_key=self._topic, body=message,
-                                           properties=pika.BasicProperties(content_type='application/json', delivery_mode=1), mandatory=True)
-        if not delivery:
+        route, record, lane = routed(message)
+        with self._lock:
+            # Records of higher lanes do not wait for the spool to be drained
+            self.recover(not lane)
+            if self._spool is not None and (self._unavailable or self._blocked or (not self._spool.empty() and not lane)):
+                self._spool.append(message)
+                return
+            if self._batch_size <= 1:
+                self.deliver([record], route, lane)
+                return
+            # Every destination has a batch per lane
+            destination = self.destination(route)
+            batch = destination.batches.get(lane)
+            if batch is None:
+                batch = destination.batches[lane] = LogBatch(destination, lane)
+            if batch.records and self._batch_max_bytes and batch.bytes + len(record) > self._batch_max_bytes:
+                self.flush_batch(batch)
+            if not batch.records:
+                batch.started = time.time()
+                self._batched.append(batch)
+            batch.records.append(record)
+            batch.bytes += len(record)
+            if len(batch.records) >= self._batch_size or \
+                    (self._batch_max_bytes and batch.bytes >= self._batch_max_bytes):
+                self.flush_batch(batch)
+            elif self.batch_expired():
+                self.flush()
+
+    def batch_expired(self):
+        # The oldest batch is the first one
+        return bool(self._batched) and (time.time() - self._batched[0].started) * 1000 >= self._batch_linger
+
+    def flush(self):
+        # Higher lanes first
+        with self._lock:
+            for batch in sorted(self._batched, key=lambda batch: -batch.lane):
+                self.flush_batch(batch)
+
+    def flush_batch(self, batch):
+        with self._lock:
+            if not batch.records:
+                return
+            records = batch.records
+            batch.records = []
+            batch.bytes = 0
+            self._batched.remove(batch)
+            self._logger.debug('Flushing batch of %i messages', len(records))
+            self.deliver(records, batch.destination.route, batch.lane)
+            batch.flushes += 1
+            self.settle()
+
+    def mark(self, callback):
+        # Records are delivered, or spooled, once the batches they are in
+        # are flushed
+        with self._lock:
+            self._marks.append(([(batch, batch.flushes) for batch in self._batched], callback))
+            self.settle()
+
+    def settle(self):
+        with self._lock:
+            while self._marks and all(batch.flushes > flushes for batch, flushes in self._marks[0][0]):
+                self.delivered(self._marks.popleft()[1])
+
+    def delivered(self, callback):
+        # Messages are confirmed as they are published
+        callback()
+
+    def deliver(self, records, route=None, lane=0):
+        if self.publish_records(records, route, lane):
+            return
+        if self._spool is None:
             self.restart()
+            return
+        self._logger.warning('Delivery failed. Spooling %i messages' % len(records))
+        for record in records:
+            self._spool.append(record if route is None and not lane else (route, record, lane))
+        self.unavailable()
+
+    def encode(self, records):
+        # Messages, as (body, content type, content encoding), for a list of
+        # records
+        if self._format == 'msgpack':
+            if self._batch_size <= 1:
+                messages = [(record, 'application/msgpack') for record in records]
+            else:
+                messages = [(array_header(len(records)) + b''.join(records), 'application/msgpack')]
+        elif self._batch_size <= 1:
+            messages = [(record, 'application/json') for record in records]
+        elif self._batch_format == 'ndjson':
+            messages = [('\n'.join(records), 'application/x-ndjson')]
+        else:
+            messages = [('['+','.join(records)+']', 'application/json')]
+        return [self.compress(body, content_type) for body, content_type in messages]
+
+    def compress(self, body, content_type):
+        # Only messages of at least compression_min_bytes are compressed
+        if self._compress is None or len(body) < self._compress_min:
+            return body, content_type, None
+        data = body if isinstance(body, bytes) else body.encode('utf-8')
+        return self._compress(data), content_type, self._compression
+
+    def publish_records(self, records, route=None, lane=0):
+        # False when the records have to be sent again later. The records of
+        # a refused destination are dropped.
+        destination = self.destination(route)
+        if destination.refused_until > time.time():
+            DROPPED.inc(len(records), 'refused')
+            return True
+        try:
+            self.prepare(destination)
+        except ChannelClosed as e:
+            self.refuse(destination, e)
+            DROPPED.inc(len(records), 'refused')
+            return True
+        except (AMQPError, LogDispatchException) as e:
+            self._logger.warning('Opening destination %r failed: %r' % (destination.key, e))
+            return False
+        return all(self.publish(body, content_type, content_encoding, destination, lane) for body, content_type, content_encoding in self.encode(records))
+
+    def publish(self, body, content_type, content_encoding=None, destination=None, lane=0):
+        destination = destination or self._destination
+        self._logger.debug('Sending message: %r', body)
+        started = time.time()
+        try:
+            delivered = destination.channel.basic_publish(exchange=destination.exchange, routing_key=destination.topic, body=body,
+                                           properties=pika.BasicProperties(content_type=content_type, content_encoding=content_encoding, delivery_mode=1,
+                                                                           priority=lane if self._amqp_priority else None), mandatory=True)
+        except AMQPError as e:
+            self._logger.warning('Publishing failed: %r' % e)
+            return False
+        PUBLISH_TIME.observe(time.time() - started)
+        PUBLISHED.inc()
+        self._message_number += 1
+        if delivered:
+            self._acked += 1
+            ACKED.inc()
+        else:
+            self._nacked += 1
+            NACKED.inc()
+        return delivered
+
+    def unavailable(self):
+        if not self._unavailable:
+            self._logger.warning('Server unavailable. Spooling messages in %s' % self._spool.path)
+        self._unavailable = True
+        self._retry_at = time.time() + self._retry_delay
+
+    def recover(self, drain=True):
+        if self._spool is None:
+            return
+        if self._blocked and not self._unavailable:
+            # Connection.Unblocked is only read while the connection
+            # processes its events, and nothing is published meanwhile
+            try:
+                self._connection.process_data_events(time_limit=0)
+            except AMQPError as e:
+                self._logger.warning('Blocked connection failed: %r' % e)
+                self._blocked = False
+                self.unavailable()
+        if self._unavailable and time.time() >= self._retry_at:
+            try:
+                self.reconnect()
+                self._unavailable = False
+                self._retry_delay = 1
+                self._logger.info('Server available again. Draining %i spooled messages' % len(self._spool))
+            except Exception as e:
+                self._retry_delay = min(self._retry_delay * 2, 60)
+                self._retry_at = time.time() + self._retry_delay
+                self._logger.warning('Reconnection failed (%r). Retrying in %i seconds' % (e, self._retry_delay))
+        if drain and not self._unavailable and not self._blocked and not self._spool.empty():
+            # With priority lanes the spool is drained a part at a time, so
+            # that queued records of higher lanes are not held back
+            self.drain(1000 if self._lanes else None)
+
+    def drain(self, limit=None):
+        drained = 0
+        while not self._spool.empty() and not self._unavailable and not self._blocked and (limit is None or drained < limit):
+            messages = self._spool.peek(max(self._batch_size, 1))
+            # Consecutive records of the same route and lane are published
+            # together
+            for (route, lane), group in groupby(messages, lambda message: routed(message)[::2]):
+                if not self.publish_records([routed(message)[1] for message in group], route, lane):
+                    self.unavailable()
+                    return
+            self._spool.commit()
+            drained += len(messages)
+
+    def tick(self):
+        with self._lock:
+            self.recover()
+            if self.batch_expired():
+                self.flush()
+
+    def flusher_interval(self):
+        if self._batch_size > 1 and self._batch_linger > 0:
+            return self._batch_linger / 1000.0
+        if self._spool is not None:
+            return 1.0
 
     def on_delivery_confirmation(self, method_frame):
         confirmation_type = method_frame.method.NAME.split('.')[1].lower()
@@ -204,23 +648,36 @@ class LogPublisher(object):
 
     def channel_close(self):
         self._logger.debug('Closing channel')
-        if self._channel.is_open:
-            self._channel.close()
-
-    def exchange_close(self):
-        self._logger.debug('Closing exchange: %s' % self._exchange)
-        if self._channel.is_open:
-            self._channel.exchange_delete(exchange=self._exchange)
-
-    def queue_close(self):
-        self._logger.debug('Closing queue: %s' % self._queue)
-        if self._channel.is_open:
-            self._channel.queue_delete(queue=self._queue)
-
-    def queue_unbind(self):
-        self._logger.debug('Unbinding queue "%s" from exchange "%s" with key "%s"' % (self._queue, self._exchange, self._topic))
-        if self._channel.is_open:
-            self._channel.queue_unbind(queue=self._queue, exchange=self._exchange, routing_key=self._topic)
+        for channel in self._channels:
+            if channel.is_open:
+                channel.close()
+
+    def exchange_close(self, destination=None):
+        destination = destination or self._destination
+        if ('exchange', destination.exchange) not in self._declared:
+            return
+        self._logger.debug('Closing exchange: %s' % destination.exchange)
+        self._declared.discard(('exchange', destination.exchange))
+        if destination.channel.is_open:
+            destination.channel.exchange_delete(exchange=destination.exchange)
+
+    def queue_close(self, destination=None):
+        destination = destination or self._destination
+        if ('queue', destination.queue) not in self._declared:
+            return
+        self._logger.debug('Closing queue: %s' % destination.queue)
+        self._declared.discard(('queue', destination.queue))
+        if destination.channel.is_open:
+            destination.channel.queue_delete(queue=destination.queue)
+
+    def queue_unbind(self, destination=None):
+        destination = destination or self._destination
+        if ('binding', destination.queue, destination.exchange, destination.topic) not in self._declared:
+            return
+        self._logger.debug('Unbinding queue "%s" from exchange "%s" with key "%s"' % (destination.queue, destination.exchange, destination.topic))
+        self._declared.discard(('binding', destination.queue, destination.exchange, destination.topic))
+        if destination.channel.is_open:
+            destination.channel.queue_unbind(queue=destination.queue, exchange=destination.exchange, routing_key=destination.topic)
 
     def disconnect(self):
         self._logger.debug('Disconnecting')
@@ -229,9 +686,11 @@ class LogPublisher(object):
 
     def connection_blocked_callback(self, unused_frame):
         self._logger.debug('Connection blocked callback')
+        self._blocked = True
 
     def connection_unblocked_callback(self, unused_frame):
         self._logger.debug('Connection unblocked callback')
+        self._blocked = False
 
     def connection_backpressure_callback(self, unused_frame):
         self._logger.debug('Connection backpressure callback')
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+
+import time
+import resource
+from LogPublisher import LogPublisher
+from LogFileHandler import LogFileHandler
+from LogMetrics import LINES_READ, RECORDS_READ, PROCESS_TIME
+
+
+class FakeChannel(object):
+    # The calls of LogPublisher to a pika BlockingChannel. Every publication
+    # waits latency seconds for its confirmation, like a broker would.
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.is_open = True
+
+    def ignore(self, *args, **kwargs):
+        return None
+
+    confirm_delivery = add_on_cancel_callback = add_on_return_callback = ignore
+    exchange_declare = exchange_delete = queue_declare = queue_delete = queue_bind = queue_unbind = ignore
+
+    def basic_publish(self, *args, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        return True
+
+    def close(self):
+        self.is_open = False
+
+
+class FakeConnection(object):
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.is_open = True
+
+    def add_on_connection_blocked_callback(self, callback):
+        pass
+
+    def add_on_connection_unblocked_callback(self, callback):
+        pass
+
+    def channel(self):
+        return FakeChannel(self.latency)
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+
+class BrokerSink(LogPublisher):
+    # The blocking publisher, batching and encoding included, connected to
+    # an in-process broker instead of RabbitMQ
+
+    def __init__(self, config, logger, latency=0.001):
+        super(BrokerSink, self).__init__(dict(config, spool_path=''), logger)
+        self._latency = latency
+
+    def dispatch(self, destination=None):
+        return None
+
+    def connect(self):
+        self._connection = FakeConnection(self._latency)
+
+
+# Pushes whole files through the file handler, buffer and filters of their
+# rule as fast as they can be read, and measures every stage.
+class LogReplay(object):
+
+    def __init__(self, sink):
+        self.sink     = sink
+        self.files    = 0
+        self.bytes    = 0
+        self.lines    = 0
+        self.built    = 0
+        self.records  = 0
+        self.read     = 0
+        self.process  = 0
+        self.publish  = 0
+        self.started  = None
+        self.stopped  = None
+
+    def start(self):
+        self.started = time.time()
+        self.sink.start()
+
+    def stop(self):
+        started = time.time()
+        self.sink.stop()
+        self.stopped = time.time()
+        self.publish += self.stopped - started
+
+    def replay(self, path, rule):
+        # Records held at the end of the file (multiline, collapsed) are
+        # flushed: the file is complete
+        lines, built, processed = LINES_READ.total(), RECORDS_READ.total(), PROCESS_TIME.sum
+        file = LogFileHandler(path, rule.filters, None, **rule.options)
+        buffer = file.get_buffer()
+        while True:
+            started = time.time()
+            read = file.tail()
+            self.read += time.time() - started
+            if read:
+                self.send(buffer)
+            else:
+                buffer.flush()
+                self.send(buffer)
+                break
+        self.files += 1
+        self.bytes += file.position
+        file.close()
+        self.lines += LINES_READ.total() - lines
+        self.built += RECORDS_READ.total() - built
+        # Reading includes the processing (splitting, filtering and
+        # serializing) of every chunk pushed
+        spent = PROCESS_TIME.sum - processed
+        self.process += spent
+        self.read -= spent
+
+    def send(self, buffer):
+        started = time.time()
+        while not buffer.empty():
+            self.sink.send(buffer.pop())
+            self.records += 1
+        self.publish += time.time() - started
+
+    def report(self):
+        elapsed = max(self.stopped - self.started, 1e-9)
+        # ru_maxrss is in kilobytes on Linux
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+        return ['Replay: {0} files, {1} lines, {2} records, {3:.1f} MB in {4:.2f} s'.format(self.files, self.lines, self.built, self.bytes / 1e6, elapsed),
+                'Replay: {0:.0f} lines/s, {1:.1f} MB/s, {2} records sent'.format(self.lines / elapsed, self.bytes / 1e6 / elapsed, self.records),
+                'Replay: read {0:.2f} s, process {1:.2f} s, publish {2:.2f} s'.format(self.read, self.process, self.publish),
+                'Replay: peak RSS {0:.1f} MB'.format(rss)]
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+import os, re
+from LogFilter import LogFilterSet
+from LogPoller import remote_filesystem
+
+
+GLOB = re.compile(r'[*?[]')
+
+def glob_regex(pattern):
+    # '**/' matches any number of directories, '*' and '?' do not cross '/'
+    regex, i = '', 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += '(?:.*/)?'
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += '.*'
+            i += 2
+        elif pattern[i] == '*':
+            regex += '[^/]*'
+            i += 1
+        elif pattern[i] == '?':
+            regex += '[^/]'
+            i += 1
+        elif pattern[i] == '[' and pattern.find(']', i + 2) != -1:
+            end = pattern.find(']', i + 2)
+            klass = pattern[i+1:end]
+            if klass.startswith('!'):
+                klass = '^' + klass[1:]
+            regex += '[' + klass.replace('\\', '\\\\') + ']'
+            i = end + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+    return re.compile(regex + r'\Z')
+
+
+# A rule of the filter file: the files it follows (a path or a glob
+# pattern), their filters and the options of their handlers. key identifies
+# the rule across reloads of the filter file.
+class LogRule():
+    def __init__(self, pattern, filters, key=None, **options):
+        self.pattern = pattern
+        self.key = key or pattern
+        # Paths of the files followed with this rule
+        self.paths = set()
+        poll = options.pop('poll', 'auto')
+        route = options.pop('route', None)
+        self.options = options
+        # Compiled once and shared by every file of the rule
+        self.filters = LogFilterSet(list(filters), options.get('encoding', 'utf-8'), options.get('errors', 'replace'), route)
+        self.literal = not GLOB.search(pattern)
+        if self.literal:
+            self.directory = os.path.dirname(pattern)
+            self.recursive = False
+            self.regex = None
+        else:
+            parts = pattern.split('/')
+            index = next(i for i, part in enumerate(parts) if GLOB.search(part))
+            self.directory = '/'.join(parts[:index]) or '/'
+            self.recursive = index < len(parts) - 1 or '**' in parts[index]
+            self.regex = glob_regex(pattern)
+        # Files on remote filesystems are polled: inotify does not see the
+        # writes of other hosts
+        self.poll = remote_filesystem(self.directory) if poll == 'auto' else bool(poll)
+
+    def match(self, path):
+        if self.literal:
+            return path == self.pattern
+        return self.regex.match(path) is not None
+
+    def discover(self, directory=None):
+        # Existing files of the rule, under directory if given
+        if self.literal:
+            if os.path.isfile(self.pattern) and (directory is None or os.path.dirname(self.pattern) == directory):
+                return [self.pattern]
+            return []
+        directory = directory or self.directory
+        if not os.path.isdir(directory):
+            return []
+        if not self.recursive:
+            paths = [os.path.join(directory, name) for name in os.listdir(directory)]
+        else:
+            paths = [os.path.join(root, name) for root, dirs, files in os.walk(directory) for name in files]
+        return sorted(path for path in paths if self.match(path) and os.path.isfile(path))
+
+    def covers(self, directory):
+        # Whether files of this rule can appear in directory
+        if self.literal or not self.recursive:
+            return directory == self.directory
+        return directory == self.directory or directory.startswith(self.directory.rstrip('/') + '/')
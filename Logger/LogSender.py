@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import threading
+from collections import deque
+from LogSpool import LogSpool
+from LogMetrics import QUEUE_DEPTH, DROPPED
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+def lane(message):
+    # Lane of a (route, record, lane) record, 0 for the other ones
+    return message[2] if isinstance(message, tuple) else 0
+
+
+# Queue with a FIFO lane per priority. Lanes are served by stride scheduling:
+# every lane gets a share of the records proportional to its weight, higher
+# lanes first on ties, so busy low lanes slow down but never starve. Marks
+# are released once every record put before them was taken.
+class LogLaneQueue(queue.Queue):
+
+    def __init__(self, maxsize=0, weights=(1,)):
+        self.weights = weights
+        queue.Queue.__init__(self, maxsize)
+
+    def _init(self, maxsize):
+        self.lanes  = [deque() for weight in self.weights]
+        self.passes = [0.0] * len(self.weights)
+        self.clock  = 0.0
+        self.puts   = [0] * len(self.weights)
+        self.gets   = [0] * len(self.weights)
+        self.marks  = deque()
+
+    def _qsize(self, len=len):
+        return sum(len(records) for records in self.lanes)
+
+    def _put(self, item):
+        index = min(lane(item), len(self.lanes) - 1)
+        if not self.lanes[index]:
+            # Idle lanes do not save up turns
+            self.passes[index] = max(self.passes[index], self.clock)
+        self.lanes[index].append(item)
+        self.puts[index] += 1
+
+    def _get(self):
+        index = min((index for index, records in enumerate(self.lanes) if records), key=lambda index: (self.passes[index], -index))
+        self.clock = self.passes[index]
+        self.passes[index] += 1.0 / self.weights[index]
+        self.gets[index] += 1
+        return self.lanes[index].popleft()
+
+    def discard(self):
+        # Drops the oldest record of the lowest lane
+        with self.mutex:
+            for index, records in enumerate(self.lanes):
+                if records:
+                    records.popleft()
+                    self.gets[index] += 1
+                    self.not_full.notify()
+                    return
+        raise queue.Empty
+
+    def mark(self, callback):
+        with self.mutex:
+            self.marks.append((list(self.puts), callback))
+
+    def released(self):
+        with self.mutex:
+            marks = []
+            while self.marks and all(gets >= puts for gets, puts in zip(self.gets, self.marks[0][0])):
+                marks.append(self.marks.popleft()[1])
+            return marks
+
+
+# Records are enqueued by the event handlers and published by a dedicated
+# thread that owns the publisher connection. With priority lanes, records of
+# higher lanes are published first.
+class LogSender(object):
+
+    OVERFLOW_POLICIES = ('block', 'drop_oldest', 'spill')
+
+    def __init__(self, publisher, config, logger):
+        self._publisher      = publisher
+        self._logger         = logger
+        weights              = config.get('priority_weights', [1, 2, 4, 8]) if config.get('priority_lanes') else [1]
+        self._queue          = LogLaneQueue(config.get('sender_queue_size', 10000), weights)
+        self._overflow       = config.get('sender_overflow', 'block')
+        self._spill          = None
+        self._tick           = max(config.get('batch_linger', 100), 10) / 1000.0
+        if self._overflow not in self.OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: %s' % self._overflow)
+        if self._overflow == 'spill':
+            self._spill      = LogSpool(config.get('sender_spill_path', 'remotelogger.spill'),
+                                        config.get('spool_segment_bytes', 16777216),
+                                        config.get('spool_max_bytes', 1073741824),
+                                        config.get('spool_fsync', 'segment'),
+                                        config.get('message_format', 'json') == 'msgpack')
+
+        self._thread         = None
+        self._stopping       = False
+        self._spill_lock     = threading.Lock()
+        self._dropped        = 0
+        self._overflowing    = False
+        QUEUE_DEPTH.set_function(self.depth)
+
+    def start(self):
+        self._logger.debug('Starting sender thread')
+        self._stopping = False
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._started = threading.Event()
+        self._error = None
+        self._thread.start()
+        # Errors starting the publisher are raised to the caller
+        self._started.wait()
+        if self._error is not None:
+            self._thread.join()
+            self._thread = None
+            raise self._error
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._logger.debug('Stopping sender thread (%i records pending)' % self.depth())
+        self._stopping = True
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+        self._thread = None
+
+    def depth(self):
+        return self._queue.qsize() + (len(self._spill) if self._spill is not None else 0)
+
+    def dropped(self):
+        return self._dropped
+
+    def mark(self, callback):
+        # The mark follows the records queued before it: it is handed to the
+        # publisher once they all were. Spilled records are on disk already.
+        self._queue.mark(callback)
+
+    def release(self):
+        if self._queue.marks:
+            for callback in self._queue.released():
+                self._publisher.mark(callback)
+
+    def send(self, message):
+        # Records of higher lanes do not wait for the spill to be drained
+        if self._spill is not None and not self._spill.empty() and not lane(message):
+            with self._spill_lock:
+                if not self._spill.empty():
+                    self._spill.append(message)
+                    return
+        if self._overflow == 'block':
+            self._queue.put(message)
+            return
+        try:
+            self._queue.put_nowait(message)
+            self._overflowing = False
+            return
+        except queue.Full:
+            self.overflow()
+        if self._overflow == 'drop_oldest':
+            while True:
+                try:
+                    self._queue.discard()
+                    self._dropped += 1
+                    DROPPED.inc(1, 'queue')
+                except queue.Empty:
+                    pass
+                try:
+                    self._queue.put_nowait(message)
+                    return
+                except queue.Full:
+                    continue
+        else:
+            with self._spill_lock:
+                self._spill.append(message)
+
+    def overflow(self):
+        if not self._overflowing:
+            self._overflowing = True
+            self._logger.warning('Sender queue full (%i records). Applying overflow policy: %s' % (self._queue.maxsize, self._overflow))
+
+    def drain_spill(self):
+        # Spilled records are only sent once the queue is empty, and new
+        # records keep being spilled until the spill is drained.
+        if self._spill is None or self._spill.empty():
+            return False
+        self._logger.debug('Draining spill: %i records' % len(self._spill))
+        while not self._spill.empty() and self._queue.empty():
+            for record in self._spill.peek(1000):
+                self._publisher.send(record)
+            with self._spill_lock:
+                self._spill.commit()
+        return True
+
+    def run(self):
+        try:
+            self._publisher.start()
+        except Exception as e:
+            self._error = e
+            return
+        finally:
+            self._started.set()
+        while True:
+            try:
+                message = self._queue.get(timeout=self._tick)
+            except queue.Empty:
+                self._publisher.tick()
+                self.release()
+                if self.drain_spill():
+                    continue
+                if self._stopping:
+                    break
+                continue
+            self._publisher.send(message)
+            self.release()
+        self._publisher.stop()
+        if self._spill is not None:
+            self._spill.close()
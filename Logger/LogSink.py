@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import time
+import socket
+import logging
+import threading
+from LogMetrics import DROPPED
+
+# Buffers of a single writev call
+try:
+    IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+
+def record_of(message):
+    # Routes and lanes only mean something to the AMQP publisher
+    record = message[1] if isinstance(message, tuple) else message
+    return record if isinstance(record, bytes) else record.encode('utf-8')
+
+def vectored(write, buffers):
+    # Writes every buffer with write(list of buffers) -> bytes written, e.g.
+    # os.writev or socket.sendmsg, resuming after partial writes
+    index, offset = 0, 0
+    while index < len(buffers):
+        chunk = buffers[index:index + IOV_MAX]
+        if offset:
+            chunk[0] = memoryview(buffers[index])[offset:]
+        written = write(chunk)
+        while index < len(buffers) and written >= len(buffers[index]) - offset:
+            written -= len(buffers[index]) - offset
+            index, offset = index + 1, 0
+        offset += written
+
+
+# Where the records go. Records are sent one by one, and tick() is called
+# regularly (by the sender thread, or by the flusher thread of the sink) to
+# send the ones waiting in batches.
+class LogSink(object):
+
+    def __init__(self, logger=logging, flusher=True):
+        self._logger         = logger
+        self._use_flusher    = flusher
+        self._flusher        = None
+        self._flusher_stop   = None
+
+    def start(self):
+        self.flusher_start()
+
+    def send(self, message):
+        raise NotImplementedError
+
+    def tick(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def mark(self, callback):
+        # Calls callback once the records sent before are delivered, e.g. to
+        # save the offset they were read up to
+        callback()
+
+    def stop(self):
+        self.flusher_stop()
+        self.flush()
+
+    def flusher_start(self):
+        if not self._use_flusher or self._flusher is not None or self.flusher_interval() is None:
+            return
+        self._logger.debug('Starting flusher (interval: %.3f s)' % self.flusher_interval())
+        self._flusher_stop = threading.Event()
+        self._flusher = threading.Thread(target=self.flusher_loop, args=(self._flusher_stop,))
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def flusher_stop(self):
+        if self._flusher is None:
+            return
+        self._logger.debug('Stopping flusher')
+        self._flusher_stop.set()
+        if self._flusher is not threading.current_thread():
+            self._flusher.join()
+        self._flusher = None
+
+    def flusher_loop(self, stop):
+        while not stop.wait(self.flusher_interval()):
+            self.tick()
+
+    def flusher_interval(self):
+        return None
+
+
+class LogNullSink(LogSink):
+
+    def __init__(self, logger=logging, flusher=True):
+        super(LogNullSink, self).__init__(logger, flusher)
+        self.records = 0
+
+    def send(self, message):
+        self.records += 1
+
+
+# Records are buffered and written with as few system calls as possible:
+# once buffer_bytes are pending, or after linger milliseconds. Writes that
+# fail drop their records and the output is opened again, after a delay
+# doubling up to 60 seconds. JSON records are followed by separator.
+class LogBatchSink(LogSink):
+
+    def __init__(self, separator=b'\n', buffer_bytes=65536, linger=100, logger=logging, flusher=True):
+        super(LogBatchSink, self).__init__(logger, flusher)
+        self.separator     = separator
+        self.buffer_bytes  = buffer_bytes
+        self.linger        = linger
+        self.buffers       = []
+        self.pending       = 0
+        self.started       = None
+        self.batched       = 0
+        self.failed        = False
+        self.retry_at      = 0
+        self.retry_delay   = 1
+        self.marks         = []
+        self.lock          = threading.RLock()
+
+    def start(self):
+        with self.lock:
+            self.open()
+        super(LogBatchSink, self).start()
+
+    def stop(self):
+        super(LogBatchSink, self).stop()
+        with self.lock:
+            self.close()
+
+    def send(self, message):
+        record = record_of(message)
+        with self.lock:
+            if not self.buffers:
+                self.started = time.time()
+            self.buffers.append(record)
+            if self.separator:
+                self.buffers.append(self.separator)
+            self.pending += len(record) + len(self.separator)
+            self.batched += 1
+            if self.pending >= self.buffer_bytes or self.expired():
+                self.flush()
+
+    def expired(self):
+        return bool(self.buffers) and (time.time() - self.started) * 1000 >= self.linger
+
+    def mark(self, callback):
+        # Records dropped by a failed write are done too
+        with self.lock:
+            if not self.buffers:
+                callback()
+            else:
+                self.marks.append(callback)
+
+    def tick(self):
+        with self.lock:
+            if self.expired():
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.buffers:
+                return
+            buffers, pending, records = self.buffers, self.pending, self.batched
+            self.buffers, self.pending, self.batched = [], 0, 0
+            try:
+                self.write_buffers(buffers, pending, records)
+            finally:
+                marks, self.marks = self.marks, []
+                for callback in marks:
+                    callback()
+
+    def write_buffers(self, buffers, pending, records):
+        with self.lock:
+            if self.failed and time.time() < self.retry_at:
+                DROPPED.inc(records, 'sink')
+                return
+            try:
+                if self.failed:
+                    self.close()
+                    self.open()
+                self.write(buffers, pending)
+            except (IOError, OSError, socket.error) as e:
+                DROPPED.inc(records, 'sink')
+                if not self.failed:
+                    self._logger.warning('%s failed (%r). Dropping records' % (self, e))
+                else:
+                    self.retry_delay = min(self.retry_delay * 2, 60)
+                self.failed = True
+                self.retry_at = time.time() + self.retry_delay
+                return
+            if self.failed:
+                self._logger.info('%s available again' % self)
+                self.failed = False
+                self.retry_delay = 1
+
+    def flusher_interval(self):
+        return self.linger / 1000.0 if self.linger > 0 else None
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def write(self, buffers, size):
+        raise NotImplementedError
+
+
+# Appends the records to a file, rotated to path.1 ... path.<backups> once
+# it reaches max_bytes (0 never rotates)
+class LogFileSink(LogBatchSink):
+
+    def __init__(self, path, max_bytes=104857600, backups=5, **options):
+        super(LogFileSink, self).__init__(**options)
+        self.path      = path
+        self.max_bytes = max_bytes
+        self.backups   = backups
+        self.fd        = None
+        self.size      = 0
+
+    def __str__(self):
+        return 'File output %s' % self.path
+
+    def open(self):
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.size = os.fstat(self.fd).st_size
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def rotate(self):
+        self.close()
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists('%s.%d' % (self.path, index)):
+                os.rename('%s.%d' % (self.path, index), '%s.%d' % (self.path, index + 1))
+        if self.backups:
+            os.rename(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+        self.open()
+
+    def write(self, buffers, size):
+        if self.max_bytes and self.size and self.size + size > self.max_bytes:
+            self.rotate()
+        if hasattr(os, 'writev'):
+            vectored(lambda chunk: os.writev(self.fd, chunk), buffers)
+        else:
+            vectored(lambda chunk: os.write(self.fd, chunk[0]), [b''.join(buffers)])
+        self.size += size
+
+
+# Writes the records to the standard output, e.g. for the log collector of a
+# container
+class LogStdoutSink(LogFileSink):
+
+    def __init__(self, **options):
+        super(LogStdoutSink, self).__init__('<stdout>', 0, 0, **options)
+
+    def __str__(self):
+        return 'Standard output'
+
+    def open(self):
+        self.fd = sys.stdout.fileno()
+
+    def close(self):
+        self.fd = None
+
+
+# Sends the records to a unix socket: a datagram per record, or a stream of
+# records
+class LogSocketSink(LogBatchSink):
+
+    SOCKET_TYPES = ('datagram', 'stream')
+
+    def __init__(self, path, socket_type='datagram', **options):
+        if socket_type not in self.SOCKET_TYPES:
+            raise ValueError('Unknown socket type: %s' % socket_type)
+        if socket_type == 'datagram':
+            options['separator'] = b''
+        super(LogSocketSink, self).__init__(**options)
+        self.path        = path
+        self.socket_type = socket_type
+        self.socket      = None
+
+    def __str__(self):
+        return 'Socket output %s' % self.path
+
+    def open(self):
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM if self.socket_type == 'datagram' else socket.SOCK_STREAM)
+        try:
+            self.socket.connect(self.path)
+        except socket.error:
+            self.close()
+            raise
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close()
+            self.socket = None
+
+    def write(self, buffers, size):
+        if self.socket is None:
+            self.open()
+        if self.socket_type == 'datagram':
+            for record in buffers:
+                self.socket.send(record)
+        elif hasattr(self.socket, 'sendmsg'):
+            vectored(self.socket.sendmsg, buffers)
+        else:
+            self.socket.sendall(b''.join(buffers))
+
+
+# Sends every record to several sinks. A sink raising an error does not stop
+# the other ones: it misses the records until it is started again, after a
+# delay doubling up to 60 seconds.
+class LogFanout(LogSink):
+
+    def __init__(self, sinks, logger=logging, flusher=True):
+        super(LogFanout, self).__init__(logger, flusher)
+        self.sinks    = sinks
+        self.failures = dict((sink, None) for sink in sinks)
+        self.delays   = dict((sink, 1) for sink in sinks)
+
+    def start(self):
+        # Starting only fails when every sink fails
+        errors = [error for error in (self.call(sink, sink.start) for sink in self.sinks) if error is not None]
+        if len(errors) == len(self.sinks):
+            raise errors[0]
+        super(LogFanout, self).start()
+
+    def stop(self):
+        self.flusher_stop()
+        for sink in self.sinks:
+            if self.failures[sink] is None:
+                self.call(sink, sink.stop)
+
+    def send(self, message):
+        for sink in self.sinks:
+            if self.available(sink):
+                self.call(sink, sink.send, message)
+            else:
+                DROPPED.inc(1, 'sink')
+
+    def tick(self):
+        for sink in self.sinks:
+            if self.available(sink):
+                self.call(sink, sink.tick)
+
+    def flush(self):
+        for sink in self.sinks:
+            if self.failures[sink] is None:
+                self.call(sink, sink.flush)
+
+    def mark(self, callback):
+        # Once every sink delivered the records. Failed sinks dropped them.
+        pending = [len(self.sinks)]
+        lock = threading.Lock()
+        def delivered():
+            with lock:
+                pending[0] -= 1
+                done = not pending[0]
+            if done:
+                callback()
+        for sink in self.sinks:
+            if self.failures[sink] is not None or self.call(sink, sink.mark, delivered) is not None:
+                delivered()
+
+    def available(self, sink):
+        retry_at = self.failures[sink]
+        if retry_at is None:
+            return True
+        if time.time() < retry_at:
+            return False
+        if self.call(sink, sink.start) is not None:
+            return False
+        self._logger.info('Output %s restarted' % sink)
+        self.failures[sink] = None
+        self.delays[sink] = 1
+        return True
+
+    def call(self, sink, method, *args):
+        try:
+            method(*args)
+        except Exception as e:
+            if self.failures[sink] is None:
+                self._logger.warning('Output %s failed (%r). Restarting it in %i seconds' % (sink, e, self.delays[sink]))
+            else:
+                self.delays[sink] = min(self.delays[sink] * 2, 60)
+            self.failures[sink] = time.time() + self.delays[sink]
+            return e
+        return None
+
+    def flusher_interval(self):
+        intervals = [interval for interval in (sink.flusher_interval() for sink in self.sinks) if interval is not None]
+        return min(intervals) if intervals else None
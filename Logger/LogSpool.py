@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import zlib
+import struct
+import logging
+import threading
+
+# Every record is stored as: length (4 bytes), crc32 (4 bytes), payload
+HEADER = struct.Struct('>II')
+# Payload of a tagged (route, record, lane) record: NUL, route, NUL, lane,
+# NUL, record. JSON and MessagePack records never start with NUL.
+ROUTED = b'\x00'
+
+
+class LogSpool(object):
+
+    FSYNC_POLICIES = ('always', 'segment', 'never')
+
+    def __init__(self, path, segment_bytes=16777216, max_bytes=1073741824, fsync='segment', binary=False):
+        self.path          = path
+        self.binary        = binary
+        self.segment_bytes = segment_bytes
+        self.max_bytes     = max_bytes
+        self.fsync         = fsync
+        if self.fsync not in self.FSYNC_POLICIES:
+            raise ValueError('Unknown fsync policy: %s' % self.fsync)
+
+        self.segments      = []
+        self.offset        = 0
+        self.count         = 0
+        self.size          = 0
+        self.writer        = None
+        self.peeked        = None
+        self.lock          = threading.RLock()
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self.recover()
+
+    def __len__(self):
+        return self.count
+
+    def empty(self):
+        return not self.count
+
+    def segment_path(self, seq):
+        return os.path.join(self.path, '%020d.seg' % seq)
+
+    def head_path(self):
+        return os.path.join(self.path, 'head')
+
+    def scan(self, seq, offset=0):
+        # Returns the number of valid records and the offset where the
+        # valid data ends. Anything after it was partially written.
+        count = 0
+        with open(self.segment_path(seq), 'rb') as stream:
+            stream.seek(offset)
+            while True:
+                header = stream.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                length, crc = HEADER.unpack(header)
+                data = stream.read(length)
+                if len(data) < length or zlib.crc32(data) & 0xffffffff != crc:
+                    break
+                count += 1
+                offset = stream.tell()
+        return count, offset
+
+    def recover(self):
+        self.segments = sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith('.seg'))
+        head = {}
+        if self.segments and os.path.isfile(self.head_path()):
+            try:
+                with open(self.head_path(), 'r') as stream:
+                    head = json.load(stream)
+            except ValueError:
+                head = {}
+        if head.get('segment') == (self.segments[0] if self.segments else None):
+            self.offset = head.get('offset', 0)
+        for seq in self.segments:
+            start = self.offset if seq == self.segments[0] else 0
+            count, valid = self.scan(seq, start)
+            size = os.path.getsize(self.segment_path(seq))
+            if valid < size:
+                logging.warning("Spool segment {0} has {1} corrupted bytes. Truncating".format(self.segment_path(seq), size - valid))
+                with open(self.segment_path(seq), 'r+b') as stream:
+                    stream.truncate(valid)
+            self.count += count
+            self.size += valid - start
+        if self.count:
+            logging.info("Recovered {0} spooled records from {1}".format(self.count, self.path))
+
+    def sync(self, stream):
+        stream.flush()
+        os.fsync(stream.fileno())
+
+    def roll(self):
+        if self.writer is not None:
+            if self.fsync != 'never':
+                self.sync(self.writer)
+            self.writer.close()
+        seq = self.segments[-1] + 1 if self.segments else 0
+        self.segments.append(seq)
+        self.writer = open(self.segment_path(seq), 'ab')
+
+    def encode(self, message):
+        if isinstance(message, tuple):
+            route, record, lane = message
+            return ROUTED + self.encode(route or '') + ROUTED + str(lane).encode('ascii') + ROUTED + self.encode(record)
+        return message if isinstance(message, bytes) else message.encode('utf-8')
+
+    def decode(self, data):
+        if data.startswith(ROUTED):
+            route, lane, record = data[1:].split(ROUTED, 2)
+            return ((route if str is bytes else route.decode('utf-8')) or None, self.decode(record), int(lane))
+        return data if str is bytes or self.binary else data.decode('utf-8')
+
+    def append(self, message):
+        data = self.encode(message)
+        record = HEADER.pack(len(data), zlib.crc32(data) & 0xffffffff) + data
+        with self.lock:
+            if self.writer is None or self.writer.tell() >= self.segment_bytes:
+                self.roll()
+            self.writer.write(record)
+            if self.fsync == 'always':
+                self.sync(self.writer)
+            self.count += 1
+            self.size += len(record)
+            self.limit()
+
+    def limit(self):
+        while self.max_bytes and self.size > self.max_bytes and len(self.segments) > 1:
+            seq = self.segments.pop(0)
+            start = self.offset
+            count, valid = self.scan(seq, start)
+            os.remove(self.segment_path(seq))
+            self.offset = 0
+            self.count -= count
+            self.size -= valid - start
+            if self.peeked is not None:
+                # A sender may be between peek() and commit(): the records it
+                # read from the dropped segment are gone, the rest are still
+                # committed so that they are not sent again
+                index, offset, peeked = self.peeked
+                self.peeked = (index - 1, offset, peeked - count) if index else None
+            logging.warning("Spool {0} exceeded {1} bytes. Dropped {2} records".format(self.path, self.max_bytes, count))
+
+    def peek(self, n):
+        # Returns up to n records from the head of the spool. They are only
+        # removed by a later commit().
+        records = []
+        with self.lock:
+            if self.writer is not None:
+                self.writer.flush()
+            index, offset = 0, self.offset
+            while len(records) < n and index < len(self.segments):
+                with open(self.segment_path(self.segments[index]), 'rb') as stream:
+                    stream.seek(offset)
+                    while len(records) < n:
+                        header = stream.read(HEADER.size)
+                        if len(header) < HEADER.size:
+                            break
+                        length, crc = HEADER.unpack(header)
+                        data = stream.read(length)
+                        records.append(self.decode(data))
+                        offset = stream.tell()
+                if len(records) < n and index + 1 < len(self.segments):
+                    index, offset = index + 1, 0
+                else:
+                    break
+            self.peeked = (index, offset, len(records))
+        return records
+
+    def commit(self):
+        with self.lock:
+            if self.peeked is None:
+                return
+            index, offset, count = self.peeked
+            self.peeked = None
+            for seq in self.segments[:index]:
+                self.size -= os.path.getsize(self.segment_path(seq))
+                os.remove(self.segment_path(seq))
+            if index:
+                self.size += self.offset
+                self.offset = 0
+            del self.segments[:index]
+            self.size -= offset - self.offset
+            self.offset = offset
+            self.count -= count
+            if not self.count:
+                self.clear()
+            else:
+                self.save_head()
+
+    def save_head(self):
+        temp = self.head_path() + '.tmp'
+        with open(temp, 'w') as stream:
+            json.dump({'segment': self.segments[0], 'offset': self.offset}, stream)
+        os.rename(temp, self.head_path())
+
+    def clear(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        for seq in self.segments:
+            os.remove(self.segment_path(seq))
+        if os.path.isfile(self.head_path()):
+            os.remove(self.head_path())
+        self.segments = []
+        self.offset = 0
+        self.count = 0
+        self.size = 0
+
+    def close(self):
+        with self.lock:
+            if self.writer is not None:
+                if self.fsync != 'never':
+                    self.sync(self.writer)
+                self.writer.close()
+                self.writer = None
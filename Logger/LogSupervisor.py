@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import zlib
+import signal
+import logging
+import multiprocessing
+
+
+def shard(path, workers):
+    # Stable across runs and interpreters, unlike hash()
+    return (zlib.crc32(path.encode('utf-8')) & 0xffffffff) % workers
+
+
+# Partitions the rules across worker processes by file name and restarts the
+# workers that die. target(index, rules) runs in every worker.
+class LogSupervisor(object):
+
+    def __init__(self, target, rules, workers, restart_delay=1):
+        self.target        = target
+        self.workers       = workers
+        self.shards        = []
+        self.restart_delay = restart_delay
+        self.processes     = {}
+        self.started       = {}
+        self.stopping      = False
+        # Workers are forked so they inherit the parsed configuration and the
+        # signal handlers, whatever the default start method is
+        self.context       = multiprocessing.get_context('fork') if hasattr(multiprocessing, 'get_context') else multiprocessing
+        self.partition(rules)
+
+    def partition(self, rules):
+        self.shards = [[] for i in range(self.workers)]
+        for rule in rules:
+            self.shards[shard(rule['filename'], self.workers)].append(rule)
+
+    def start(self):
+        for index, rules in enumerate(self.shards):
+            if rules:
+                self.spawn(index)
+            else:
+                logging.info("Worker {0} has no files to observe".format(index))
+
+    def spawn(self, index):
+        process = self.context.Process(target=self.target, args=(index, self.shards[index]), name='worker-%i' % index)
+        process.daemon = False
+        process.start()
+        self.processes[index] = process
+        self.started[index] = time.time()
+        logging.info("Started worker {0} (pid {1}) observing {2} files".format(index, process.pid, len(self.shards[index])))
+
+    def reload(self, rules):
+        # Restarted workers get the new rules. Running workers are sent
+        # SIGHUP to reload the filter file themselves, keeping their files.
+        self.partition(rules)
+        for index, rules in enumerate(self.shards):
+            process = self.processes.get(index)
+            if process is not None and process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+            elif rules and index not in self.processes:
+                self.spawn(index)
+
+    def supervise(self):
+        # Restarts dead workers. A worker that keeps dying right after being
+        # started is restarted with an increasing delay.
+        delays = dict((index, self.restart_delay) for index in self.processes)
+        while not self.stopping:
+            for index, process in list(self.processes.items()):
+                if process is None or self.stopping or process.is_alive():
+                    continue
+                uptime = time.time() - self.started[index]
+                delays[index] = self.restart_delay if uptime > 60 else min(delays.get(index, self.restart_delay) * 2, 60)
+                logging.warning("Worker {0} (pid {1}) exited with code {2}. Restarting in {3} seconds".format(index, process.pid, process.exitcode, delays[index]))
+                self.started[index] = time.time() + delays[index]
+                self.processes[index] = None
+            for index, process in list(self.processes.items()):
+                if process is None and not self.stopping and time.time() >= self.started[index]:
+                    self.spawn(index)
+            time.sleep(1)
+
+    def stop(self, timeout=30):
+        self.stopping = True
+        processes = [process for process in self.processes.values() if process is not None]
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        deadline = time.time() + timeout
+        for process in processes:
+            process.join(max(deadline - time.time(), 0))
+            if process.is_alive():
+                logging.warning("Worker {0} did not stop in {1} seconds. Killing it".format(process.name, timeout))
+                os.kill(process.pid, signal.SIGKILL)
+                process.join()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# Bytes on the wire and CPU time per million lines for every message format
+# and compression, with batches of 100 records. Usage: bench_encoding.py [lines]
+import os, sys, time, random, logging
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+import LogFilter
+from LogBuffer import LogBuffer
+from LogPublisher import LogPublisher
+
+
+CONFIG = {'host': 'localhost', 'port': 5672, 'user': 'guest', 'pass': 'guest', 'exchange': 'bench', 'exchange_type': 'direct',
+          'queue': 'bench', 'routing_key': 'bench', 'heartbeat': 0, 'blocked_connection_timeout': 300,
+          'batch_size': 100, 'spool_path': '', 'compression_min_bytes': 0}
+
+def data(count):
+    random.seed(0)
+    lines = []
+    for i in range(count):
+        if random.random() < 0.2:
+            lines.append('2019-05-12 10:%02d:%02d ERROR job %d step %d failed: exit code %d' % (i // 60 % 60, i % 60, i % 977, i, i % 7))
+        else:
+            lines.append('2019-05-12 10:%02d:%02d INFO job %d step %d residual 1.0e-%d' % (i // 60 % 60, i % 60, i % 977, i, i % 12))
+    return ('\n'.join(lines) + '\n').encode('ascii')
+
+def run(chunk, count, format, compression):
+    LogFilter.set_format(format)
+    buffer = LogBuffer([LogFilter.LogFilter({'pattern': '^\\S+ \\S+ ERROR', 'severity': 'ERROR', 'verbosity': 1}),
+                        LogFilter.LogFilter({'pattern': '^\\S+ \\S+ INFO', 'severity': 'INFO', 'verbosity': 3})])
+    config = dict(CONFIG, message_format=format, compression=compression)
+    publisher = LogPublisher(config, logging, flusher=False)
+    size = 0
+    started = time.time()
+    for i in range(0, len(chunk), 65536):
+        buffer.push(chunk[i:i+65536])
+        records = []
+        while not buffer.empty():
+            records.append(buffer.pop())
+        for start in range(0, len(records), 100):
+            for body, content_type, content_encoding in publisher.encode(records[start:start+100]):
+                size += len(body)
+    elapsed = time.time() - started
+    return size * 1e6 / count, elapsed * 1e6 / count
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    chunk = data(count)
+    compressions = ['none', 'gzip']
+    try:
+        import zstandard
+        compressions.append('zstd')
+    except ImportError:
+        print('zstandard is not installed: skipping zstd')
+    print('{0:>8} {1:>12} {2:>16} {3:>16}'.format('format', 'compression', 'MB / 1M lines', 'CPU s / 1M lines'))
+    for format in ('json', 'msgpack'):
+        for compression in compressions:
+            size, cpu = run(chunk, count, format, compression)
+            print('{0:>8} {1:>12} {2:>16.1f} {3:>16.2f}'.format(format, compression, size / 1e6, cpu))
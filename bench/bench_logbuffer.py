@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# Micro-benchmark for LogBuffer.push: the cost per byte must stay constant
+# while the burst size (and the chunk size it is pushed in) grows.
+import os, sys, time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+from LogBuffer import LogBuffer
+from LogFilter import LogFilter
+
+
+def filters():
+    return [LogFilter({'pattern': '^ERROR', 'severity': 'ERROR'}),
+            LogFilter({'pattern': '^WARN', 'severity': 'WARNING'})]
+
+def burst(size):
+    line = 'INFO  a fairly ordinary log line with some payload 0123456789' + os.linesep
+    return (line * (size // len(line) + 1))[:size].encode('ascii')
+
+def run(size, chunk):
+    data = burst(size)
+    buffer = LogBuffer(filters())
+    start = time.time()
+    for i in range(0, len(data), chunk):
+        buffer.push(data[i:i+chunk])
+    while not buffer.empty():
+        buffer.pop()
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    print('{0:>12} {1:>12} {2:>10} {3:>12}'.format('bytes', 'chunk', 'seconds', 'ns/byte'))
+    for size in (1 << 20, 4 << 20, 16 << 20):
+        for chunk in (4096, 1 << 20, size):
+            elapsed = run(size, chunk)
+            print('{0:>12} {1:>12} {2:>10.3f} {3:>12.1f}'.format(size, chunk, elapsed, elapsed * 1e9 / size))
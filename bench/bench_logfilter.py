@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# Compares the combined regex engine of LogFilterSet.apply (on raw bytes)
+# with the sequential loop (LogFilterSet.apply_sequential) for growing rule
+# sets.
+import os, sys, time, random
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+from LogFilter import LogFilter, LogFilterSet
+
+
+SEVERITIES = ['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG']
+
+def rules(n, anchored):
+    filters = []
+    for i in range(n):
+        severity = SEVERITIES[i % len(SEVERITIES)]
+        if anchored:
+            filters.append({'pattern': '^%s rank %d: ' % (severity, i), 'severity': severity})
+        else:
+            filters.append({'pattern': 'rank %d: .*%s' % (i, severity.lower()), 'action': 'search', 'severity': severity})
+    return filters
+
+def lines(n, rules):
+    random.seed(0)
+    result = []
+    for i in range(n):
+        if random.random() < 0.1:
+            rank = random.randrange(rules)
+            result.append('%s rank %d: step %d %s' % (SEVERITIES[rank % len(SEVERITIES)], rank, i, SEVERITIES[rank % len(SEVERITIES)].lower()))
+        else:
+            result.append('TRACE iteration %d residual 1.0e-%d' % (i, i % 12))
+    return result
+
+def run(apply, data):
+    start = time.time()
+    for line in data:
+        apply(line)
+    return time.time() - start
+
+
+if __name__ == "__main__":
+    count = 20000
+    print('{0:>8} {1:>8} {2:>12} {3:>12} {4:>8}'.format('rules', 'anchored', 'sequential', 'combined', 'speedup'))
+    for anchored in (True, False):
+        for n in (1, 10, 50, 200):
+            filters = LogFilterSet([LogFilter(attributes) for attributes in rules(n, anchored)])
+            data = lines(count, n)
+            raw = [line.encode('ascii') for line in data]
+            assert [filters.apply(line) for line in raw] == [filters.apply_sequential(line) for line in data]
+            sequential = run(filters.apply_sequential, data)
+            combined = run(filters.apply, raw)
+            print('{0:>8} {1:>8} {2:>12.3f} {3:>12.3f} {4:>8.1f}'.format(n, str(anchored), sequential, combined, sequential / combined))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# Delivery latency of ERROR lines read among a flood of INFO lines, through
+# the sender queue and the in-process broker (0.5 ms per message, batches of
+# 10), with and without priority lanes. Usage: bench_priority.py [lines]
+import os, sys, time, logging
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+import LogFilter
+from LogBuffer import LogBuffer
+from LogSender import LogSender
+from LogReplay import BrokerSink
+
+
+CONFIG = {'host': 'localhost', 'port': 5672, 'user': 'guest', 'pass': 'guest', 'exchange': 'bench', 'exchange_type': 'direct',
+          'queue': 'bench', 'routing_key': 'bench', 'heartbeat': 0, 'blocked_connection_timeout': 300,
+          'batch_size': 10, 'batch_linger': 10, 'sender_queue_size': 0}
+
+class TimedSink(BrokerSink):
+    # Notes when every record is published
+
+    def __init__(self, config, logger, latency, published):
+        super(TimedSink, self).__init__(config, logger, latency)
+        self.published = published
+
+    def publish_records(self, records, route=None, lane=0):
+        delivered = super(TimedSink, self).publish_records(records, route, lane)
+        now = time.time()
+        for record in records:
+            self.published[record] = now
+        return delivered
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+def run(count, lanes):
+    LogFilter.set_lanes(4 if lanes else 0)
+    config = dict(CONFIG, priority_lanes=lanes, sender_queue_size=count)
+    buffer = LogBuffer([LogFilter.LogFilter({'pattern': '^ERROR', 'severity': 'ERROR'}),
+                        LogFilter.LogFilter({'pattern': '^INFO', 'severity': 'INFO'})])
+    queued, published = {}, {}
+    sender = LogSender(TimedSink(config, logging, 0.0005, published), config, logging)
+    sender.start()
+    started = time.time()
+    for start in range(0, count, 1000):
+        lines = ['%s step %d done' % ('ERROR' if i % 100 == 0 else 'INFO', i) for i in range(start, start + 1000)]
+        buffer.push(('\n'.join(lines) + '\n').encode('ascii'))
+        now = time.time()
+        while not buffer.empty():
+            message = buffer.pop()
+            queued[message[1] if isinstance(message, tuple) else message] = now
+            sender.send(message)
+        # Lines keep coming while the broker catches up
+        time.sleep(0.01)
+    sender.stop()
+    elapsed = time.time() - started
+    latencies = {'ERROR': [], 'INFO': []}
+    for record, when in queued.items():
+        latencies['ERROR' if '"ERROR"' in record else 'INFO'].append(published[record] - when)
+    return latencies, elapsed
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    print('{0:>6} {1:>8} {2:>12} {3:>12} {4:>10}'.format('lanes', 'lines', 'p50 (ms)', 'p99 (ms)', 'total (s)'))
+    for lanes in (False, True):
+        latencies, elapsed = run(count, lanes)
+        for severity in ('ERROR', 'INFO'):
+            values = latencies[severity]
+            print('{0:>6} {1:>8} {2:>12.1f} {3:>12.1f} {4:>10.2f}'.format('on' if lanes else 'off', severity,
+                                                                          percentile(values, 0.5) * 1000, percentile(values, 0.99) * 1000, elapsed))
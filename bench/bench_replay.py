@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+# Replays a synthetic log through every rule set of bench/rules with the
+# null sink and the in-process broker (batches of 100), every run in its own
+# process so that its peak RSS is its own. Usage: bench_replay.py [lines]
+import os, sys, shutil, tempfile, subprocess
+from generate_log import generate
+
+
+BENCH = os.path.dirname(os.path.abspath(__file__))
+CLI = os.path.join(BENCH, '..', 'remotelogger-cli.py')
+RUNS = [('null', []), ('broker', ['-bs', '100', '-rsl', '1'])]
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    directory = tempfile.mkdtemp()
+    try:
+        generate(os.path.join(directory, 'replay.log'), count)
+        for rules in sorted(os.listdir(os.path.join(BENCH, 'rules'))):
+            for sink, options in RUNS:
+                print('{0} ({1} sink):'.format(rules, sink))
+                output = subprocess.check_output([sys.executable, CLI, '--bench', '-f', os.path.join(BENCH, 'rules', rules), '-rs', sink,
+                                                  '-cp', '', '-spp', '', '-si', '0'] + options, cwd=directory, stderr=subprocess.STDOUT)
+                for line in output.decode('utf-8').splitlines():
+                    if 'Replay:' in line:
+                        print('    ' + line.split('Replay: ', 1)[1])
+    finally:
+        shutil.rmtree(directory)
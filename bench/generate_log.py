@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# Synthetic log of a parallel job: timestamped lines of many ranks with the
+# usual mix of levels, progress lines and Python stack traces.
+# Usage: generate_log.py PATH [lines] [seed]
+import sys, random
+
+
+MODULES = ['solver', 'mesh', 'io', 'comm', 'scheduler', 'checkpoint']
+ERRORS = ['ValueError: negative density in cell {0}', 'IOError: [Errno 5] Input/output error',
+          'RuntimeError: MPI_Allreduce failed on rank {0}', 'KeyError: \'boundary_{0}\'']
+
+def lines(count, seed=0):
+    random.seed(seed)
+    second, written = 0, 0
+    while written < count:
+        second += random.random() < 0.05
+        prefix = '2019-05-12 {0:02d}:{1:02d}:{2:02d},{3:03d} [rank {4}]'.format(10 + second // 3600 % 14, second // 60 % 60, second % 60,
+                                                                              random.randint(0, 999), random.randint(0, 255))
+        module = random.choice(MODULES)
+        kind = random.random()
+        if kind < 0.40:
+            yield '{0} DEBUG {1}: exchanging halo of block {2} ({3} bytes)'.format(prefix, module, random.randint(0, 4095), random.randint(1, 1 << 20))
+        elif kind < 0.85:
+            yield '{0} INFO {1}: iteration {2} residual {3:.6e}'.format(prefix, module, written, random.random() / (written + 1))
+        elif kind < 0.93:
+            yield '{0} INFO progress: {1}%'.format(prefix, written * 100 // count)
+        elif kind < 0.98:
+            yield '{0} WARNING {1}: step took {2:.2f} s, more than expected'.format(prefix, module, random.random() * 10)
+        elif kind < 0.995:
+            yield '{0} ERROR {1}: {2}'.format(prefix, module, random.choice(ERRORS).format(random.randint(0, 999)))
+        else:
+            trace = ['{0} ERROR {1}: unhandled exception'.format(prefix, module), 'Traceback (most recent call last):']
+            for depth in range(random.randint(2, 8)):
+                trace.append('  File "/opt/app/{0}.py", line {1}, in step_{2}'.format(module, random.randint(1, 2000), depth))
+                trace.append('    result = kernel(state, {0})'.format(depth))
+            trace.append(random.choice(ERRORS).format(random.randint(0, 999)))
+            for line in trace:
+                yield line
+            written += len(trace) - 1
+        written += 1
+
+def generate(path, count, seed=0):
+    with open(path, 'w') as stream:
+        for line in lines(count, seed):
+            stream.write(line + '\n')
+
+
+if __name__ == "__main__":
+    generate(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 1000000, int(sys.argv[3]) if len(sys.argv) > 3 else 0)
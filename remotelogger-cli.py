@@ -1,22 +1,53 @@
 #!/usr/bin/env python
-import sys, os, time, signal, logging
-from Logger.LogEventHandler import LogEventHandler
-from Logger.LogFilter import LogFilter, LogFilterSet
+import sys, os, time, glob, signal, logging
+from Logger.LogEventHandler import LogEventHandler, LogFilterFileHandler
+from Logger.LogFilter import LogFilter, ROUTE_KEYS, route_of, set_encoder, set_format, set_lanes
 from Logger.LogPublisher import LogPublisher
+from Logger.LogAsyncPublisher import LogAsyncPublisher
+from Logger.LogSender import LogSender
+from Logger.LogSink import LogNullSink, LogFileSink, LogStdoutSink, LogSocketSink, LogFanout
+from Logger.LogCheckpoint import LogCheckpointStore
+from Logger.LogMetrics import LogMetricsReporter
+from Logger.LogSupervisor import LogSupervisor, shard
+from Logger.LogRule import LogRule
+from Logger.LogReplay import LogReplay, BrokerSink
 from watchdog.observers import Observer
 import argparse
 import yaml
 
 publisher = None
 observer = None
+checkpoints = None
+reporter = None
+supervisor = None
+logeventhandler = None
+watcher = None
+worker_index = None
+# Files and sockets that can not be shared by several workers
+WORKER_PATHS = {'checkpoint_path': 'remotelogger.offsets', 'spool_path': 'remotelogger.spool',
+                'sender_spill_path': 'remotelogger.spill', 'metrics_socket': '', 'output_file_path': 'remotelogger.out'}
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 
 
 def kill():
-    if publisher is not None:
-        publisher.stop()
+    if watcher is not None:
+        watcher.stop()
+    if supervisor is not None:
+        supervisor.stop()
+    # Nothing is read once the sender stops, and the checkpoints only cover
+    # what it delivered
+    if logeventhandler is not None:
+        logeventhandler.stop()
     if observer is not None:
         observer.stop()
+        if observer.is_alive():
+            observer.join()
+    if publisher is not None:
+        publisher.stop()
+    if checkpoints is not None:
+        checkpoints.save()
+    if reporter is not None:
+        reporter.stop()
 
 def signal_handler(sig, frame):
     logging.info('Gracefully closing remotelogger (Signal: {signal}) ... '.format(signal=sig))
@@ -31,19 +62,188 @@ def signals_trap():
     signal.signal(signal.SIGSEGV,  signal_handler)
     signal.signal(signal.SIGTERM,  signal_handler)
 
-def log(path, filters, observer, publisher):
-    dir = os.path.split(path)[0]
-    logging.info("Remotelogger observing file: {path}".format(path=path))
+def load(path):
+    # Parses and validates the filter file
+    with open(path, 'r') as stream:
+        rules = yaml.safe_load(stream)
+    logging.debug("Filter file: {0} {1}".format(os.linesep, yaml.dump(rules)))
+    # validate(filters_yaml, schema)
+    for rule in rules:
+        rule['filename'] = os.path.abspath(rule['filename'])
+        for afilter in rule['filters']:
+            # The destination of a rule is the default of its filters
+            for key in ROUTE_KEYS:
+                if key in rule:
+                    afilter.setdefault(key, rule[key])
+            LogFilter(dict(afilter))
+    return rules
+
+def reload(sig=None, frame=None):
+    # On SIGHUP or when the filter file changes. The supervisor forwards the
+    # signal to the workers, that reload their own files.
+    logging.info("Reloading filter file: {0}".format(args.filter))
+    try:
+        rules = load(args.filter)
+    except Exception as e:
+        logging.error("[ERROR] Parsing FILTER file: {0} {1} Keeping the current filters".format(e, os.linesep))
+        return
+    if supervisor is not None:
+        supervisor.reload(rules)
+    elif logeventhandler is not None:
+        if worker_index is not None:
+            rules = [rule for rule in rules if shard(rule['filename'], config['workers']) == worker_index]
+        logeventhandler.reload(specs(config, rules))
+
+def watch(path):
+    # Reloads the filter file when it is written or replaced
+    global watcher
+    watcher = Observer()
+    watcher.schedule(LogFilterFileHandler(path, reload), path=os.path.dirname(path))
+    watcher.start()
+    logging.info("Reloading filter file on changes: {0}".format(path))
+
+
+def run(config, rules, index=None):
+    global publisher, observer, checkpoints, reporter, logeventhandler
+    checkpoint_path = config.get('checkpoint_path', 'remotelogger.offsets')
+    if index is not None:
+        config = dict(config)
+        for key, default in WORKER_PATHS.items():
+            if config.get(key, default):
+                config[key] = '{0}.{1}'.format(config.get(key, default), index)
+        if config.get('metrics_port', 0):
+            config['metrics_port'] += index
+
+    set_encoder(config.get('json_encoder', 'json'))
+    set_format(config.get('message_format', 'json'))
+    set_lanes(len(config.get('priority_weights', [1, 2, 4, 8])) if config.get('priority_lanes') else 0)
+    reporter = LogMetricsReporter(config.get('stats_interval', 60),
+                                  config.get('metrics_address', '127.0.0.1'),
+                                  config.get('metrics_port', 0),
+                                  config.get('metrics_socket', ''))
+    reporter.start()
+    if config.get('sender_queue_size', 10000) > 0:
+        publisher = LogSender(outputs(config, routes(rules), flusher=False), config, logging)
+    else:
+        publisher = outputs(config, routes(rules))
+    publisher.start()
+    if checkpoint_path:
+        path = config.get('checkpoint_path', 'remotelogger.offsets')
+        sources = [source for source in [checkpoint_path] + glob.glob(checkpoint_path + '.[0-9]*') if source != path and not source.endswith('.tmp')]
+        checkpoints = LogCheckpointStore(path, config.get('checkpoint_interval', 5), sources)
+    observer = Observer()
+    logeventhandler = LogEventHandler(observer, publisher, checkpoints,
+                                      read_budget=config.get('read_budget_bytes', 4194304),
+                                      idle_timeout=config.get('watch_idle_timeout', 300),
+                                      poll_min_interval=config.get('poll_min_interval', 0.5),
+                                      poll_max_interval=config.get('poll_max_interval', 30))
+
+    # Patterns can be globs, e.g. /var/log/jobs/**/*.log
+    logeventhandler.reload(specs(config, rules))
+
+    observer.start()
+
+def specs(config, rules):
+    return [(rule['filename'], rule['filters'], options(config, rule)) for rule in rules]
+
+def options(config, rule):
+    # Options of the file handlers of a rule
+    return dict(buffer_size=rule.get('buffer_size'),
+                max_line_length=rule.get('max_line_length'),
+                max_line_policy=rule.get('max_line_policy', 'split'),
+                encoding=rule.get('encoding', 'utf-8'),
+                errors=rule.get('errors', 'replace'),
+                poll=rule.get('poll', 'auto'),
+                multiline_start=rule.get('multiline_start'),
+                multiline_continue=rule.get('multiline_continue'),
+                multiline_max_lines=rule.get('multiline_max_lines', 500),
+                multiline_max_bytes=rule.get('multiline_max_bytes', 65536),
+                multiline_timeout=rule.get('multiline_timeout', 1),
+                chunk_size=config.get('read_chunk_bytes', 65536),
+                route=route_of(rule))
 
-    logeventhandler = LogEventHandler(  path=path,
-                                        filters=filters,
-                                        publisher=publisher,
-                                        patterns=[path],
-                                        ignore_patterns=[],
-                                        ignore_directories=True,
-                                        case_sensitive=True)
+def routes(rules):
+    # Routes of the rules (lines matching no filter) and of their filters
+    found = set(route_of(rule) for rule in rules) | set(route_of(afilter) for rule in rules for afilter in rule['filters'])
+    return sorted(found - set([None]))
 
-    observer.schedule(logeventhandler, path=dir, recursive=False)
+def outputs(config, routes=(), flusher=True):
+    # The sink records are sent to. With several outputs, only the fan-out
+    # runs a flusher thread.
+    names = config.get('outputs', ['amqp'])
+    options = dict(separator=b'' if config.get('message_format', 'json') == 'msgpack' else b'\n',
+                   buffer_bytes=config.get('output_buffer_bytes', 65536),
+                   linger=config.get('batch_linger', 100),
+                   logger=logging,
+                   flusher=flusher and len(names) == 1)
+    sinks = []
+    for name in names:
+        if name == 'amqp':
+            Publisher = LogAsyncPublisher if config.get('publisher', 'blocking') == 'async' else LogPublisher
+            sinks.append(Publisher(config, logging, options['flusher'], routes))
+        elif name == 'file':
+            sinks.append(LogFileSink(config.get('output_file_path', 'remotelogger.out'),
+                                     config.get('output_file_max_bytes', 104857600),
+                                     config.get('output_file_backups', 5), **options))
+        elif name == 'stdout':
+            sinks.append(LogStdoutSink(**options))
+        elif name == 'socket':
+            sinks.append(LogSocketSink(config['output_socket_path'], config.get('output_socket_type', 'datagram'), **options))
+        else:
+            raise ValueError('Unknown output: %s' % name)
+    if len(sinks) == 1:
+        return sinks[0]
+    return LogFanout(sinks, logging, flusher)
+
+def replay(config, rules, args):
+    # Offline mode: files are read at full speed into a local sink, without
+    # server, checkpoints or file watcher
+    set_encoder(config.get('json_encoder', 'json'))
+    set_format(config.get('message_format', 'json'))
+    set_lanes(len(config.get('priority_weights', [1, 2, 4, 8])) if config.get('priority_lanes') else 0)
+    if args.sink == 'file':
+        # The file sink appends: every replay starts from an empty file
+        open(args.sink_path, 'wb').close()
+        sink = LogFileSink(args.sink_path, 0, 0, separator=b'' if config.get('message_format', 'json') == 'msgpack' else b'\n', flusher=False)
+    elif args.sink == 'broker':
+        sink = BrokerSink(config, logging, args.sink_latency / 1000.0)
+    else:
+        sink = LogNullSink(flusher=False)
+    logrules = [LogRule(rule['filename'], [LogFilter(dict(afilter)) for afilter in rule['filters']], **options(config, rule)) for rule in rules]
+    if args.replay:
+        # The file is filtered by the first rule matching it, or the first rule
+        path = os.path.abspath(args.replay)
+        files = [(path, next((rule for rule in logrules if rule.match(path)), logrules[0]))]
+    else:
+        files = [(path, rule) for rule in logrules for path in rule.discover()]
+    replayer = LogReplay(sink)
+    replayer.start()
+    for path, rule in files:
+        logging.info("Replaying file: {0}".format(path))
+        replayer.replay(path, rule)
+    replayer.stop()
+    for line in replayer.report():
+        logging.info(line)
+
+def worker(index, rules):
+    global supervisor, watcher, worker_index
+    supervisor = None
+    watcher = None
+    worker_index = index
+    # Interrupts from the terminal reach the whole process group: the parent
+    # stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    parent = os.getppid()
+    try:
+        run(config, rules, index)
+    except Exception as e:
+        logging.error("[ERROR] Worker {0} failed to start: {1}".format(index, e))
+        kill()
+        sys.exit(1)
+    while os.getppid() == parent:
+        time.sleep(1)
+    logging.warning("Parent process died. Stopping worker {0}".format(index))
+    kill()
 
 
 def parse():
@@ -53,6 +253,11 @@ def parse():
     parser.add_argument('-d', '--debug', dest='debug', help='Debug mode', action='store_true')    
     parser.add_argument('-f', '--filter', dest='filter', type=str, help='Path to filter file', required=True)    
     parser.add_argument('-c', '--config', dest='config', type=str, help='Path to config file')
+    parser.add_argument('-r', '--replay', dest='replay', type=str, help='Replay a log file at full speed into a local sink and exit')
+    parser.add_argument('-b', '--bench', dest='bench', help='Replay the files of every rule at full speed into a local sink and exit', action='store_true')
+    parser.add_argument('-rs', '--sink', dest='sink', type=str, default='null', choices=['null', 'file', 'broker'], help='Sink of the replay and bench modes')
+    parser.add_argument('-rsp', '--sink_path', dest='sink_path', type=str, default='remotelogger.replay', help='Output file of the file sink')
+    parser.add_argument('-rsl', '--sink_latency', dest='sink_latency', type=float, default=1, help='Confirmation latency (ms) of the broker sink')
     parser.add_argument('-sh', '--host', dest='host', type=str, default='localhost', help='Server host')
     parser.add_argument('-u', '--user', dest='user', type=str, default='guest', help='Server username')
     parser.add_argument('-p', '--pass', dest='passwd', type=str, default='guest', help='Server password')
@@ -63,6 +268,51 @@ def parse():
     parser.add_argument('-et', '--exchange_type', dest='exchange_type', type=str, default='direct', help='Exchange type')
     parser.add_argument('-hb', '--heartbeat', dest='heartbeat', type=int, default=0, help='Hearbeat')
     parser.add_argument('-bct', '--blocked_connection_timeout', dest='blocked_connection_timeout', type=int, default=300, help='Blocked connection timeout')
+    parser.add_argument('-dt', '--dispatch_timeout', dest='dispatch_timeout', type=int, default=10, help='Seconds to wait for the consumer dispatch response')
+    parser.add_argument('-dr', '--dispatch_retries', dest='dispatch_retries', type=int, default=3, help='Retries of the consumer dispatch')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('-o', '--outputs', dest='outputs', type=str, nargs='+', default=['amqp'], choices=['amqp', 'file', 'stdout', 'socket'], help='Outputs of the records')
+    parser.add_argument('-ofp', '--output_file_path', dest='output_file_path', type=str, default='remotelogger.out', help='File of the file output')
+    parser.add_argument('-ofm', '--output_file_max_bytes', dest='output_file_max_bytes', type=int, default=104857600, help='Size (bytes) of the file output before rotation (0 to never rotate)')
+    parser.add_argument('-ofb', '--output_file_backups', dest='output_file_backups', type=int, default=5, help='Number of rotated files kept by the file output')
+    parser.add_argument('-osp', '--output_socket_path', dest='output_socket_path', type=str, default='', help='Unix socket of the socket output')
+    parser.add_argument('-ost', '--output_socket_type', dest='output_socket_type', type=str, default='datagram', choices=['datagram', 'stream'], help='Socket type of the socket output')
+    parser.add_argument('-obb', '--output_buffer_bytes', dest='output_buffer_bytes', type=int, default=65536, help='Bytes buffered by the file, stdout and socket outputs before a write')
+    parser.add_argument('-pb', '--publisher', dest='publisher', type=str, default='blocking', choices=['blocking', 'async'], help='Publisher backend')
+    parser.add_argument('-pw', '--publisher_window', dest='publisher_window', type=int, default=1000, help='Maximum number of unconfirmed messages (async publisher)')
+    parser.add_argument('-cps', '--channel_pool_size', dest='channel_pool_size', type=int, default=4, help='Maximum number of channels shared by the destinations (blocking publisher)')
+    parser.add_argument('-pl', '--priority_lanes', dest='priority_lanes', help='Publish records of higher severity first', action='store_true')
+    parser.add_argument('-plw', '--priority_weights', dest='priority_weights', type=int, nargs='+', default=[1, 2, 4, 8], help='Weights of the priority lanes, lowest lane first')
+    parser.add_argument('-ap', '--amqp_priority', dest='amqp_priority', help='Declare priority queues and send the lane as message priority', action='store_true')
+    parser.add_argument('-pr', '--publisher_max_retries', dest='publisher_max_retries', type=int, default=5, help='Maximum retries of a rejected message (async publisher)')
+    parser.add_argument('-bs', '--batch_size', dest='batch_size', type=int, default=1, help='Maximum number of messages per batch')
+    parser.add_argument('-bl', '--batch_linger', dest='batch_linger', type=int, default=100, help='Maximum time (ms) a batch waits before being sent')
+    parser.add_argument('-bmb', '--batch_max_bytes', dest='batch_max_bytes', type=int, default=0, help='Maximum size (bytes) of a batch')
+    parser.add_argument('-bf', '--batch_format', dest='batch_format', type=str, default='json', choices=['json', 'ndjson'], help='Batch format')
+    parser.add_argument('-je', '--json_encoder', dest='json_encoder', type=str, default='json', choices=['json', 'ujson', 'orjson', 'auto'], help='JSON encoder')
+    parser.add_argument('-mf', '--message_format', dest='message_format', type=str, default='json', choices=['json', 'msgpack'], help='Message format')
+    parser.add_argument('-cz', '--compression', dest='compression', type=str, default='none', choices=['none', 'gzip', 'zstd'], help='Message compression')
+    parser.add_argument('-czl', '--compression_level', dest='compression_level', type=int, default=None, help='Compression level (default of the codec if not set)')
+    parser.add_argument('-czm', '--compression_min_bytes', dest='compression_min_bytes', type=int, default=1024, help='Minimum size (bytes) of a compressed message')
+    parser.add_argument('-rcb', '--read_chunk_bytes', dest='read_chunk_bytes', type=int, default=65536, help='Size of every read from a log file')
+    parser.add_argument('-rbb', '--read_budget_bytes', dest='read_budget_bytes', type=int, default=4194304, help='Maximum bytes read from a log file before serving other files')
+    parser.add_argument('-wf', '--watch_filter', dest='watch_filter', help='Reload the filter file when it changes', action='store_true')
+    parser.add_argument('-wit', '--watch_idle_timeout', dest='watch_idle_timeout', type=int, default=300, help='Seconds before forgetting a closed or deleted file')
+    parser.add_argument('-pmi', '--poll_min_interval', dest='poll_min_interval', type=float, default=0.5, help='Seconds between polls of an active file')
+    parser.add_argument('-pma', '--poll_max_interval', dest='poll_max_interval', type=float, default=30, help='Maximum seconds between polls of an idle file')
+    parser.add_argument('-cp', '--checkpoint_path', dest='checkpoint_path', type=str, default='remotelogger.offsets', help='Offsets checkpoint file (empty to disable)')
+    parser.add_argument('-ci', '--checkpoint_interval', dest='checkpoint_interval', type=int, default=5, help='Seconds between checkpoints')
+    parser.add_argument('-spp', '--spool_path', dest='spool_path', type=str, default='remotelogger.spool', help='Spool directory for undelivered messages (empty to disable)')
+    parser.add_argument('-sps', '--spool_segment_bytes', dest='spool_segment_bytes', type=int, default=16777216, help='Spool segment size (bytes)')
+    parser.add_argument('-spm', '--spool_max_bytes', dest='spool_max_bytes', type=int, default=1073741824, help='Maximum spool size (bytes)')
+    parser.add_argument('-spf', '--spool_fsync', dest='spool_fsync', type=str, default='segment', choices=['always', 'segment', 'never'], help='Spool fsync policy')
+    parser.add_argument('-si', '--stats_interval', dest='stats_interval', type=int, default=60, help='Seconds between stats log lines (0 to disable)')
+    parser.add_argument('-ma', '--metrics_address', dest='metrics_address', type=str, default='127.0.0.1', help='Metrics HTTP endpoint address')
+    parser.add_argument('-mp', '--metrics_port', dest='metrics_port', type=int, default=0, help='Metrics HTTP endpoint port (0 to disable)')
+    parser.add_argument('-ms', '--metrics_socket', dest='metrics_socket', type=str, default='', help='Metrics unix socket path (empty to disable)')
+    parser.add_argument('-sqs', '--sender_queue_size', dest='sender_queue_size', type=int, default=10000, help='Sender queue size (0 to publish synchronously)')
+    parser.add_argument('-so', '--sender_overflow', dest='sender_overflow', type=str, default='block', choices=['block', 'drop_oldest', 'spill'], help='Sender queue overflow policy')
+    parser.add_argument('-ssp', '--sender_spill_path', dest='sender_spill_path', type=str, default='remotelogger.spill', help='Sender spill directory')
     try:
         args = parser.parse_args()
         if args.debug:
@@ -82,6 +332,51 @@ def parse():
                 args.config['exchange_type'] = args.exchange_type
                 args.config['heartbeat'] = args.heartbeat
                 args.config['blocked_connection_timeout'] = args.blocked_connection_timeout
+                args.config['dispatch_timeout'] = args.dispatch_timeout
+                args.config['dispatch_retries'] = args.dispatch_retries
+                args.config['workers'] = args.workers
+                args.config['outputs'] = args.outputs
+                args.config['output_file_path'] = args.output_file_path
+                args.config['output_file_max_bytes'] = args.output_file_max_bytes
+                args.config['output_file_backups'] = args.output_file_backups
+                args.config['output_socket_path'] = args.output_socket_path
+                args.config['output_socket_type'] = args.output_socket_type
+                args.config['output_buffer_bytes'] = args.output_buffer_bytes
+                args.config['publisher'] = args.publisher
+                args.config['publisher_window'] = args.publisher_window
+                args.config['publisher_max_retries'] = args.publisher_max_retries
+                args.config['channel_pool_size'] = args.channel_pool_size
+                args.config['priority_lanes'] = args.priority_lanes
+                args.config['priority_weights'] = args.priority_weights
+                args.config['amqp_priority'] = args.amqp_priority
+                args.config['batch_size'] = args.batch_size
+                args.config['batch_linger'] = args.batch_linger
+                args.config['batch_max_bytes'] = args.batch_max_bytes
+                args.config['batch_format'] = args.batch_format
+                args.config['json_encoder'] = args.json_encoder
+                args.config['message_format'] = args.message_format
+                args.config['compression'] = args.compression
+                args.config['compression_level'] = args.compression_level
+                args.config['compression_min_bytes'] = args.compression_min_bytes
+                args.config['read_chunk_bytes'] = args.read_chunk_bytes
+                args.config['read_budget_bytes'] = args.read_budget_bytes
+                args.config['watch_filter'] = args.watch_filter
+                args.config['watch_idle_timeout'] = args.watch_idle_timeout
+                args.config['poll_min_interval'] = args.poll_min_interval
+                args.config['poll_max_interval'] = args.poll_max_interval
+                args.config['checkpoint_path'] = args.checkpoint_path
+                args.config['checkpoint_interval'] = args.checkpoint_interval
+                args.config['spool_path'] = args.spool_path
+                args.config['spool_segment_bytes'] = args.spool_segment_bytes
+                args.config['spool_max_bytes'] = args.spool_max_bytes
+                args.config['spool_fsync'] = args.spool_fsync
+                args.config['stats_interval'] = args.stats_interval
+                args.config['metrics_address'] = args.metrics_address
+                args.config['metrics_port'] = args.metrics_port
+                args.config['metrics_socket'] = args.metrics_socket
+                args.config['sender_queue_size'] = args.sender_queue_size
+                args.config['sender_overflow'] = args.sender_overflow
+                args.config['sender_spill_path'] = args.sender_spill_path
             else:
                 parser.error("Wrong number of arguments!")
     except:
@@ -99,7 +394,7 @@ if __name__ == "__main__":
     else:
         with open(args.config, 'r') as stream:
             try:
-                config = yaml.load(stream)
+                config = yaml.safe_load(stream)
                 logging.debug("Config file: {0} {1}".format(os.linesep, yaml.dump(config)))
                 # validate(config_yaml, schema)
             except Exception as e:
@@ -107,27 +402,33 @@ if __name__ == "__main__":
                 kill()
                 sys.exit(0)
 
-    publisher = LogPublisher(config, logging)
-    publisher.start()
-    observer = Observer()
+    try:
+        filters_yaml = load(args.filter)
+    except Exception as e:
+        logging.error("[ERROR] Parsing FILTER file: {0} {1} Please, check the YAML format".format(e, os.linesep))
+        kill()
+        sys.exit(0)
+
+    if args.replay or args.bench:
+        replay(config, filters_yaml, args)
+        sys.exit(0)
 
-    with open(args.filter, 'r') as stream:
+    signal.signal(signal.SIGHUP, reload)
+    if config.get('watch_filter', False):
+        watch(os.path.abspath(args.filter))
+
+    if config.get('workers', 1) > 1:
+        supervisor = LogSupervisor(worker, filters_yaml, config['workers'])
+        supervisor.start()
+        supervisor.supervise()
+    else:
         try:
-            filters_yaml = yaml.load(stream)
-            logging.debug("Filter file: {0} {1}".format(os.linesep, yaml.dump(filters_yaml)))
-            # validate(filters_yaml, schema)
-            for rule in filters_yaml:
-                filters = []
-                for afilter in rule['filters']:
-                    filters.append(LogFilter(afilter))
-                log(os.path.abspath(rule['filename']), filters, observer, publisher)  
+            run(config, filters_yaml)
         except Exception as e:
-            logging.error("[ERROR] Parsing FILTER file: {0} {1} Please, check the YAML format".format(e, os.linesep))
+            logging.error("[ERROR] Starting remotelogger: {0}".format(e))
             kill()
             sys.exit(0)
 
-    observer.start()
-
     try:
         while True:
             time.sleep(1)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os, sys, json, shutil, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+from LogFilter import LogFilter
+from LogBuffer import LogBuffer
+from LogFileHandler import LogFileHandler
+from LogEventHandler import LogEventHandler
+
+
+def buffer(**kwargs):
+    return LogBuffer([LogFilter({'pattern': '.*'})], **kwargs)
+
+def strings(logbuffer):
+    records = []
+    while not logbuffer.empty():
+        records.append(json.loads(logbuffer.pop())['string'])
+    return records
+
+
+class LogBufferOversizedTest(unittest.TestCase):
+
+    def test_split_at_character_boundary(self):
+        logbuffer = buffer(max_line_length=10)
+        logbuffer.push(u'aaaaaaaaaébb\nnext\n'.encode('utf-8'))
+        self.assertEqual(strings(logbuffer), [u'aaaaaaaaa', u'ébb', u'next'])
+
+    def test_split_keeps_inner_spaces(self):
+        logbuffer = buffer(max_line_length=5)
+        logbuffer.push(b'abcd      efgh\n')
+        self.assertEqual(strings(logbuffer), [u'abcd ', u'     ', u'efgh'])
+
+    def test_truncate_at_character_boundary(self):
+        logbuffer = buffer(max_line_length=4, max_line_policy='truncate')
+        logbuffer.push(u'abc€ rest\nnext\n'.encode('utf-8'))
+        self.assertEqual(strings(logbuffer), [u'abc', u'next'])
+
+    def test_split_latin1(self):
+        # Every byte is a character
+        logbuffer = buffer(max_line_length=3, encoding='latin-1')
+        logbuffer.push(u'aéébb\n'.encode('latin-1'))
+        self.assertEqual(strings(logbuffer), [u'aéé', u'bb'])
+
+
+class Checkpoints(object):
+
+    def __init__(self):
+        self.offsets = []
+
+    def resume(self, path, stat):
+        return 0
+
+    def update(self, path, stat, offset):
+        self.offsets.append(offset)
+
+
+class Sink(object):
+
+    def __init__(self):
+        self.records = []
+
+    def send(self, record):
+        self.records.append(json.loads(record)['string'])
+
+    def mark(self, callback):
+        callback()
+
+
+class EventQueue(list):
+
+    def put(self, item):
+        self.append(item)
+
+
+class Observer(object):
+
+    def __init__(self):
+        self.event_queue = EventQueue()
+
+    def schedule(self, handler, path, recursive=False):
+        return (path, recursive)
+
+    def unschedule(self, watch):
+        pass
+
+
+class LogBufferMultilineTest(unittest.TestCase):
+
+    def test_start_pattern(self):
+        logbuffer = buffer(multiline_start='^[0-9]{4}-')
+        logbuffer.push(b'2024-1 failed\n  at one\n\n  at two\n2024-2 done\n')
+        self.assertEqual(strings(logbuffer), [u'2024-1 failed\n  at one\n\n  at two'])
+        self.assertTrue(logbuffer.holding())
+        logbuffer.flush()
+        self.assertEqual(strings(logbuffer), [u'2024-2 done'])
+
+    def test_continue_pattern(self):
+        logbuffer = buffer(multiline_continue='^\\s')
+        logbuffer.push(b'  orphan\nError\n  at one\nNext\n')
+        self.assertEqual(strings(logbuffer), [u'  orphan', u'Error\n  at one'])
+        logbuffer.flush()
+        self.assertEqual(strings(logbuffer), [u'Next'])
+
+    def test_start_and_continue_patterns(self):
+        self.assertRaises(ValueError, buffer, multiline_start='^E', multiline_continue='^\\s')
+
+    def test_max_lines(self):
+        logbuffer = buffer(multiline_continue='^\\s', multiline_max_lines=2)
+        logbuffer.push(b'Error\n 1\n 2\n 3\n')
+        logbuffer.flush()
+        self.assertEqual(strings(logbuffer), [u'Error\n 1', u' 2\n 3'])
+
+    def test_max_bytes(self):
+        logbuffer = buffer(multiline_continue='^\\s', multiline_max_bytes=10)
+        logbuffer.push(b'Error\n 123\n 12345678\n 9\n')
+        logbuffer.flush()
+        self.assertEqual(strings(logbuffer), [u'Error\n 123', u' 12345678', u' 9'])
+
+    def test_timeout(self):
+        logbuffer = buffer(multiline_continue='^\\s', multiline_timeout=60)
+        logbuffer.push(b'Error\n  at one\n')
+        logbuffer.expire()
+        self.assertEqual(strings(logbuffer), [])
+        self.assertTrue(59 < logbuffer.deadline() <= 60)
+        # No line was added for multiline_timeout
+        logbuffer.record_updated -= 60
+        self.assertEqual(logbuffer.deadline(), 0)
+        logbuffer.expire()
+        self.assertEqual(strings(logbuffer), [u'Error\n  at one'])
+        self.assertFalse(logbuffer.holding())
+        self.assertEqual(logbuffer.deadline(), None)
+
+    def test_pending(self):
+        logbuffer = buffer(multiline_continue='^\\s')
+        logbuffer.push(b'Error\n  at one\npart')
+        self.assertEqual(logbuffer.pending(), len(b'Error\n  at one\npart'))
+        logbuffer.push(b'ial\n')
+        # The partial line completed the record: only itself is held
+        self.assertEqual(strings(logbuffer), [u'Error\n  at one'])
+        self.assertEqual(logbuffer.pending(), len(b'partial\n'))
+
+
+class LogFileMultilineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'job.log')
+        self.sink = Sink()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, data):
+        with open(self.path, 'ab') as stream:
+            stream.write(data)
+
+    def test_checkpoint_of_held_record(self):
+        # A restart resumes at the first line of the held record
+        self.write(b'Error\n  at one\n')
+        checkpoints = Checkpoints()
+        file = LogFileHandler(self.path, [LogFilter({'pattern': '.*'})], checkpoints, multiline_continue='^\\s')
+        file.tail()
+        file.checkpoint(self.sink)
+        self.write(b'  at two\nNext\npar')
+        file.tail()
+        file.checkpoint(self.sink)
+        file.get_buffer().flush()
+        file.checkpoint(self.sink)
+        file.close()
+        self.assertEqual(checkpoints.offsets, [0, len(b'Error\n  at one\n  at two\n'), os.path.getsize(self.path)])
+
+    def test_timer_releases_held_record(self):
+        observer = Observer()
+        handler = LogEventHandler(observer, self.sink)
+        self.write(b'Error\n  at one\n')
+        handler.apply([(self.path, [{'pattern': '.*'}], {'poll': False, 'multiline_continue': '^\\s', 'multiline_timeout': 0.05})])
+        file = handler.files[self.path]
+        self.assertEqual(self.sink.records, [])
+        self.assertTrue(file.timer is not None)
+        file.timer.join(5)
+        # The timer queued an event, handled like the ones of the watches
+        event, watch = observer.event_queue.pop()
+        self.assertTrue(file.timer is None)
+        handler.dispatch(event)
+        self.assertEqual(self.sink.records, [u'Error\n  at one'])
+        file.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
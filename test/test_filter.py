@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os, sys, json, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+from LogFilter import LogFilter, LogFilterSet
+
+
+LINES = [u'WARN disk', u'warn disk', u'ERROR disk', u'error disk', u'Error dïsk', u'WARN dïsk', u'INFO disk', u'café au lait']
+
+def filter_set(filters):
+    return LogFilterSet([LogFilter(dict(afilter)) for afilter in filters])
+
+
+class LogFilterSetTest(unittest.TestCase):
+
+    def assertSequential(self, filters):
+        # The combined and bytes engines give the result of trying every
+        # filter in turn
+        filters = filter_set(filters)
+        for line in LINES:
+            self.assertEqual(filters.apply(line.encode('utf-8')), filters.apply_sequential(line), line)
+
+    def test_inline_flags_are_not_combined(self):
+        self.assertSequential([{'pattern': '(?i)^error'}, {'pattern': '^warn', 'severity': 'WARNING'}])
+        self.assertSequential([{'pattern': '^warn', 'severity': 'WARNING'}, {'pattern': '(?i)^error'}, {'pattern': '^INFO'}])
+
+    def test_str_only_patterns(self):
+        # ASCII patterns that are not valid bytes patterns
+        filters = [{'pattern': '^caf\\u00e9', 'severity': 'INFO'}, {'pattern': '(?u)^WARN', 'severity': 'WARNING'}]
+        self.assertSequential(filters)
+
+
+class LogFieldsTest(unittest.TestCase):
+
+    def test_non_finite_floats(self):
+        afilter = LogFilter({'pattern': '(?P<value>\\S+)', 'fields': {'value': 'float'}})
+        for value, converted in [('1.5', 1.5), ('nan', None), ('inf', None), ('-Infinity', None), ('x', None)]:
+            record = afilter.serialize(value, None, afilter.regex.match(value))
+            # Strict JSON: NaN and Infinity are refused
+            self.assertEqual(json.loads(record, parse_constant=self.fail)['value'], converted)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+import os, sys, shutil, logging, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+try:
+    from pika.exceptions import ChannelClosed
+except ImportError:
+    raise unittest.SkipTest('pika is not installed')
+from LogPublisher import LogPublisher, LogDispatchException
+from LogFilter import route_of
+
+
+CONFIG = {'host': 'localhost', 'port': 5672, 'user': 'guest', 'pass': 'guest', 'exchange': 'exchange', 'exchange_type': 'direct',
+          'queue': 'queue', 'routing_key': 'routing_key', 'heartbeat': 0, 'blocked_connection_timeout': 300}
+
+
+class Channel(object):
+    # The calls of LogPublisher to a pika BlockingChannel
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.is_open    = True
+
+    def ignore(self, *args, **kwargs):
+        return None
+
+    confirm_delivery = add_on_cancel_callback = add_on_return_callback = ignore
+    exchange_delete = queue_declare = queue_delete = queue_bind = queue_unbind = ignore
+
+    def exchange_declare(self, exchange, exchange_type):
+        # The exchange "refused" exists with another type
+        if exchange == 'refused':
+            self.is_open = False
+            raise ChannelClosed(406, 'PRECONDITION_FAILED')
+
+    def basic_publish(self, **kwargs):
+        if not self.is_open:
+            raise ChannelClosed(406, 'PRECONDITION_FAILED')
+        self.connection.published.append((kwargs['exchange'], kwargs['body']))
+        return True
+
+    def close(self):
+        self.is_open = False
+
+
+class Connection(object):
+    # A pika BlockingConnection that reads Connection.Unblocked from the
+    # server once unblocked is set
+
+    def __init__(self):
+        self.is_open   = True
+        self.published = []
+        self.events    = 0
+        self.unblocked = False
+
+    def add_on_connection_blocked_callback(self, callback):
+        self.on_blocked = callback
+
+    def add_on_connection_unblocked_callback(self, callback):
+        self.on_unblocked = callback
+
+    def channel(self):
+        return Channel(self)
+
+    def process_data_events(self, time_limit=0):
+        self.events += 1
+        if self.unblocked:
+            self.unblocked = False
+            self.on_unblocked(None)
+
+    def close(self):
+        self.is_open = False
+
+
+class Publisher(LogPublisher):
+
+    def dispatch(self, destination=None):
+        return None
+
+    def connect(self):
+        self._connection = Connection()
+        self._connection.add_on_connection_blocked_callback(self.connection_blocked_callback)
+        self._connection.add_on_connection_unblocked_callback(self.connection_unblocked_callback)
+
+
+class LogPublisherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.publisher = self.start()
+
+    def start(self, routes=()):
+        publisher = Publisher(dict(CONFIG, spool_path=os.path.join(self.directory, 'spool')), logging, False, routes)
+        publisher.start()
+        return publisher
+
+    def tearDown(self):
+        self.publisher.stop()
+        shutil.rmtree(self.directory)
+
+    def test_blocked_connection_drains_spool_once_unblocked(self):
+        connection = self.publisher._connection
+        connection.on_blocked(None)
+        for index in range(5):
+            self.publisher.send('{"index": %i}' % index)
+        self.assertEqual(connection.published, [])
+        self.assertEqual(len(self.publisher._spool), 5)
+        # The connection is read while blocked
+        self.assertTrue(connection.events > 0)
+        connection.unblocked = True
+        self.publisher.tick()
+        self.assertFalse(self.publisher._blocked)
+        self.assertTrue(self.publisher._spool.empty())
+        self.publisher.send('{"index": 5}')
+        self.assertEqual(connection.published, [('exchange', '{"index": %i}' % index) for index in range(6)])
+
+    def test_refused_destination_does_not_block_spool(self):
+        refused, other = route_of({'exchange': 'refused'}), route_of({'exchange': 'other'})
+        connection = self.publisher._connection
+        connection.on_blocked(None)
+        self.publisher.send((refused, '{"index": 0}', 0))
+        self.publisher.send((other, '{"index": 1}', 0))
+        self.publisher.send('{"index": 2}')
+        connection.unblocked = True
+        self.publisher.tick()
+        self.assertTrue(self.publisher._spool.empty())
+        self.assertEqual(connection.published, [('other', '{"index": 1}'), ('exchange', '{"index": 2}')])
+        self.publisher.send((refused, '{"index": 3}', 0))
+        self.assertEqual(len(connection.published), 2)
+
+    def test_refused_destination_fails_at_startup(self):
+        self.assertRaises(LogDispatchException, self.start, [route_of({'exchange': 'refused'})])
+
+
+if __name__ == "__main__":
+    unittest.main()
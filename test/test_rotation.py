@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+import os, sys, json, shutil, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+from watchdog.events import FileCreatedEvent, FileDeletedEvent, FileModifiedEvent, FileMovedEvent
+from LogEventHandler import LogEventHandler
+
+
+class Observer(object):
+    # The calls of LogEventHandler to a watchdog Observer
+
+    def __init__(self):
+        self.event_queue = []
+
+    def schedule(self, handler, path, recursive=False):
+        return (path, recursive)
+
+    def unschedule(self, watch):
+        pass
+
+    def is_alive(self):
+        return False
+
+
+class Sink(object):
+
+    def __init__(self):
+        self.records = []
+
+    def send(self, record):
+        self.records.append(json.loads(record)['string'])
+
+    def mark(self, callback):
+        callback()
+
+
+class LogRotationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'job.log')
+        self.sink = Sink()
+        self.handler = None
+
+    def tearDown(self):
+        for file in self.handler.files.values():
+            if file is not None:
+                file.close()
+        shutil.rmtree(self.directory)
+
+    def watch(self, pattern):
+        self.handler = LogEventHandler(Observer(), self.sink)
+        self.handler.apply([(pattern, [{'pattern': '.*'}], {'poll': False})])
+
+    def write(self, path, lines, newline=True):
+        with open(path, 'ab') as stream:
+            stream.write(('\n'.join(lines) + ('\n' if newline else '')).encode('utf-8'))
+
+    def lines(self, start, stop):
+        return ['line %i' % index for index in range(start, stop)]
+
+    def test_rename_and_create(self):
+        self.write(self.path, self.lines(0, 3))
+        self.watch(self.path)
+        self.write(self.path, self.lines(3, 5), newline=False)
+        os.rename(self.path, self.path + '.1')
+        self.write(self.path, self.lines(5, 7))
+        self.handler.dispatch(FileMovedEvent(self.path, self.path + '.1'))
+        self.handler.dispatch(FileCreatedEvent(self.path))
+        self.write(self.path, self.lines(7, 8))
+        self.handler.dispatch(FileModifiedEvent(self.path))
+        self.assertEqual(self.sink.records, self.lines(0, 8))
+
+    def test_rename_without_events(self):
+        # Only the next write to the new file is seen
+        self.write(self.path, self.lines(0, 3))
+        self.watch(self.path)
+        self.write(self.path, self.lines(3, 5))
+        os.rename(self.path, self.path + '.1')
+        self.write(self.path, self.lines(5, 7))
+        self.handler.dispatch(FileModifiedEvent(self.path))
+        self.handler.dispatch(FileModifiedEvent(self.path))
+        self.assertEqual(self.sink.records, self.lines(0, 7))
+
+    def test_copytruncate(self):
+        self.write(self.path, self.lines(0, 5))
+        self.watch(self.path)
+        with open(self.path, 'r+b') as stream:
+            stream.truncate(0)
+        self.write(self.path, self.lines(5, 7))
+        self.handler.dispatch(FileModifiedEvent(self.path))
+        self.write(self.path, self.lines(7, 8))
+        self.handler.dispatch(FileModifiedEvent(self.path))
+        self.assertEqual(self.sink.records, self.lines(0, 8))
+
+    def test_delete_with_unread_data(self):
+        self.write(self.path, self.lines(0, 3))
+        self.watch(self.path)
+        self.write(self.path, self.lines(3, 5))
+        os.remove(self.path)
+        self.handler.dispatch(FileDeletedEvent(self.path))
+        self.assertEqual(self.sink.records, self.lines(0, 5))
+        self.write(self.path, self.lines(5, 7))
+        self.handler.dispatch(FileCreatedEvent(self.path))
+        self.assertEqual(self.sink.records, self.lines(0, 7))
+
+    def test_rename_to_a_followed_name(self):
+        # The rotated file is still matched by the glob: it is followed
+        # under its new name, and the new file from the start
+        self.write(self.path, self.lines(0, 3))
+        self.watch(os.path.join(self.directory, 'job*.log'))
+        rotated = os.path.join(self.directory, 'job.1.log')
+        self.write(self.path, self.lines(3, 5))
+        os.rename(self.path, rotated)
+        self.handler.dispatch(FileMovedEvent(self.path, rotated))
+        self.write(rotated, self.lines(5, 6))
+        self.handler.dispatch(FileModifiedEvent(rotated))
+        self.write(self.path, self.lines(6, 8))
+        self.handler.dispatch(FileCreatedEvent(self.path))
+        self.assertEqual(self.sink.records, self.lines(0, 8))
+
+
+if __name__ == "__main__":
+    unittest.main()
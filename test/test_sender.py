@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+import os, sys, logging, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+from LogSender import LogLaneQueue, LogSender
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+
+def record(lane, index):
+    return (None, '{"lane": %i, "index": %i}' % (lane, index), lane)
+
+def lanes(queue, count):
+    return [queue.get_nowait()[2] for index in range(count)]
+
+
+class LogLaneQueueTest(unittest.TestCase):
+
+    def fill(self, queue, lane, count):
+        for index in range(count):
+            queue.put(record(lane, index))
+
+    def test_weighted_order(self):
+        queue = LogLaneQueue(0, (1, 2, 4, 8))
+        for lane in range(4):
+            self.fill(queue, lane, 10)
+        order = lanes(queue, 15)
+        # Higher lanes first on ties
+        self.assertEqual(order, [3, 2, 1, 0, 3, 3, 2, 3, 3, 2, 1, 3, 3, 2, 3])
+        self.assertEqual([order.count(lane) for lane in range(4)], [1, 2, 4, 8])
+
+    def test_fifo_within_lane(self):
+        queue = LogLaneQueue(0, (1, 2))
+        self.fill(queue, 1, 3)
+        self.assertEqual([queue.get_nowait()[1] for index in range(3)], [record(1, index)[1] for index in range(3)])
+
+    def test_low_lane_not_starved(self):
+        queue = LogLaneQueue(0, (1, 2, 4, 8))
+        self.fill(queue, 3, 100)
+        self.fill(queue, 0, 10)
+        order = lanes(queue, 45)
+        self.assertEqual(order.count(0), 5)
+
+    def test_idle_lane_saves_no_turns(self):
+        queue = LogLaneQueue(0, (1, 2, 4, 8))
+        self.fill(queue, 3, 100)
+        self.assertEqual(lanes(queue, 16), [3] * 16)
+        self.fill(queue, 0, 10)
+        self.assertEqual(lanes(queue, 9), [0] + [3] * 8)
+
+    def test_lanes_above_weights(self):
+        queue = LogLaneQueue(0, (1, 2))
+        queue.put(record(5, 0))
+        self.assertEqual(queue.get_nowait(), record(5, 0))
+
+    def test_discard_lowest_lane_first(self):
+        queue = LogLaneQueue(0, (1, 2, 4, 8))
+        queue.put(record(2, 0))
+        queue.put(record(0, 0))
+        queue.put(record(1, 0))
+        queue.put(record(0, 1))
+        queue.discard()
+        queue.discard()
+        queue.discard()
+        self.assertEqual(queue.qsize(), 1)
+        self.assertEqual(queue.get_nowait(), record(2, 0))
+        self.assertRaises(Empty, queue.discard)
+
+    def test_marks(self):
+        queue = LogLaneQueue(0, (1, 2, 4, 8))
+        queue.put(record(0, 0))
+        queue.put(record(3, 0))
+        queue.mark('first')
+        queue.put(record(0, 1))
+        queue.mark('second')
+        self.assertEqual(queue.released(), [])
+        queue.get_nowait()
+        self.assertEqual(queue.released(), [])
+        # Discarded records are done with too
+        queue.discard()
+        self.assertEqual(queue.released(), ['first'])
+        queue.get_nowait()
+        self.assertEqual(queue.released(), ['second'])
+
+
+class LogSenderOverflowTest(unittest.TestCase):
+
+    def test_drop_oldest_of_lowest_lane(self):
+        sender = LogSender(None, {'priority_lanes': True, 'sender_queue_size': 3, 'sender_overflow': 'drop_oldest'}, logging)
+        for message in [record(1, 0), record(0, 0), record(2, 0), record(3, 0), record(3, 1)]:
+            sender.send(message)
+        self.assertEqual(sender.dropped(), 2)
+        self.assertEqual(sorted(lanes(sender._queue, 3)), [2, 3, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+import os, sys, socket, shutil, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+import LogSink
+from LogSink import LogBatchSink, LogFileSink, LogSocketSink, LogFanout, vectored
+from LogMetrics import DROPPED
+
+
+def data(buffers):
+    return b''.join(buffer if isinstance(buffer, bytes) else buffer.tobytes() for buffer in buffers)
+
+
+class Writer(object):
+    # A writev writing at most limit bytes per call
+
+    def __init__(self, limit):
+        self.limit  = limit
+        self.data   = b''
+        self.chunks = []
+
+    def __call__(self, chunk):
+        self.chunks.append(len(chunk))
+        written = data(chunk)[:self.limit]
+        self.data += written
+        return len(written)
+
+
+class MemorySink(LogBatchSink):
+
+    def __init__(self, **options):
+        super(MemorySink, self).__init__(flusher=False, **options)
+        self.data    = b''
+        self.failing = False
+        self.starts  = 0
+
+    def open(self):
+        self.starts += 1
+
+    def write(self, buffers, size):
+        if self.failing:
+            raise IOError('failing')
+        self.data += data(buffers)
+
+
+class BrokenSink(MemorySink):
+
+    def send(self, message):
+        if self.failing:
+            raise RuntimeError('failing')
+        super(BrokenSink, self).send(message)
+
+
+class VectoredTest(unittest.TestCase):
+
+    def setUp(self):
+        self.iov_max = LogSink.IOV_MAX
+
+    def tearDown(self):
+        LogSink.IOV_MAX = self.iov_max
+
+    def test_partial_writes(self):
+        buffers = [b'abc', b'\n', b'defghij', b'\n', b'', b'k', b'\n']
+        writer = Writer(2)
+        vectored(writer, buffers)
+        self.assertEqual(writer.data, data(buffers))
+
+    def test_iov_max(self):
+        LogSink.IOV_MAX = 3
+        buffers = [b'%i\n' % index if bytes is str else ('%i\n' % index).encode('ascii') for index in range(10)]
+        writer = Writer(100)
+        vectored(writer, buffers)
+        self.assertEqual(writer.data, data(buffers))
+        self.assertEqual(writer.chunks, [3, 3, 3, 1])
+
+    def test_partial_writes_over_iov_max(self):
+        LogSink.IOV_MAX = 4
+        buffers = [b'record %i' % index if bytes is str else ('record %i' % index).encode('ascii') for index in range(20)]
+        writer = Writer(5)
+        vectored(writer, buffers)
+        self.assertEqual(writer.data, data(buffers))
+        self.assertTrue(max(writer.chunks) <= 4)
+
+
+class LogFileSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'records')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read(self, path):
+        with open(path, 'rb') as stream:
+            return stream.read()
+
+    def test_write(self):
+        sink = LogFileSink(self.path, flusher=False)
+        sink.start()
+        sink.send('{"a": 1}')
+        sink.send((None, b'{"b": 2}', 3))
+        self.assertEqual(self.read(self.path), b'')
+        sink.stop()
+        self.assertEqual(self.read(self.path), b'{"a": 1}\n{"b": 2}\n')
+
+    def test_rotation(self):
+        # Every record is written on its own and fills half of max_bytes
+        sink = LogFileSink(self.path, max_bytes=18, backups=2, buffer_bytes=1, flusher=False)
+        sink.start()
+        for index in range(7):
+            sink.send('record %i' % index)
+        sink.stop()
+        self.assertEqual(self.read(self.path), b'record 6\n')
+        self.assertEqual(self.read(self.path + '.1'), b'record 4\nrecord 5\n')
+        self.assertEqual(self.read(self.path + '.2'), b'record 2\nrecord 3\n')
+        self.assertFalse(os.path.exists(self.path + '.3'))
+
+    def test_rotation_without_backups(self):
+        sink = LogFileSink(self.path, max_bytes=9, backups=0, buffer_bytes=1, flusher=False)
+        sink.start()
+        for index in range(3):
+            sink.send('record %i' % index)
+        sink.stop()
+        self.assertEqual(os.listdir(self.directory), ['records'])
+        self.assertEqual(self.read(self.path), b'record 2\n')
+
+    def test_reopen_appends(self):
+        with open(self.path, 'wb') as stream:
+            stream.write(b'old\n')
+        sink = LogFileSink(self.path, max_bytes=10, buffer_bytes=1, flusher=False)
+        sink.start()
+        sink.send('new')
+        sink.send('newer')
+        sink.stop()
+        self.assertEqual(self.read(self.path + '.1'), b'old\nnew\n')
+        self.assertEqual(self.read(self.path), b'newer\n')
+
+
+class LogSocketSinkTest(unittest.TestCase):
+
+    def setUp(self):
+        self.peer = None
+
+    def connect(self, socket_type, kind):
+        sink = LogSocketSink('<socketpair>', socket_type, flusher=False)
+        sink.socket, self.peer = socket.socketpair(socket.AF_UNIX, kind)
+        self.peer.settimeout(1)
+        return sink
+
+    def tearDown(self):
+        if self.peer is not None:
+            self.peer.close()
+
+    def test_datagram(self):
+        # A datagram per record, without separator
+        sink = self.connect('datagram', socket.SOCK_DGRAM)
+        sink.send('{"a": 1}')
+        sink.send('{"b": 2}')
+        sink.stop()
+        self.assertEqual([self.peer.recv(1024), self.peer.recv(1024)], [b'{"a": 1}', b'{"b": 2}'])
+
+    def test_stream(self):
+        sink = self.connect('stream', socket.SOCK_STREAM)
+        sink.send('{"a": 1}')
+        sink.send('{"b": 2}')
+        sink.stop()
+        self.assertEqual(self.peer.recv(1024), b'{"a": 1}\n{"b": 2}\n')
+
+    def test_socket_type(self):
+        self.assertRaises(ValueError, LogSocketSink, '<socket>', 'raw')
+
+
+class LogBatchSinkTest(unittest.TestCase):
+
+    def test_marks(self):
+        sink = MemorySink()
+        marks = []
+        sink.mark(lambda: marks.append('empty'))
+        self.assertEqual(marks, ['empty'])
+        sink.send('{"a": 1}')
+        sink.mark(lambda: marks.append('written'))
+        self.assertEqual(marks, ['empty'])
+        sink.flush()
+        self.assertEqual(marks, ['empty', 'written'])
+        self.assertEqual(sink.data, b'{"a": 1}\n')
+
+    def test_failed_write(self):
+        # The records are dropped, the marks released, and the output is
+        # opened again once retry_at passed
+        sink = MemorySink()
+        marks = []
+        sink.failing = True
+        dropped = DROPPED.total()
+        sink.send('{"a": 1}')
+        sink.mark(lambda: marks.append('dropped'))
+        sink.flush()
+        self.assertEqual(marks, ['dropped'])
+        self.assertEqual(DROPPED.total() - dropped, 1)
+        self.assertTrue(sink.failed)
+        sink.failing = False
+        sink.send('{"b": 2}')
+        sink.flush()
+        self.assertEqual(sink.data, b'')
+        sink.retry_at = 0
+        sink.send('{"c": 3}')
+        sink.flush()
+        self.assertFalse(sink.failed)
+        self.assertEqual(sink.starts, 1)
+        self.assertEqual(sink.data, b'{"c": 3}\n')
+
+
+class LogFanoutTest(unittest.TestCase):
+
+    def test_failing_sink(self):
+        good, broken = MemorySink(), BrokenSink()
+        fanout = LogFanout([broken, good], flusher=False)
+        fanout.start()
+        fanout.send('{"a": 1}')
+        broken.failing = True
+        fanout.send('{"b": 2}')
+        fanout.send('{"c": 3}')
+        fanout.flush()
+        self.assertEqual(good.data, b'{"a": 1}\n{"b": 2}\n{"c": 3}\n')
+        self.assertEqual(broken.data, b'')
+        self.assertTrue(fanout.failures[broken] is not None)
+        # Restarted once its delay passed, with the records it had buffered
+        broken.failing = False
+        fanout.failures[broken] = 0
+        fanout.send('{"d": 4}')
+        fanout.stop()
+        self.assertEqual(broken.starts, 2)
+        self.assertEqual(broken.data, b'{"a": 1}\n{"d": 4}\n')
+        self.assertEqual(good.data, b'{"a": 1}\n{"b": 2}\n{"c": 3}\n{"d": 4}\n')
+
+    def test_start_fails_with_every_sink(self):
+        class Unavailable(MemorySink):
+            def open(self):
+                raise IOError('unavailable')
+        fanout = LogFanout([Unavailable(), MemorySink()], flusher=False)
+        fanout.start()
+        fanout = LogFanout([Unavailable(), Unavailable()], flusher=False)
+        self.assertRaises(IOError, fanout.start)
+
+    def test_mark_countdown(self):
+        # The callback is called once every sink delivered the records
+        first, second, broken = MemorySink(), MemorySink(), BrokenSink()
+        fanout = LogFanout([first, second, broken], flusher=False)
+        fanout.start()
+        broken.failing = True
+        fanout.send('{"a": 1}')
+        marks = []
+        fanout.mark(lambda: marks.append('delivered'))
+        first.flush()
+        self.assertEqual(marks, [])
+        second.flush()
+        self.assertEqual(marks, ['delivered'])
+        fanout.mark(lambda: marks.append('nothing pending'))
+        self.assertEqual(marks, ['delivered', 'nothing pending'])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+import os, sys, json, shutil, tempfile, unittest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Logger'))
+from LogSpool import LogSpool, HEADER
+
+
+def record(index):
+    return '{"index": %i}' % index
+
+
+class LogSpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'spool')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def spool(self, **kwargs):
+        return LogSpool(self.path, **kwargs)
+
+    def fill(self, spool, indexes):
+        for index in indexes:
+            spool.append(record(index))
+
+    def drain(self, spool):
+        records = spool.peek(len(spool) + 1)
+        spool.commit()
+        return records
+
+    def test_recover_after_restart(self):
+        spool = self.spool()
+        self.fill(spool, range(5))
+        self.assertEqual(spool.peek(2), [record(0), record(1)])
+        spool.commit()
+        spool.close()
+        spool = self.spool()
+        self.assertEqual(len(spool), 3)
+        self.assertEqual(self.drain(spool), [record(index) for index in range(2, 5)])
+        self.assertTrue(spool.empty())
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_torn_segment_tail(self):
+        spool = self.spool()
+        self.fill(spool, range(3))
+        spool.close()
+        # A crash in the middle of the fourth record
+        segment = spool.segment_path(spool.segments[-1])
+        with open(segment, 'ab') as stream:
+            stream.write(HEADER.pack(100, 0) + b'{"ind')
+        size = os.path.getsize(segment)
+        spool = self.spool()
+        self.assertEqual(len(spool), 3)
+        self.assertEqual(os.path.getsize(segment), size - HEADER.size - 5)
+        self.fill(spool, [3])
+        self.assertEqual(self.drain(spool), [record(index) for index in range(4)])
+
+    def test_corrupted_record(self):
+        spool = self.spool()
+        self.fill(spool, range(3))
+        spool.close()
+        segment = spool.segment_path(spool.segments[-1])
+        with open(segment, 'r+b') as stream:
+            stream.seek(-2, os.SEEK_END)
+            stream.write(b'!!')
+        spool = self.spool()
+        self.assertEqual(self.drain(spool), [record(0), record(1)])
+
+    def test_stale_head(self):
+        spool = self.spool(segment_bytes=1)
+        self.fill(spool, range(3))
+        spool.peek(1)
+        spool.commit()
+        spool.close()
+        # The head file names a segment that was removed since: it is ignored
+        with open(spool.head_path(), 'w') as stream:
+            json.dump({'segment': 0, 'offset': 12345}, stream)
+        spool = self.spool()
+        self.assertEqual(self.drain(spool), [record(1), record(2)])
+
+    def test_unreadable_head(self):
+        spool = self.spool()
+        self.fill(spool, range(3))
+        spool.close()
+        with open(spool.head_path(), 'w') as stream:
+            stream.write('{"segment": ')
+        spool = self.spool()
+        self.assertEqual(self.drain(spool), [record(index) for index in range(3)])
+
+    def test_commit_across_segments(self):
+        spool = self.spool(segment_bytes=1)
+        self.fill(spool, range(5))
+        self.assertEqual(len(spool.segments), 5)
+        self.assertEqual(spool.peek(3), [record(index) for index in range(3)])
+        spool.commit()
+        self.assertEqual(len(spool), 2)
+        self.assertEqual(len(spool.segments), 3)
+        self.assertEqual(spool.size, sum(os.path.getsize(spool.segment_path(seq)) for seq in spool.segments) - spool.offset)
+        spool.close()
+        spool = self.spool(segment_bytes=1)
+        self.assertEqual(self.drain(spool), [record(3), record(4)])
+
+    def test_commit_without_peek(self):
+        spool = self.spool()
+        self.fill(spool, range(2))
+        spool.commit()
+        self.assertEqual(len(spool), 2)
+
+    def test_rollover_at_max_bytes(self):
+        size = HEADER.size + len(record(0))
+        spool = self.spool(segment_bytes=2 * size, max_bytes=5 * size)
+        self.fill(spool, range(10))
+        # The oldest segments are dropped, two records at a time
+        self.assertEqual(len(spool), 4)
+        self.assertTrue(spool.size <= 5 * size)
+        self.assertEqual(self.drain(spool), [record(index) for index in range(6, 10)])
+
+    def test_rollover_between_peek_and_commit(self):
+        size = HEADER.size + len(record(0))
+        spool = self.spool(segment_bytes=2 * size, max_bytes=5 * size)
+        self.fill(spool, range(4))
+        self.assertEqual(spool.peek(3), [record(index) for index in range(3)])
+        # Records 0 and 1 are dropped while 0 to 2 are being sent
+        self.fill(spool, range(4, 6))
+        spool.commit()
+        self.assertEqual(self.drain(spool), [record(index) for index in range(3, 6)])
+
+    def test_routed_records(self):
+        spool = self.spool()
+        spool.append(('jobs', record(0), 2))
+        spool.append((None, record(1), 1))
+        spool.append(record(2))
+        self.assertEqual(self.drain(spool), [('jobs', record(0), 2), (None, record(1), 1), record(2)])
+
+    def test_fsync_policy(self):
+        self.assertRaises(ValueError, self.spool, fsync='sometimes')
+
+
+if __name__ == "__main__":
+    unittest.main()